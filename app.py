@@ -1,38 +1,118 @@
 # app.py
+import os
 from flask import Flask, redirect, url_for
-from flask_migrate import Migrate
 from model.connection import db
-from model.model import init_db
+from config import DATABASE_URL, configure_database
 from dotenv import load_dotenv
 load_dotenv()
 
-app = Flask(__name__)
 
+def _from_flask_cli() -> bool:
+    # app caricata dalla CLI "flask ..." (db, seed, worker, pool, ...): Flask imposta questa variabile
+    return os.environ.get("FLASK_RUN_FROM_CLI") == "true"
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///proxmox-portal.db'
-app.config['SECRET_KEY'] = '12345'
 
-from blueprints.auth import login_manager, app as auth_blueprint
-from blueprints.admin import app as admin_blueprint
-from blueprints.user import app as user_blueprint
+def create_app(config: dict = None, services: bool = None) -> Flask:
 
-app.register_blueprint(auth_blueprint, url_prefix='/auth')
-app.register_blueprint(admin_blueprint, url_prefix='/admin')
-app.register_blueprint(user_blueprint, url_prefix='/user')
+    """
+    Crea e configura l'applicazione: blueprint, database, login, comandi CLI e /metrics.
+    Non tocca il DB (niente create_all né dati iniziali: vedi "flask seed") e non importa lo stack
+    di provisioning (proxmoxer, paramiko), caricato solo quando serve.
+    Flask-Migrate (e alembic) viene caricato solo dalla CLI, dove serve per i comandi "flask db".
+    :param config: impostazioni che sovrascrivono quelle di default (es. SQLALCHEMY_DATABASE_URI)
+    :param services: avvia i servizi in background (worker, pool, repliche dei template, fotografia
+        del cluster); di default sì, tranne quando l'app è caricata da un comando "flask ..."
+    Ritorna l'applicazione Flask
 
-db.init_app(app)
-login_manager.init_app(app)
+    """
 
+    app = Flask(__name__)
 
-migrate = Migrate(app, db)
-with app.app_context():
-    init_db()
+    app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
+    app.config['SECRET_KEY'] = '12345'
+    if config:
+        app.config.update(config)
 
-@app.route("/")
-def home():
-    return redirect(url_for('auth.login'))
+    from blueprints.auth import login_manager, app as auth_blueprint
+    from blueprints.admin import app as admin_blueprint
+    from blueprints.user import app as user_blueprint
+    from blueprints.api import app as api_blueprint
+
+    app.register_blueprint(auth_blueprint, url_prefix='/auth')
+    app.register_blueprint(admin_blueprint, url_prefix='/admin')
+    app.register_blueprint(user_blueprint, url_prefix='/user')
+    # API JSON versionata (richieste, credenziali, tipi di VM, utenti) con ETag
+    app.register_blueprint(api_blueprint, url_prefix='/api/v1')
+
+    # database (SQLite con WAL oppure Postgres) e pool di connessioni, vedi config.py
+    configure_database(app, db)
+    login_manager.init_app(app)
+
+    # migrazioni (comando "flask db"): alembic pesa all'import, i processi web e i worker non lo caricano
+    if _from_flask_cli():
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+    from model.model import seed_command
+    from utils.jobs import worker_command
+    from utils.warm_pool import pool_command
+    from utils.ipam import ipam_command
+    from utils.vmids import vmid_command
+    from utils.templates import template_command
+    from utils.metrics import metrics_view
+
+    # dati iniziali (ruoli, admin, tipi di VM): comando "flask seed"
+    app.cli.add_command(seed_command)
+    # worker di provisioning in un processo separato: comando "flask worker"
+    app.cli.add_command(worker_command)
+    # pool di container pronti per tipo di VM: comando "flask pool"
+    app.cli.add_command(pool_command)
+    # gestione delle subnet e dei lease IP: comando "flask ipam"
+    app.cli.add_command(ipam_command)
+    # prenotazione dei vmid dei nuovi container: comando "flask vmid"
+    app.cli.add_command(vmid_command)
+    # repliche dei template su ogni nodo: comando "flask template"
+    app.cli.add_command(template_command)
+
+    # metriche Prometheus del processo (tempi dei passi del provisioning, chiamate Proxmox/SSH)
+    app.add_url_rule("/metrics", view_func=metrics_view)
+
+    @app.route("/")
+    def home():
+        return redirect(url_for('auth.login'))
+
+    if services is None:
+        services = not _from_flask_cli()
+    if services:
+        start_services(app)
+
+    return app
+
+
+def start_services(app: Flask) -> None:
+
+    """
+    Avvia i servizi in background del processo web, ognuno se abilitato dalla sua variabile:
+    worker di provisioning (PORTAL_WORKERS), pool di container pronti (PORTAL_POOL_MANAGER),
+    repliche dei template (PORTAL_TEMPLATE_SYNC) e fotografia del cluster (PROXMOX_SNAPSHOT_REFRESH)
+    Rifiuta di avviarli su un DB creato dalle versioni precedenti e non ancora migrato (check_schema)
+
+    """
+
+    from model.model import check_schema
+    from utils.jobs import start_workers
+    from utils.warm_pool import start_pool_manager
+    from utils.templates import start_template_sync
+    from utils.cluster import start_snapshot_refresher
+
+    with app.app_context():
+        check_schema()
+
+    start_workers(app)
+    start_pool_manager(app)
+    start_template_sync(app)
+    start_snapshot_refresher()
 
 
-    
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,133 @@
+# bench/async_pipelines.py
+"""
+Benchmark del motore async (utils/aio.py): esegue N pipeline di provisioning complete
+(clone, resize, configurazione, avvio, attesa dell'IP e creazione dell'utente via SSH)
+come coroutine sullo stesso event loop, contro l'API Proxmox e il server SSH finti.
+Nessun DB e nessun worker: misura solo l'I/O verso Proxmox e SSH.
+
+Riporta tempo totale, pipeline al minuto, percentili della durata, chiamate API e thread
+usati dal processo (il numero di thread non cresce con il numero di pipeline: le chiamate all'API
+usano il client sincrono condiviso nel pool di thread di run_blocking).
+
+Uso:
+    python bench/async_pipelines.py [--n 200] [--limit 200] [--clone-s 2] [--resize-s 0.5]
+                                    [--start-s 1] [--dhcp-s 2] [--ssh-s 0.2] [--nodes px1,px2]
+"""
+import os, sys, time, asyncio, argparse, threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.provisioning import free_port, setup_env, percentile
+
+
+async def pipeline(i: int, node: str, args, durate: list) -> str:
+    # stessi passi di build_container + create_user_over_ssh, tutti async
+    from utils.aio import run_blocking
+    from utils.proxmox import proxmox_client, wait_task_async
+    from utils.interfaces import wait_lxc_ipv4_async
+    from utils.ssh import create_user_over_ssh_async, gen_password
+
+    px = proxmox_client()
+    vmid = args.first_vmid + i
+    start = time.perf_counter()
+
+    upid = await run_blocking(px.nodes(node).lxc(args.template).clone.post, newid=vmid, hostname=f"async-{vmid}", full=1)
+    await wait_task_async(px, node, upid, timeout_s=900)
+
+    upid = await run_blocking(px.nodes(node).lxc(vmid).resize.put, disk="rootfs", size="20G")
+    await wait_task_async(px, node, upid, timeout_s=300)
+
+    await run_blocking(px.nodes(node).lxc(vmid).config.put, cores=2, memory=2048, hostname=f"async-{vmid}")
+
+    upid = await run_blocking(px.nodes(node).lxc(vmid).status.start.post)
+    await wait_task_async(px, node, upid, timeout_s=300)
+
+    ip = await wait_lxc_ipv4_async(px, node, vmid, timeout_s=120)
+    await create_user_over_ssh_async(ip, "default_user", "Admin123", f"u{vmid}", gen_password(12), timeout_s=240)
+
+    durate.append(time.perf_counter() - start)
+    return ip
+
+
+async def run(args) -> dict:
+    from utils.aio import run_pipelines
+
+    nodes = args.nodes.split(",")
+    durate = []
+    picco = threading.active_count()
+    fine = asyncio.Event()
+
+    async def campiona():
+        # thread del processo durante il giro (loop, pool dei comandi SSH, server finti)
+        nonlocal picco
+        while not fine.is_set():
+            picco = max(picco, threading.active_count())
+            await asyncio.sleep(0.1)
+
+    campionatore = asyncio.create_task(campiona())
+    start = time.perf_counter()
+    esiti = await run_pipelines([pipeline(i, nodes[i % len(nodes)], args, durate) for i in range(args.n)],
+                                limit=args.limit)
+    elapsed = time.perf_counter() - start
+    fine.set()
+    await campionatore
+
+    errori = [e for e in esiti if isinstance(e, Exception)]
+    return {"elapsed_s": elapsed, "ok": args.n - len(errori), "errori": errori, "durate": durate, "thread": picco}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark delle pipeline async con Proxmox e SSH finti")
+    parser.add_argument("--n", type=int, default=200, help="pipeline da eseguire")
+    parser.add_argument("--limit", type=int, default=200, help="pipeline contemporanee al massimo")
+    parser.add_argument("--clone-s", type=float, default=2.0, help="durata della task di clone")
+    parser.add_argument("--resize-s", type=float, default=0.5, help="durata della task di resize")
+    parser.add_argument("--start-s", type=float, default=1.0, help="durata della task di avvio")
+    parser.add_argument("--dhcp-s", type=float, default=2.0, help="attesa dell'IP DHCP dopo l'avvio")
+    parser.add_argument("--ssh-s", type=float, default=0.2, help="durata di ogni comando SSH")
+    parser.add_argument("--api-latency-s", type=float, default=0.0, help="latenza aggiunta a ogni chiamata API")
+    parser.add_argument("--nodes", default="px1,px2", help="nodi del cluster finto")
+    parser.add_argument("--template", type=int, default=1102, help="vmid del template")
+    parser.add_argument("--first-vmid", type=int, default=5000, help="primo vmid dei container creati")
+    args = parser.parse_args()
+
+    api_port, ssh_port = free_port(), free_port()
+    setup_env(args, api_port, ssh_port)
+
+    from bench.fake_proxmox import FakeProxmox
+    from bench.fake_ssh import FakeSSHServer
+
+    fake = FakeProxmox(nodes=args.nodes.split(","), template_vmid=args.template, clone_s=args.clone_s,
+                       resize_s=args.resize_s, start_s=args.start_s, dhcp_s=args.dhcp_s,
+                       latency_s=args.api_latency_s)
+    fake.serve(api_port)
+    ssh = FakeSSHServer(exec_s=args.ssh_s)
+    ssh.serve(ssh_port)
+
+    from utils.proxmox import proxmox_stats
+
+    print(f"API finta su 127.0.0.1:{api_port}, SSH finto su {fake.ip}:{ssh_port}")
+    print(f"{args.n} pipeline, al massimo {args.limit} insieme, thread all'avvio: {threading.active_count()}\n")
+
+    r = asyncio.run(run(args))
+    stats = proxmox_stats()
+
+    print(f"=== {r['ok']} pipeline completate, {len(r['errori'])} fallite in {r['elapsed_s']:.1f}s")
+    print(f"    {r['ok'] / r['elapsed_s'] * 60:.1f} pipeline/minuto, durata p50 {percentile(r['durate'], 50):.2f}s "
+          f"p95 {percentile(r['durate'], 95):.2f}s p99 {percentile(r['durate'], 99):.2f}s")
+    print(f"    thread del processo al massimo: {r['thread']}")
+    print(f"    chiamate API: {stats['requests']} ({stats['requests'] / args.n:.1f} per pipeline), "
+          f"{stats['connections']} connessioni, latenza media {stats['avg_latency_ms']} ms")
+    for (method, endpoint), count in sorted(fake.calls.items(), key=lambda kv: -kv[1]):
+        if method != "errors":
+            print(f"      {count:6d}  {method} {endpoint}")
+    print(f"    SSH: {ssh.stats['connections']} connessioni, {ssh.stats['auths']} login, {ssh.stats['execs']} comandi")
+    for e in r["errori"][:5]:
+        print(f"    errore: {e!r}")
+
+    fake.stop()
+    sys.exit(0 if not r["errori"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+# bench/fake_proxmox.py
+"""
+API Proxmox finta (HTTPS) per i benchmark: copre le chiamate usate dal provisioning
+(nextid, clone, resize, config, start, stato, task, interfacce, cluster/resources e cluster/tasks)
+e quelle delle repliche dei template (configurazione con digest, conversione in template, eliminazione).
+Le task durano il tempo configurato e l'IP "DHCP" compare dopo dhcp_s secondi dall'avvio.
+"""
+import os, re, json, ssl, time, socket, hashlib, tempfile, threading, ipaddress
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+GB = 1024 ** 3
+MB = 1024 ** 2
+
+
+def local_ip() -> str:
+    """Indirizzo non di loopback della macchina (i container finti rispondono qui)."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(("10.255.255.255", 1))
+        return s.getsockname()[0]
+    except OSError:
+        return "127.0.0.1"
+    finally:
+        s.close()
+
+
+def self_signed_cert() -> tuple:
+    """Certificato autofirmato temporaneo per il server HTTPS, ritorna (cert.pem, key.pem)."""
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "fake-proxmox")])
+    now = datetime.now(timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number()).not_valid_before(now - timedelta(days=1))
+            .not_valid_after(now + timedelta(days=1))
+            .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), False)
+            .sign(key, hashes.SHA256()))
+
+    cartella = tempfile.mkdtemp(prefix="fake-proxmox-")
+    cert_path, key_path = os.path.join(cartella, "cert.pem"), os.path.join(cartella, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+                                  serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+class ApiError(Exception):
+    """Errore restituito dall'API finta con il codice HTTP indicato."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class FakeProxmox:
+
+    """
+    Stato del cluster finto: nodi, storage, container e task.
+    Conta le chiamate ricevute per metodo ed endpoint (vedi calls)
+
+    """
+
+    def __init__(self, nodes=("px1", "px2"), template_vmid: int = 1102, clone_s: float = 2.0,
+                 resize_s: float = 0.5, start_s: float = 1.0, dhcp_s: float = 2.0, latency_s: float = 0.0,
+                 ip: str = None, storage_type: str = "lvmthin", remote_clone_s: float = None):
+        self.nodes = list(nodes)
+        self.clone_s, self.resize_s, self.start_s, self.dhcp_s = clone_s, resize_s, start_s, dhcp_s
+        self.latency_s = latency_s
+        self.storage_type = storage_type
+        # clone verso un altro nodo (copia del disco in rete), di default come quello locale
+        self.remote_clone_s = clone_s if remote_clone_s is None else remote_clone_s
+        self.ip = ip or local_ip()
+
+        self.lock = threading.Lock()
+        self.next_vmid = 2000
+        self.guests = {template_vmid: {"vmid": template_vmid, "node": self.nodes[0], "template": 1,
+                                       "status": "stopped", "maxmem": 512 * MB, "maxdisk": 8 * GB}}
+        self.tasks = {}
+        self.calls = {}
+        self.server = None
+
+    # --- stato ---
+
+    def _task(self, node: str, kind: str, vmid: int, duration_s: float, on_done=None) -> str:
+        now = time.time()
+        upid = f"UPID:{node}:{os.getpid():08X}:{len(self.tasks):08X}:{int(now):08X}:{kind}:{vmid}:bench@pve:"
+        self.tasks[upid] = {"upid": upid, "node": node, "type": kind, "id": str(vmid),
+                            "starttime": int(now), "end": now + duration_s, "on_done": on_done}
+        return upid
+
+    def _task_view(self, t: dict) -> dict:
+        vista = {k: t[k] for k in ("upid", "node", "type", "id", "starttime")}
+        if time.time() >= t["end"]:
+            if t["on_done"]:
+                t["on_done"]()
+                t["on_done"] = None
+            vista["endtime"] = int(t["end"])
+            vista["status"] = "OK"
+        return vista
+
+    def resources(self, kind: str = None) -> list:
+        risorse = []
+        for node in self.nodes:
+            su_nodo = [g for g in self.guests.values() if g["node"] == node and not g.get("template")]
+            risorse.append({"type": "node", "node": node, "status": "online", "cpu": 0.05 * len(su_nodo) % 1,
+                            "maxcpu": 32, "mem": sum(g["maxmem"] for g in su_nodo), "maxmem": 256 * GB})
+            risorse.append({"type": "storage", "node": node, "storage": "local-lvm", "plugintype": self.storage_type,
+                            "disk": sum(g["maxdisk"] for g in su_nodo), "maxdisk": 4096 * GB})
+        for g in self.guests.values():
+            risorse.append({"type": "lxc", "id": f"lxc/{g['vmid']}", "uptime": 0, "mem": 0, **g})
+        if kind == "vm":
+            risorse = [r for r in risorse if r["type"] in ("lxc", "qemu")]
+        return risorse
+
+    # --- instradamento delle chiamate ---
+
+    def handle(self, method: str, path: str, params: dict):
+        routes = [
+            ("GET", r"/cluster/nextid", self.nextid),
+            ("GET", r"/cluster/resources", lambda params: self.resources(params.get("type"))),
+            ("GET", r"/cluster/tasks", lambda params: [self._task_view(t) for t in list(self.tasks.values())][-200:]),
+            ("POST", r"/nodes/(?P<node>[^/]+)/lxc/(?P<vmid>\d+)/clone", self.clone),
+            ("PUT", r"/nodes/(?P<node>[^/]+)/lxc/(?P<vmid>\d+)/resize", self.resize),
+            ("PUT", r"/nodes/(?P<node>[^/]+)/lxc/(?P<vmid>\d+)/config", self.config),
+            ("GET", r"/nodes/(?P<node>[^/]+)/lxc/(?P<vmid>\d+)/config", self.get_config),
+            ("POST", r"/nodes/(?P<node>[^/]+)/lxc/(?P<vmid>\d+)/template", self.template),
+            ("DELETE", r"/nodes/(?P<node>[^/]+)/lxc/(?P<vmid>\d+)", self.destroy),
+            ("POST", r"/nodes/(?P<node>[^/]+)/lxc/(?P<vmid>\d+)/status/start", self.start),
+            ("GET", r"/nodes/(?P<node>[^/]+)/lxc/(?P<vmid>\d+)/status/current", self.current),
+            ("GET", r"/nodes/(?P<node>[^/]+)/lxc/(?P<vmid>\d+)/interfaces", self.interfaces),
+            ("GET", r"/nodes/(?P<node>[^/]+)/tasks/(?P<upid>UPID:[^/]+)/status", self.task_status),
+            ("GET", r"/nodes/(?P<node>[^/]+)/tasks", self.node_tasks),
+        ]
+        for m, pattern, fn in routes:
+            match = re.fullmatch(pattern, path)
+            if m == method and match:
+                endpoint = re.sub(r"\(\?P<(\w+)>[^)]*\)", r"{\1}", pattern)
+                with self.lock:
+                    self.calls[(method, endpoint)] = self.calls.get((method, endpoint), 0) + 1
+                    kwargs = match.groupdict()
+                    if "vmid" in kwargs:
+                        kwargs["vmid"] = int(kwargs["vmid"])
+                    try:
+                        return 200, fn(params=params, **kwargs)
+                    except ApiError as e:
+                        self.calls[("errors", str(e))] = self.calls.get(("errors", str(e)), 0) + 1
+                        return e.code, str(e)
+        return 501, f"{method} {path} non implementato"
+
+
+    def nextid(self, params):
+        # come Proxmox: il primo vmid libero, non riservato (due chiamate ravvicinate possono ricevere lo stesso)
+        vmid = self.next_vmid
+        while vmid in self.guests:
+            vmid += 1
+        return str(vmid)
+
+    def clone(self, node, vmid, params):
+        newid = int(params["newid"])
+        if newid in self.guests:
+            # come Proxmox quando due clone ricevono lo stesso nextid
+            raise ApiError(500, f"CT {newid} already exists")
+        source = self.guests.get(vmid)
+        if source is None:
+            raise ApiError(500, f"Configuration file 'nodes/{node}/lxc/{vmid}.conf' does not exist")
+        target = params.get("target", node)
+        linked = str(params.get("full", "1")) == "0"
+        if linked and (not source.get("template") or target != node):
+            raise ApiError(500, "linked clone feature is not supported")
+        g = self.guests[newid] = {"vmid": newid, "node": target, "name": params.get("hostname"), "status": "stopped",
+                                  "maxmem": 512 * MB, "maxdisk": source["maxdisk"], "started": None, "lock": "create"}
+        if linked:
+            g["base"] = vmid
+        self.next_vmid = max(self.next_vmid, newid + 1)
+        # i linked clone non copiano il disco: la task dura poco
+        durata = self.clone_s / 10 if linked else self.clone_s if target == node else self.remote_clone_s
+        return self._task(node, "vzclone", vmid, durata, on_done=lambda: g.pop("lock", None))
+
+    def resize(self, node, vmid, params):
+        # "+NG" aggiunge, "NG" è la dimensione finale (come Proxmox, senza ridurre)
+        size = str(params.get("size", "+0G"))
+        g = self.guests[vmid]
+        if size.startswith("+"):
+            g["maxdisk"] += int(size.strip("+G") or 0) * GB
+        else:
+            g["maxdisk"] = max(g["maxdisk"], int(size.strip("G")) * GB)
+        return self._task(node, "resize", vmid, self.resize_s)
+
+    def current(self, node, vmid, params):
+        g = self.guests.get(vmid)
+        if g is None:
+            raise ApiError(500, f"Configuration file 'nodes/{node}/lxc/{vmid}.conf' does not exist")
+        stato = {"vmid": vmid, "status": g["status"], "name": g.get("name")}
+        if g.get("lock"):
+            stato["lock"] = g["lock"]
+        return stato
+
+    def config(self, node, vmid, params):
+        g = self.guests[vmid]
+        g["rev"] = g.get("rev", 0) + 1
+        if "memory" in params:
+            g["maxmem"] = int(params["memory"]) * MB
+        if "hostname" in params:
+            g["name"] = params["hostname"]
+        return None
+
+    def get_config(self, node, vmid, params):
+        g = self.guests.get(vmid)
+        if g is None or g["node"] != node:
+            raise ApiError(500, f"Configuration file 'nodes/{node}/lxc/{vmid}.conf' does not exist")
+        # il digest cambia a ogni modifica della configurazione (come su Proxmox)
+        digest = hashlib.sha1(f"{vmid}:{g.get('rev', 0)}".encode()).hexdigest()
+        return {"hostname": g.get("name"), "memory": g["maxmem"] // MB, "digest": digest,
+                "rootfs": f"local-lvm:vm-{vmid}-disk-0,size={g['maxdisk'] // GB}G",
+                **({"template": 1} if g.get("template") else {})}
+
+    def template(self, node, vmid, params):
+        g = self.guests[vmid]
+        g["template"] = 1
+        return None
+
+    def destroy(self, node, vmid, params):
+        g = self.guests.get(vmid)
+        if g is None:
+            raise ApiError(500, f"Configuration file 'nodes/{node}/lxc/{vmid}.conf' does not exist")
+        if any(c.get("base") == vmid for c in self.guests.values()):
+            raise ApiError(500, f"base volume of CT {vmid} is used by linked clone")
+
+        def eliminato():
+            self.guests.pop(vmid, None)
+
+        return self._task(node, "vzdestroy", vmid, 0.1, on_done=eliminato)
+
+    def start(self, node, vmid, params):
+        g = self.guests[vmid]
+
+        def avviato():
+            g["status"] = "running"
+            g["started"] = time.time()
+
+        return self._task(node, "vzstart", vmid, self.start_s, on_done=avviato)
+
+    def interfaces(self, node, vmid, params):
+        g = self.guests[vmid]
+        ifaces = [{"name": "lo", "inet": "127.0.0.1/8"}]
+        if g.get("started") and time.time() - g["started"] >= self.dhcp_s:
+            ifaces.append({"name": "eth0", "inet": f"{self.ip}/24"})
+        return ifaces
+
+    def node_tasks(self, node, params):
+        since = int(params.get("since", 0))
+        return [self._task_view(t) for t in list(self.tasks.values()) if t["node"] == node and t["starttime"] >= since]
+
+    def task_status(self, node, upid, params):
+        t = self.tasks.get(upid)
+        if t is None:
+            raise ApiError(404, "no such task")
+        vista = self._task_view(t)
+        return {**vista, "status": "stopped" if "endtime" in vista else "running", "exitstatus": vista.get("status")}
+
+    # --- server ---
+
+    def serve(self, port: int = 0) -> int:
+        """Avvia il server HTTPS in background su 127.0.0.1, ritorna la porta."""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _dispatch(self, method):
+                url = urlsplit(self.path)
+                params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    body = self.rfile.read(length).decode()
+                    params.update({k: v[-1] for k, v in parse_qs(body).items()})
+                if fake.latency_s:
+                    time.sleep(fake.latency_s)
+
+                path = unquote(url.path.split("/api2/json", 1)[-1])
+                code, data = fake.handle(method, path, params)
+                payload = json.dumps({"data": data} if code == 200 else {"data": None, "message": data}).encode()
+                self.send_response(code, None if code == 200 else data)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def do_PUT(self):
+                self._dispatch("PUT")
+
+            def do_DELETE(self):
+                self._dispatch("DELETE")
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        server.daemon_threads = True
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ctx.load_cert_chain(*self_signed_cert())
+        server.socket = ctx.wrap_socket(server.socket, server_side=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.server = server
+        return server.server_address[1]
+
+    def stop(self) -> None:
+        if self.server:
+            self.server.shutdown()
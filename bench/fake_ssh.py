@@ -0,0 +1,105 @@
+# bench/fake_ssh.py
+"""
+Server SSH finto (paramiko) per i benchmark: accetta qualsiasi password e risponde allo script
+di bootstrap di create_user_over_ssh (utils/ssh.py) riportando ogni passo come riuscito,
+senza eseguire nulla sulla macchina.
+"""
+import re, time, socket, logging, threading
+import paramiko
+
+from utils.ssh import STEP_MARK
+
+# le prove di utils/readiness.py chiudono la connessione dopo il banner, senza key exchange: non sono errori
+logging.getLogger("paramiko.transport").setLevel(logging.CRITICAL)
+
+_STEP = re.compile(r'echo "' + re.escape(STEP_MARK) + r' (\S+) \$rc"')
+
+
+class FakeSSH(paramiko.ServerInterface):
+
+    """Sessione di un client: login con password e comandi exec."""
+
+    def __init__(self, server):
+        self.server = server
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        self.server.count("auths")
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == "session" else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        self.server.count("execs")
+        threading.Thread(target=self.server.run, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+
+class FakeSSHServer:
+
+    """
+    Server in ascolto su tutte le interfacce; ogni comando risponde dopo exec_s secondi.
+    Conta connessioni, login e comandi ricevuti (vedi stats)
+
+    """
+
+    def __init__(self, exec_s: float = 0.2):
+        self.exec_s = exec_s
+        self.key = paramiko.RSAKey.generate(2048)
+        self.stats = {"connections": 0, "auths": 0, "execs": 0}
+        self._lock = threading.Lock()
+        self._sock = None
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def run(self, channel, command: str) -> None:
+        out = ""
+        if command.strip().endswith("bash -s"):
+            # script di bootstrap su stdin: un "@@step nome 0" per ogni passo
+            script = b""
+            while True:
+                data = channel.recv(65536)
+                if not data:
+                    break
+                script += data
+            out = "".join(f"{STEP_MARK} {name} 0\n" for name in _STEP.findall(script.decode()))
+        time.sleep(self.exec_s)
+        channel.sendall(out.encode())
+        channel.send_exit_status(0)
+        channel.close()
+
+    def _handle(self, conn) -> None:
+        self.count("connections")
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(self.key)
+        try:
+            transport.start_server(server=FakeSSH(self))
+        except (paramiko.SSHException, EOFError, OSError):
+            transport.close()
+
+    def serve(self, port: int = 0) -> int:
+        """Avvia il server in background, ritorna la porta."""
+        self._sock = socket.socket()
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("0.0.0.0", port))
+        self._sock.listen(256)
+
+        def loop():
+            while True:
+                try:
+                    conn, _ = self._sock.accept()
+                except OSError:
+                    return
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+        threading.Thread(target=loop, daemon=True).start()
+        return self._sock.getsockname()[1]
+
+    def stop(self) -> None:
+        if self._sock:
+            self._sock.close()
@@ -0,0 +1,308 @@
+# bench/load.py
+"""
+Test di carico HTTP delle pagine del portale: quanti studenti contemporanei regge durante le iscrizioni.
+Avvia il portale in un processo separato su un server HTTP locale (DB temporaneo, API Proxmox finta
+di bench/fake_proxmox.py) e lo fa usare da utenti virtuali, ognuno con la sua sessione (cookie):
+- studenti: registrazione (auth.signup_post) e login (auth.login_post), poi richieste di VM
+  (user.crea_vm) e lista delle VM (user.get_lista_vm) secondo i pesi di --mix
+- admin: login, poi lista delle richieste (admin.get_richieste)
+
+Per ogni livello di concorrenza (studenti contemporanei, più --admins admin) riporta per endpoint
+richieste al secondo, latenza p50/p95/p99, errori e query al DB per richiesta (media e massimo).
+Le query sono contate dal server e mandate al client nell'header X-Portal-Queries.
+
+Uso:
+    python bench/load.py [--levels 1,10,50] [--admins 2] [--duration-s 20] [--think-s 0]
+                         [--mix signup=1,login=1,crea=2,lista=8] [--rows 2000]
+    python bench/load.py --url http://127.0.0.1:5000 --levels 10   # portale già avviato (senza conteggio query)
+"""
+import os, sys, json, time, random, argparse, threading, itertools, subprocess
+from http.client import HTTPConnection
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.provisioning import free_port, percentile, setup_env
+
+ENDPOINTS = ("auth.signup_post", "auth.login_post", "user.crea_vm", "user.get_lista_vm", "admin.get_richieste")
+# azioni degli studenti scelte con --mix
+AZIONI = {"signup": "auth.signup_post", "login": "auth.login_post", "crea": "user.crea_vm", "lista": "user.get_lista_vm"}
+
+QUERY_HEADER = "X-Portal-Queries"
+
+_seq = itertools.count()
+
+
+class Stats:
+
+    """Latenze, errori e query al DB per endpoint, raccolte dai thread degli utenti virtuali."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latenze = {}
+        self.errori = {}
+        self.query = {}
+
+    def add(self, endpoint: str, secondi: float, ok: bool, query) -> None:
+        with self._lock:
+            self.latenze.setdefault(endpoint, []).append(secondi)
+            if not ok:
+                self.errori[endpoint] = self.errori.get(endpoint, 0) + 1
+            if query is not None:
+                self.query.setdefault(endpoint, []).append(query)
+
+
+class Client:
+
+    """Un utente virtuale: una connessione per richiesta, cookie di sessione propri, redirect non seguiti."""
+
+    def __init__(self, base_url: str, stats: Stats):
+        url = urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.stats = stats
+        self.cookies = {}
+
+    def request(self, endpoint: str, method: str, path: str, data: dict = None, expect: int = 200):
+        body = urlencode(data) if data is not None else None
+        headers = {"Cookie": "; ".join(f"{k}={v}" for k, v in self.cookies.items())}
+        if body is not None:
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+        start = time.perf_counter()
+        conn = HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            r = conn.getresponse()
+            r.read()
+        except OSError:
+            self.stats.add(endpoint, time.perf_counter() - start, False, None)
+            return None
+        finally:
+            conn.close()
+        elapsed = time.perf_counter() - start
+
+        for header in r.headers.get_all("Set-Cookie") or ():
+            for morsel in SimpleCookie(header).values():
+                self.cookies[morsel.key] = morsel.value
+        query = r.getheader(QUERY_HEADER)
+        self.stats.add(endpoint, elapsed, r.status == expect, int(query) if query is not None else None)
+        return r
+
+    def login(self, email: str, password: str, home: str) -> bool:
+        r = self.request("auth.login_post", "POST", "/auth/login", {"email": email, "password": password}, 302)
+        # login riuscito: redirect alla pagina del ruolo, altrimenti di nuovo al login
+        return r is not None and home in (r.getheader("Location") or "")
+
+
+def studente(base_url: str, stats: Stats, mix: dict, vm_types: list, deadline: float, think_s: float) -> None:
+    client = Client(base_url, stats)
+    account = None
+    azioni, pesi = zip(*mix.items())
+
+    while time.monotonic() < deadline:
+        azione = random.choices(azioni, pesi)[0]
+        if azione == "signup" or account is None:
+            # nuovo studente: registrazione e primo login
+            n = next(_seq)
+            account = {"username": f"load{os.getpid()}x{n}", "email": f"load{os.getpid()}x{n}@bench.local",
+                       "password": "bench"}
+            client.cookies.clear()
+            client.request("auth.signup_post", "POST", "/auth/signup", account, 302)
+            azione = "login"
+        if azione == "login":
+            client.cookies.clear()
+            if not client.login(account["email"], account["password"], "/user/lista"):
+                account = None
+        elif azione == "crea":
+            client.request("user.crea_vm", "POST", "/user/creazione_vm", {"vm_type_id": random.choice(vm_types)}, 302)
+        elif azione == "lista":
+            client.request("user.get_lista_vm", "GET", "/user/lista")
+        if think_s:
+            time.sleep(random.uniform(0, 2 * think_s))
+
+
+def admin(base_url: str, stats: Stats, email: str, password: str, deadline: float, think_s: float) -> None:
+    client = Client(base_url, stats)
+    client.login(email, password, "/admin/richieste")
+    while time.monotonic() < deadline:
+        client.request("admin.get_richieste", "GET", "/admin/richieste")
+        if think_s:
+            time.sleep(random.uniform(0, 2 * think_s))
+
+
+def run_level(base_url: str, n: int, args, mix: dict, vm_types: list) -> dict:
+
+    """
+    Esegue n studenti e args.admins admin contemporanei per args.duration_s secondi
+    (utenti in ciclo chiuso: la richiesta successiva parte quando arriva la risposta, più il think time)
+
+    """
+
+    stats = Stats()
+    deadline = time.monotonic() + args.duration_s
+    threads = [threading.Thread(target=studente, args=(base_url, stats, mix, vm_types, deadline, args.think_s))
+               for _ in range(n)]
+    threads += [threading.Thread(target=admin, args=(base_url, stats, args.admin_email, args.admin_password,
+                                                     deadline, args.think_s))
+                for _ in range(args.admins)]
+
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    endpoints = {}
+    for endpoint in ENDPOINTS:
+        latenze = stats.latenze.get(endpoint, [])
+        if not latenze:
+            continue
+        query = stats.query.get(endpoint, [])
+        endpoints[endpoint] = {
+            "richieste": len(latenze),
+            "errori": stats.errori.get(endpoint, 0),
+            "rps": len(latenze) / elapsed,
+            "p50": percentile(latenze, 50),
+            "p95": percentile(latenze, 95),
+            "p99": percentile(latenze, 99),
+            "query": sum(query) / len(query) if query else None,
+            "query_max": max(query, default=None),
+        }
+    tutte = [x for v in stats.latenze.values() for x in v]
+    return {"n": n, "elapsed_s": elapsed, "endpoints": endpoints, "richieste": len(tutte),
+            "errori": sum(stats.errori.values()), "rps": len(tutte) / elapsed if elapsed else 0,
+            "p95": percentile(tutte, 95)}
+
+
+def parse_mix(testo: str) -> dict:
+    mix = {}
+    for parte in testo.split(","):
+        nome, _, peso = parte.partition("=")
+        if nome.strip() not in AZIONI:
+            raise SystemExit(f"azione sconosciuta in --mix: {nome!r} (valide: {', '.join(AZIONI)})")
+        mix[nome.strip()] = float(peso or 1)
+    return mix
+
+
+def start_portal(args) -> tuple:
+
+    """
+    Avvia il portale (processo --serve) su un server HTTP locale con più thread, DB temporaneo
+    popolato con --rows richieste e API Proxmox finta (fotografia del cluster per la lista VM).
+    Ogni risposta porta nell'header X-Portal-Queries le query eseguite dalla richiesta.
+    Ritorna (url, id dei tipi di VM)
+
+    """
+
+    args.nodes = "px1,px2"
+    api_port, ssh_port, http_port = free_port(), free_port(), free_port()
+    setup_env(args, api_port, ssh_port)
+
+    from bench.fake_proxmox import FakeProxmox
+    fake = FakeProxmox(nodes=args.nodes.split(","), clone_s=0, resize_s=0, start_s=0, dhcp_s=0)
+    fake.serve(api_port)
+
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    from flask import g, has_request_context
+    from sqlalchemy import event
+    from werkzeug.serving import make_server
+    from app import create_app
+    from model.connection import db
+    from model.model import VmType, seed_db
+    from tools.query_plans import seed
+    from utils.cluster import start_snapshot_refresher
+
+    app = create_app(services=False)
+    with app.app_context():
+        db.create_all()
+        seed_db()
+        if args.rows:
+            seed(db, args.rows)
+        vm_types = [t.id for t in VmType.query.all()]
+
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def conta(conn, cursor, statement, parameters, context, executemany):
+            if has_request_context():
+                g.portal_queries = g.get("portal_queries", 0) + 1
+
+    @app.after_request
+    def header_query(response):
+        response.headers[QUERY_HEADER] = str(g.get("portal_queries", 0))
+        return response
+
+    start_snapshot_refresher()
+
+    server = make_server("127.0.0.1", http_port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="load-http", daemon=True).start()
+    return f"http://127.0.0.1:{http_port}", vm_types
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test di carico HTTP delle pagine utente e admin del portale")
+    parser.add_argument("--levels", default="1,10,50", help="studenti contemporanei per ogni giro")
+    parser.add_argument("--admins", type=int, default=2, help="admin contemporanei su /admin/richieste")
+    parser.add_argument("--duration-s", type=float, default=20, help="durata di ogni giro")
+    parser.add_argument("--think-s", type=float, default=0, help="pausa media tra due richieste di un utente")
+    parser.add_argument("--mix", default="signup=1,login=1,crea=2,lista=8",
+                        help="pesi delle azioni degli studenti (signup, login, crea, lista)")
+    parser.add_argument("--rows", type=int, default=2000, help="richieste già presenti nel DB temporaneo")
+    parser.add_argument("--url", help="portale già avviato da usare invece di quello locale (niente conteggio query)")
+    parser.add_argument("--vm-types", default="1,2,3", help="id dei tipi di VM richiesti (solo con --url)")
+    parser.add_argument("--admin-email", default="admin@example.com")
+    parser.add_argument("--admin-password", default=os.getenv("PORTAL_ADMIN_PASSWORD", "Admin$00"))
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    if args.serve:
+        # processo del portale: comunica indirizzo e tipi di VM, poi serve finché il processo principale non chiude stdin
+        base_url, vm_types = start_portal(args)
+        print(json.dumps({"url": base_url, "vm_types": vm_types}), flush=True)
+        sys.stdin.read()
+        return
+
+    portale = None
+    if args.url:
+        base_url, vm_types = args.url.rstrip("/"), [int(x) for x in args.vm_types.split(",") if x]
+    else:
+        # portale in un altro processo: i thread degli utenti virtuali non gli rubano CPU (GIL)
+        portale = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", "--rows", str(args.rows)],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        pronto = json.loads(portale.stdout.readline())
+        base_url, vm_types = pronto["url"], pronto["vm_types"]
+
+    print(f"portale su {base_url}, {args.admins} admin, {args.duration_s:g}s per giro, "
+          f"think time {args.think_s:g}s, mix {args.mix}\n")
+
+    risultati = []
+    for n in [int(x) for x in args.levels.split(",") if x]:
+        r = run_level(base_url, n, args, mix, vm_types)
+        risultati.append(r)
+
+        print(f"=== {n} studenti e {args.admins} admin: {r['richieste']} richieste, {r['errori']} errori "
+              f"in {r['elapsed_s']:.1f}s ({r['rps']:.1f} req/s)")
+        print(f"    {'endpoint':22s} {'req':>6s} {'err':>4s} {'req/s':>7s} {'p50 ms':>8s} {'p95 ms':>8s} "
+              f"{'p99 ms':>8s} {'query':>6s} {'max':>4s}")
+        for endpoint, e in r["endpoints"].items():
+            query = f"{e['query']:6.1f} {e['query_max']:4d}" if e["query"] is not None else f"{'-':>6s} {'-':>4s}"
+            print(f"    {endpoint:22s} {e['richieste']:6d} {e['errori']:4d} {e['rps']:7.1f} {e['p50'] * 1000:8.1f} "
+                  f"{e['p95'] * 1000:8.1f} {e['p99'] * 1000:8.1f} {query}")
+        print()
+
+    print("studenti  req/s    p95 ms  errori")
+    for r in risultati:
+        print(f"{r['n']:8d}  {r['rps']:6.1f}  {r['p95'] * 1000:8.1f}  {r['errori']:6d}")
+
+    if portale:
+        portale.stdin.close()
+        portale.wait(timeout=30)
+    sys.exit(0 if all(r["errori"] == 0 for r in risultati) else 1)
+
+
+if __name__ == "__main__":
+    main()
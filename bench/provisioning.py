@@ -0,0 +1,225 @@
+# bench/provisioning.py
+"""
+Benchmark del provisioning senza cluster: avvia un'API Proxmox finta (bench/fake_proxmox.py)
+e un server SSH finto (bench/fake_ssh.py), poi accetta N richieste in parallelo dalla pagina admin
+(la stessa route "accetta" del portale) e le fa eseguire ai worker della coda.
+
+Per ogni livello di concorrenza riporta approvazioni al minuto, percentili della latenza
+accettazione -> READY, chiamate API per endpoint e connessioni/login SSH.
+
+Uso:
+    python bench/provisioning.py [--levels 1,10,50] [--clone-s 2] [--resize-s 0.5] [--start-s 1]
+                                 [--dhcp-s 2] [--ssh-s 0.2] [--api-latency-s 0] [--nodes px1,px2]
+                                 [--remote-clone-s 2] [--replicas] [--linked]
+"""
+import os, sys, time, socket, argparse, tempfile, threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * p / 100
+    i = int(k)
+    if i + 1 >= len(values):
+        return values[-1]
+    return values[i] + (values[i + 1] - values[i]) * (k - i)
+
+
+def setup_env(args, api_port: int, ssh_port: int) -> None:
+    # prima di importare il portale: porte, credenziali finte e DB temporaneo
+    os.environ.update({
+        "PROXMOX_HOST": "127.0.0.1",
+        "PROXMOX_PORT": str(api_port),
+        "PROXMOX_USER": "bench@pve",
+        "PROXMOX_TOKEN_NAME": "bench",
+        "PROXMOX_TOKEN_VALUE": "bench",
+        "PROXMOX_NODES": args.nodes,
+        "PROXMOX_DEFAULT_NODE": args.nodes.split(",")[0],
+        "PROXMOX_TEMPLATE_ID": "1102",
+        "PORTAL_SSH_PORT": str(ssh_port),
+        "PORTAL_WORKERS": "0",
+        "PORTAL_POOL_MANAGER": "0",
+        "PORTAL_TEMPLATE_SYNC": "0",
+        "PROXMOX_LINKED_CLONE": "1" if getattr(args, "linked", False) else "0",
+        "PORTAL_ADMIN_USERNAME": "admin",
+        "PORTAL_ADMIN_PASSWORD": "Admin$00",
+        "DATABASE_URL": "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="bench-"), "bench.db"),
+    })
+
+
+def create_requests(n: int, vm_type_name: str, prefix: str) -> list:
+    from model.connection import db
+    from model.model import User, Role, VmType, VmRequest
+
+    role = Role.query.filter_by(name="user").first()
+    vm_type = VmType.query.filter_by(name=vm_type_name).first()
+    ids = []
+    for i in range(n):
+        user = User(username=f"{prefix}{i}", email=f"{prefix}{i}@bench.local")
+        user.set_password("bench")
+        user.roles.append(role)
+        req = VmRequest(user=user, vm_type=vm_type, status="PENDING")
+        db.session.add(req)
+        db.session.flush()
+        ids.append(req.id)
+    db.session.commit()
+    return ids
+
+
+def run_level(app, fake, ssh, n: int, args) -> dict:
+
+    """
+    Accetta n richieste in parallelo (un client HTTP per thread, come n admin) con n worker attivi
+    e aspetta che arrivino tutte in READY o FAILED
+
+    """
+
+    from model.connection import db
+    from model.model import VmRequest
+    from utils.jobs import WorkerPool
+
+    with app.app_context():
+        ids = create_requests(n, args.vm_type, f"b{n}x")
+
+    calls_before = dict(fake.calls)
+    ssh_before = dict(ssh.stats)
+    accettate = {}
+    pronte = {}
+
+    pool = WorkerPool(app, n)
+    pool.start()
+
+    def approva(req_id: int):
+        client = app.test_client()
+        client.post("/auth/login", data={"email": "admin@example.com", "password": "Admin$00"})
+        accettate[req_id] = time.perf_counter()
+        r = client.post(f"/admin/richieste/{req_id}/accetta")
+        assert r.status_code == 302, r.status_code
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=approva, args=(req_id,)) for req_id in ids]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    deadline = time.monotonic() + args.timeout_s
+    stati = {}
+    while time.monotonic() < deadline and len(pronte) < n:
+        with app.app_context():
+            stati = dict(db.session.execute(
+                db.select(VmRequest.id, VmRequest.status).where(VmRequest.id.in_(ids))
+            ).all())
+        now = time.perf_counter()
+        for req_id, status in stati.items():
+            if status in ("READY", "FAILED") and req_id not in pronte:
+                pronte[req_id] = now
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    pool.stop(timeout_s=1)
+
+    latenze = [pronte[i] - accettate[i] for i in pronte]
+    ready = sum(1 for i in ids if stati.get(i) == "READY")
+    calls = {k: v - calls_before.get(k, 0) for k, v in fake.calls.items() if v - calls_before.get(k, 0)}
+    return {
+        "n": n,
+        "ready": ready,
+        "failed": n - ready,
+        "elapsed_s": elapsed,
+        "per_min": ready / elapsed * 60 if elapsed else 0,
+        "p50": percentile(latenze, 50),
+        "p95": percentile(latenze, 95),
+        "p99": percentile(latenze, 99),
+        "calls": calls,
+        "ssh": {k: v - ssh_before.get(k, 0) for k, v in ssh.stats.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del provisioning con Proxmox e SSH finti")
+    parser.add_argument("--levels", default="1,10,50", help="richieste accettate in parallelo per ogni giro")
+    parser.add_argument("--clone-s", type=float, default=2.0, help="durata della task di clone")
+    parser.add_argument("--remote-clone-s", type=float, help="durata del clone verso un altro nodo (default --clone-s)")
+    parser.add_argument("--resize-s", type=float, default=0.5, help="durata della task di resize")
+    parser.add_argument("--start-s", type=float, default=1.0, help="durata della task di avvio")
+    parser.add_argument("--dhcp-s", type=float, default=2.0, help="attesa dell'IP DHCP dopo l'avvio")
+    parser.add_argument("--ssh-s", type=float, default=0.2, help="durata di ogni comando SSH")
+    parser.add_argument("--api-latency-s", type=float, default=0.0, help="latenza aggiunta a ogni chiamata API")
+    parser.add_argument("--nodes", default="px1,px2", help="nodi del cluster finto")
+    parser.add_argument("--vm-type", default="silver", help="tipo di VM richiesto (bronze/silver/gold)")
+    parser.add_argument("--timeout-s", type=float, default=600, help="attesa massima per ogni giro")
+    parser.add_argument("--replicas", action="store_true", help="copia i template su ogni nodo prima dei giri")
+    parser.add_argument("--linked", action="store_true", help="linked clone dalle repliche (PROXMOX_LINKED_CLONE)")
+    args = parser.parse_args()
+
+    api_port, ssh_port = free_port(), free_port()
+    setup_env(args, api_port, ssh_port)
+
+    from bench.fake_proxmox import FakeProxmox
+    from bench.fake_ssh import FakeSSHServer
+
+    fake = FakeProxmox(nodes=args.nodes.split(","), clone_s=args.clone_s, resize_s=args.resize_s,
+                       start_s=args.start_s, dhcp_s=args.dhcp_s, latency_s=args.api_latency_s,
+                       remote_clone_s=args.remote_clone_s)
+    fake.serve(api_port)
+    ssh = FakeSSHServer(exec_s=args.ssh_s)
+    ssh.serve(ssh_port)
+
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+    from app import create_app
+    from model.connection import db
+    from model.model import seed_db
+
+    # DB temporaneo: tabelle e dati iniziali; niente servizi in background, i worker li avvia run_level
+    app = create_app(services=False)
+    with app.app_context():
+        db.create_all()
+        seed_db()
+
+    print(f"API finta su 127.0.0.1:{api_port}, SSH finto su {fake.ip}:{ssh_port}")
+    print(f"task: clone {args.clone_s}s, resize {args.resize_s}s, start {args.start_s}s, "
+          f"DHCP {args.dhcp_s}s, comando SSH {args.ssh_s}s\n")
+
+    if args.replicas:
+        # repliche dei template su ogni nodo (utils/templates.py), fuori dal tempo dei giri
+        from utils.templates import sync_templates
+        from utils.proxmox import proxmox_client
+        with app.app_context():
+            start = time.perf_counter()
+            esito = sync_templates(proxmox_client())
+        print(f"repliche dei template: {esito} in {time.perf_counter() - start:.1f}s\n")
+
+    risultati = []
+    for n in [int(x) for x in args.levels.split(",") if x]:
+        r = run_level(app, fake, ssh, n, args)
+        risultati.append(r)
+
+        print(f"=== {n} approvazioni in parallelo: {r['ready']} READY, {r['failed']} FAILED in {r['elapsed_s']:.1f}s")
+        print(f"    {r['per_min']:.1f} approvazioni/minuto, latenza p50 {r['p50']:.2f}s "
+              f"p95 {r['p95']:.2f}s p99 {r['p99']:.2f}s")
+        print(f"    chiamate API: {sum(v for k, v in r['calls'].items() if k[0] != 'errors')} "
+              f"({sum(v for k, v in r['calls'].items() if k[0] != 'errors') / n:.1f} per richiesta)")
+        for (method, endpoint), count in sorted(r["calls"].items(), key=lambda kv: -kv[1]):
+            print(f"      {count:6d}  {method} {endpoint}")
+        print(f"    SSH: {r['ssh']['connections']} connessioni, {r['ssh']['auths']} login, {r['ssh']['execs']} comandi\n")
+
+    print("livello  ready  appr/min    p50     p95     p99   API/req")
+    for r in risultati:
+        api = sum(v for k, v in r["calls"].items() if k[0] != "errors") / r["n"]
+        print(f"{r['n']:7d}  {r['ready']:5d}  {r['per_min']:8.1f}  {r['p50']:6.2f}  {r['p95']:6.2f}  {r['p99']:6.2f}  {api:7.1f}")
+
+    sys.exit(0 if all(r["failed"] == 0 for r in risultati) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# bench/readiness.py
+"""
+Benchmark dell'attesa di SSH su molti host (utils/readiness.py): simula N container che
+si avviano in momenti casuali (porta chiusa, poi sshd che manda il banner) e misura
+quanto tempo passa tra l'host pronto e il risveglio di chi lo aspetta, quante prove
+vengono fatte e quanti thread usa il processo.
+
+Con --legacy usa, per confronto, il ciclo per host di prima (connessione con timeout 3s,
+pausa fissa di 2s tra un tentativo e l'altro, solo porta TCP).
+
+Uso:
+    python bench/readiness.py [--n 500] [--boot-s 20] [--sshd-s 1] [--legacy]
+"""
+import os, sys, time, random, asyncio, argparse, threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.provisioning import free_port, percentile
+
+
+class FakeHost:
+
+    """Container finto: porta chiusa fino a boot_s, poi aperta; il banner SSH arriva dopo altri sshd_s."""
+
+    def __init__(self, ip: str, port: int, boot_s: float, sshd_s: float):
+        # ogni host ha il suo indirizzo di loopback: prima dell'avvio la connessione viene rifiutata
+        self.ip = ip
+        self.port = port
+        self.boot_s = boot_s
+        self.sshd_s = sshd_s
+        self.ready_ts = None
+        self._server = None
+
+    async def start(self, t0: float) -> None:
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(max(t0 + self.boot_s - loop.time(), 0))
+        self._server = await asyncio.start_server(self._client, self.ip, self.port)
+        self.ready_ts = loop.time() + self.sshd_s
+
+    async def _client(self, reader, writer) -> None:
+        attesa = self.ready_ts - asyncio.get_running_loop().time()
+        if attesa > 0:
+            # sshd non ancora partito: la porta è aperta ma il banner non arriva
+            await asyncio.sleep(attesa)
+        try:
+            writer.write(b"SSH-2.0-OpenSSH_9.2p1 bench\r\n")
+            await writer.drain()
+            await reader.read(1)
+        except OSError:
+            pass
+        finally:
+            writer.close()
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.close()
+
+
+async def legacy_wait(host: str, port: int, timeout_s: float, contatore: list) -> None:
+    # ciclo per host di prima: una connessione ogni 2s, pronto appena la porta TCP è aperta
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout_s
+    while loop.time() < deadline:
+        contatore[0] += 1
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), 3)
+            writer.close()
+            return
+        except (OSError, asyncio.TimeoutError):
+            await asyncio.sleep(2)
+    raise RuntimeError(f"Porta {port} non disponibile su {host} entro {timeout_s}s")
+
+
+async def run(args) -> dict:
+    from utils.readiness import readiness_prober
+
+    loop = asyncio.get_running_loop()
+    t0 = loop.time() + 0.5
+    port = free_port()
+    hosts = [FakeHost(f"127.1.{i // 250}.{i % 250 + 1}", port, random.uniform(0, args.boot_s), args.sshd_s)
+             for i in range(args.n)]
+    avvii = [asyncio.create_task(h.start(t0)) for h in hosts]
+
+    prober = readiness_prober()
+    legacy = [0]
+    ritardi = []
+    picco = threading.active_count()
+
+    async def aspetta(h: FakeHost) -> None:
+        nonlocal picco
+        if args.legacy:
+            await legacy_wait(h.ip, h.port, args.boot_s + 60, legacy)
+        else:
+            await prober.wait(h.ip, h.port, banner=True, timeout_s=args.boot_s + 60)
+        # ritardo tra sshd pronto (banner) e risveglio di chi aspetta
+        ritardi.append(loop.time() - h.ready_ts)
+        picco = max(picco, threading.active_count())
+
+    start = time.perf_counter()
+    esiti = await asyncio.gather(*(aspetta(h) for h in hosts), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+
+    await asyncio.gather(*avvii)
+    for h in hosts:
+        h.stop()
+
+    return {"elapsed_s": elapsed, "errori": [e for e in esiti if isinstance(e, Exception)], "ritardi": ritardi,
+            "prove": legacy[0] if args.legacy else prober.checks, "thread": picco}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dell'attesa di porta e banner SSH su molti host")
+    parser.add_argument("--n", type=int, default=500, help="host da aspettare")
+    parser.add_argument("--boot-s", type=float, default=20.0, help="gli host si avviano a caso in questo intervallo")
+    parser.add_argument("--sshd-s", type=float, default=1.0, help="dalla porta aperta al banner SSH")
+    parser.add_argument("--legacy", action="store_true", help="ciclo per host di prima (pausa fissa, solo TCP)")
+    args = parser.parse_args()
+
+    r = asyncio.run(run(args))
+    ritardi = [max(x, 0) for x in r["ritardi"]]
+    prima = sum(1 for x in r["ritardi"] if x < 0)
+
+    print(f"=== {args.n} host ({'ciclo per host' if args.legacy else 'prober condiviso'}): "
+          f"{args.n - len(r['errori'])} pronti, {len(r['errori'])} falliti in {r['elapsed_s']:.1f}s")
+    print(f"    ritardo banner -> risveglio p50 {percentile(ritardi, 50):.2f}s p95 {percentile(ritardi, 95):.2f}s "
+          f"p99 {percentile(ritardi, 99):.2f}s max {max(ritardi, default=0):.2f}s")
+    if prima:
+        print(f"    {prima} host dati per pronti prima del banner SSH (porta aperta ma sshd non partito)")
+    print(f"    prove: {r['prove']} ({r['prove'] / args.n:.1f} per host), thread del processo: {r['thread']}")
+    for e in r["errori"][:5]:
+        print(f"    errore: {e!r}")
+
+    sys.exit(0 if not r["errori"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# bench/startup.py
+"""
+Benchmark dell'avvio di un processo del portale (es. un nuovo worker web con l'autoscaling).
+Per ogni giro avvia un processo Python nuovo (import a freddo) che importa app, crea l'applicazione,
+serve una sola richiesta HTTP e termina; il processo che misura aspetta la prima risposta.
+
+Riporta mediana e minimo di:
+- import: import del modulo app
+- create_app: creazione dell'applicazione (blueprint, DB, comandi)
+- prima richiesta: prima risposta della pagina (template compilati, prima connessione al DB)
+- spawn -> risposta: dall'avvio del processo alla prima risposta HTTP ricevuta
+e quali moduli pesanti (proxmoxer, paramiko, alembic, ...) risultano caricati dopo la prima richiesta.
+
+Funziona anche su una copia più vecchia del portale senza create_app (--root), per confronto.
+Servizi in background, Proxmox e SSH non vengono usati; il DB è temporaneo.
+
+Uso:
+    python bench/startup.py [--runs 7] [--path /auth/login] [--root .]
+"""
+import os, sys, json, time, socket, argparse, tempfile, statistics, subprocess
+from urllib.request import urlopen
+from urllib.error import URLError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# moduli che un processo web non dovrebbe caricare solo per servire le pagine
+HEAVY = ("proxmoxer", "paramiko", "cryptography", "requests", "alembic", "flask_migrate", "mako", "utils.provisioning")
+
+# crea tabelle e dati iniziali (versioni senza create_app: li crea l'import di app)
+SETUP = """
+import app as m
+if hasattr(m, "create_app"):
+    from model.connection import db
+    from model.model import seed_db
+    a = m.create_app(services=False)
+    with a.app_context():
+        db.create_all()
+        seed_db()
+"""
+
+# un processo web: import, creazione dell'app, una richiesta servita, tempi su stdout
+CHILD = """
+import sys, time, json
+t0 = time.perf_counter()
+import app as m
+t1 = time.perf_counter()
+a = m.create_app() if hasattr(m, "create_app") else m.app
+t2 = time.perf_counter()
+from werkzeug.serving import make_server
+server = make_server("127.0.0.1", int(sys.argv[1]), a)
+server.timeout = 30
+server.handle_request()
+t3 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "create_app": t2 - t1, "prima_richiesta": t3 - t2,
+                  "pesanti": [n for n in %r if n in sys.modules]}))
+""" % (HEAVY,)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def env_for(database_url: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": database_url,
+        "PORTAL_ADMIN_USERNAME": "admin",
+        "PORTAL_WORKERS": "0",
+        "PORTAL_POOL_MANAGER": "0",
+        "PORTAL_TEMPLATE_SYNC": "0",
+        "PROXMOX_SNAPSHOT_REFRESH": "0",
+        "PYTHONDONTWRITEBYTECODE": "",
+    })
+    env.pop("FLASK_RUN_FROM_CLI", None)
+    return env
+
+
+def one_run(root: str, env: dict, path: str) -> dict:
+    port = free_port()
+    start = time.perf_counter()
+    child = subprocess.Popen([sys.executable, "-c", CHILD, str(port)], cwd=root, env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+    risposta = None
+    while risposta is None:
+        if child.poll() is not None:
+            raise RuntimeError(f"processo terminato prima della risposta: {child.stderr.read()[-2000:]}")
+        try:
+            with urlopen(f"http://127.0.0.1:{port}{path}", timeout=30) as r:
+                r.read()
+                risposta = time.perf_counter() - start
+        except (URLError, ConnectionError):
+            time.sleep(0.005)
+
+    out, err = child.communicate(timeout=30)
+    risultato = json.loads(out.strip().splitlines()[-1])
+    risultato["spawn_risposta"] = risposta
+    return risultato
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dell'avvio di un processo del portale")
+    parser.add_argument("--runs", type=int, default=7, help="processi avviati (import a freddo ognuno)")
+    parser.add_argument("--path", default="/auth/login", help="pagina della prima richiesta")
+    parser.add_argument("--root", default=ROOT, help="cartella del portale da misurare")
+    args = parser.parse_args()
+
+    root = os.path.abspath(args.root)
+    env = env_for("sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="startup-"), "startup.db"))
+    subprocess.run([sys.executable, "-c", SETUP], cwd=root, env=env, check=True, capture_output=True)
+    # primo giro scartato: compila i .pyc e scalda la cache dei file del sistema operativo
+    one_run(root, env, args.path)
+
+    giri = [one_run(root, env, args.path) for _ in range(args.runs)]
+
+    print(f"=== avvio del portale in {root}, {args.runs} processi, prima richiesta GET {args.path}")
+    for chiave, nome in (("import", "import app"), ("create_app", "create_app"),
+                         ("prima_richiesta", "prima richiesta"), ("spawn_risposta", "spawn -> risposta")):
+        valori = [g[chiave] * 1000 for g in giri]
+        print(f"    {nome:18s} mediana {statistics.median(valori):7.1f} ms   min {min(valori):7.1f} ms")
+    print(f"    moduli pesanti caricati: {', '.join(giri[-1]['pesanti']) or 'nessuno'}")
+
+
+if __name__ == "__main__":
+    main()
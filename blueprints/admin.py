@@ -1,16 +1,26 @@
 # blueprints/admin.py
-import time, ipaddress, os
-from flask_login import login_required
-from flask import Blueprint, render_template, redirect, url_for, flash, current_app
+from datetime import datetime, timedelta
+
+from flask_login import login_required, current_user
+from flask import Blueprint, render_template, redirect, url_for, flash, request, abort
+from sqlalchemy.orm import joinedload
 
 from model.connection import db
-from model.model import VmRequest, VmType, User, VmCredentials
+from model.model import VmRequest, VmType, User, ProvisioningStage, ApprovalBatch
 
 from blueprints.auth import user_has_role
 
-from utils.proxmox import proxmox_client, wait_task
-from utils.ssh import gen_password, create_user_over_ssh
-from utils.interfaces import wait_lxc_ipv4_from_interfaces
+from utils.jobs import enqueue_provisioning, retry_job, utcnow
+from utils.events import publish_status, sse_response
+from utils.pagination import keyset_page
+from utils.timeline import stage_stats, GRUPPI
+from utils.batches import pending_ids, create_batch, batch_progress, batch_failures
+
+# stati possibili di una richiesta, per il filtro della lista
+STATI_RICHIESTA = ["PENDING", "QUEUED", "PROVISIONING", "READY", "FAILED", "REJECTED"]
+
+# finestre (giorni) selezionabili nella pagina delle statistiche
+FINESTRE_GIORNI = [1, 7, 30, 90]
 
 app = Blueprint('admin', __name__)
 
@@ -21,13 +31,34 @@ app = Blueprint('admin', __name__)
 def get_richieste():
 
     """
-    Funzione per visualizzare tutte le richieste di VM.
-    Fornisce una lista di richieste ordinate per data decrescente prendendole dal DB
+    Funzione per visualizzare le richieste di VM.
+    Fornisce una pagina di richieste ordinate per data decrescente prendendole dal DB
+    Filtri per stato e data (?status=, ?dal=, ?al=) eseguiti nella query, paginazione a cursore (?after=)
+    Utente e tipo di VM vengono caricati nella stessa query (niente query per ogni riga)
     Una volta estrapolate, le passa al template e le visualizza
 
     """
-    richieste = VmRequest.query.order_by(VmRequest.request_ts.desc()).all()
-    return render_template('admin/richieste.html', requests=richieste)
+    status = request.args.get("status") or None
+    dal = request.args.get("dal") or None
+    al = request.args.get("al") or None
+
+    stmt = db.select(VmRequest).options(joinedload(VmRequest.user), joinedload(VmRequest.vm_type))
+
+    try:
+        if status:
+            stmt = stmt.where(VmRequest.status == status)
+        if dal:
+            stmt = stmt.where(VmRequest.request_ts >= datetime.fromisoformat(dal))
+        if al:
+            stmt = stmt.where(VmRequest.request_ts < datetime.fromisoformat(al) + timedelta(days=1))
+
+        richieste, next_cursor = keyset_page(stmt, [VmRequest.request_ts, VmRequest.id], request.args.get("after"))
+    except ValueError:
+        abort(400)
+
+    filtri = {"status": status, "dal": dal, "al": al}
+    return render_template('admin/richieste.html', requests=richieste, next_cursor=next_cursor,
+                           filtri=filtri, stati=STATI_RICHIESTA)
 
 
 @app.route('/utenti')
@@ -36,13 +67,78 @@ def get_richieste():
 def get_utenti():
 
     """
-    Funzione per visualizzare tutti gli utenti presenti nel portale
+    Funzione per visualizzare gli utenti presenti nel portale, una pagina alla volta (?after=)
     Una volta estrapolati, li passa al template e li visualizza
 
     """
 
-    utenti = User.query.order_by(User.username.desc()).all()
-    return render_template('admin/utenti.html', users=utenti)
+    try:
+        utenti, next_cursor = keyset_page(db.select(User), [User.username], request.args.get("after"))
+    except ValueError:
+        abort(400)
+
+    return render_template('admin/utenti.html', users=utenti, next_cursor=next_cursor)
+
+
+@app.route("/richieste/<int:req_id>/timeline")
+@login_required
+@user_has_role("admin")
+def get_timeline(req_id: int):
+
+    """
+    Funzione per visualizzare la timeline del provisioning di una richiesta
+    Mostra i passi eseguiti (anche dei tentativi precedenti) con inizio, fine, durata, nodo ed errore
+    e l'ultimo checkpoint del job, da cui riparte un nuovo tentativo
+
+    """
+
+    req = VmRequest.query.get_or_404(req_id)
+
+    stages = db.session.execute(
+        db.select(ProvisioningStage).filter_by(vm_request_id=req.id)
+        .order_by(ProvisioningStage.attempt, ProvisioningStage.start_ts, ProvisioningStage.id)
+    ).scalars().all()
+
+    return render_template('admin/timeline.html', req=req, stages=stages)
+
+
+@app.route("/statistiche")
+@login_required
+@user_has_role("admin")
+def get_statistiche():
+
+    """
+    Funzione per visualizzare i tempi del provisioning sugli ultimi ?giorni= (default 7)
+    p50/p95/p99 di ogni passo, per tipo di VM (?per=vm_type), per nodo (?per=node) o complessivi (?per=stage)
+
+    """
+
+    try:
+        giorni = int(request.args.get("giorni", 7))
+    except ValueError:
+        abort(400)
+
+    per = request.args.get("per", "vm_type")
+    if giorni <= 0 or per not in GRUPPI:
+        abort(400)
+
+    stats = stage_stats(utcnow() - timedelta(days=giorni), group_by=per)
+    return render_template('admin/statistiche.html', stats=stats, giorni=giorni, per=per,
+                           finestre=FINESTRE_GIORNI)
+
+
+@app.route("/eventi")
+@login_required
+@user_has_role("admin")
+def eventi():
+
+    """
+    Stream SSE (text/event-stream) con i cambi di stato e i passi del provisioning di tutte le richieste
+    La pagina delle richieste lo usa per aggiornarsi senza essere ricaricata
+
+    """
+
+    return sse_response(("admin",), request.headers.get("Last-Event-ID"))
 
 
 @app.route("/richieste/<int:req_id>/rifiuta", methods=["POST"])
@@ -69,6 +165,7 @@ def rifiuta(req_id: int):
     # aggiorno dello stato
     req.status = "REJECTED"
     db.session.commit()
+    publish_status(req)
 
     flash("Richiesta rifiutata", "info")
     return redirect(url_for("admin.get_richieste"))
@@ -80,100 +177,112 @@ def rifiuta(req_id: int):
 def accetta(req_id: int):
 
     """
-    Provisiona ed esegue un full clone partendo dal template presente nel nodo Proxmox
-    Ridimensiona il disco e configura CPU e RAM in base al tipo di VM richiesto
-    Una volta completato il clone, avvia la VM e ne legge l'IP assegnato via DHCP
-    Crea un nuovo utente all'interno della VM tramite SSH con le credenziali generate
-    Salva le credenziali di accesso alla VM nel DB
+    Accetta una richiesta di creazione VM e la mette nella coda di provisioning
+    Il clone, la configurazione e la creazione dell'utente vengono eseguiti dai worker
+    in background (utils/jobs.py), la richiesta passa da "QUEUED" a "PROVISIONING" e infine a "READY" o "FAILED"
+    La pagina ritorna subito senza aspettare la fine del provisioning
 
     """
 
-    req = VmRequest.query.get(req_id)
-    user = User.query.get(req.user_id)
-    template_disk_gb = 8
+    req = VmRequest.query.get_or_404(req_id)
 
     if req.status != "PENDING":
         flash(f"Non puoi accettare: stato attuale {req.status}", "warning")
         return redirect(url_for("admin.get_richieste"))
 
-    vm_type = VmType.query.get(req.vm_type_id)
-    if not vm_type:
+    if not db.session.get(VmType, req.vm_type_id):
         flash("Tipo VM non trovato", "danger")
         return redirect(url_for("admin.get_richieste"))
 
-    try:
-        # ottiene dati di accesso per API Proxmox
-        proxmox = proxmox_client()
-        node = os.getenv("PROXMOX_DEFAULT_NODE", "px1")
-
-        # prepara parametri del clone
-        template_vmid = int(vm_type.template_vmid)
-        new_vmid = int(proxmox.cluster.nextid.get())
-        hostname = f"vm-{user.username}-{new_vmid}"
-        dimensione_disk = int(vm_type.disk)
-
-        # clone template
-        upid_clone = proxmox.nodes(node).lxc(template_vmid).clone.post(
-            newid=new_vmid,
-            hostname=hostname,
-            full=1,
-        )
-
-        wait_task(proxmox, node, upid_clone, timeout_s=900)
-
-        # ridimensiona il disco in base al tipo di VM scelto
-        ridimensionamento_disco = dimensione_disk - template_disk_gb
-        if ridimensionamento_disco > 0:
-
-            upid_resize = proxmox.nodes(node).lxc(new_vmid).resize.put(
-                disk="rootfs",
-                size=f"+{ridimensionamento_disco}G",
-            )
-            
-            wait_task(proxmox, node, upid_resize, timeout_s=300)
-
-        # ram,cpu,hostname
-        proxmox.nodes(node).lxc(new_vmid).config.put(
-            cores=int(vm_type.cores),
-            memory=int(vm_type.ram),
-            hostname=hostname,
-        )
-
-        # avvio vm
-        upid_start = proxmox.nodes(node).lxc(new_vmid).status.start.post()
-        wait_task(proxmox, node, upid_start, timeout_s=300)
-
-        # imposta username e password per la VM
-        vm_username = user.username
-        vm_password = gen_password(12)
-
-        # ottiene l'ip della VM
-        ipv4 = wait_lxc_ipv4_from_interfaces(proxmox, node, new_vmid, timeout_s=120)
-
-        # crea l'utente all'interno della VM tramite SSH
-        create_user_over_ssh(host_ip=ipv4,bootstrap_user="default_user",bootstrap_pass="Admin123",
-            new_user=vm_username,new_pass=vm_password,make_sudo=True,lock_bootstrap=False,timeout_s=240)
-        
-
-        # aggiorna stato 
-        req.status = "READY"
-        db.session.commit()
-
-        # salva le credenziali di accesso da fornire all'utente
-        creds = VmCredentials.query.filter_by(vm_request_id=req.id).first()
-        if not creds:
-            creds = VmCredentials(vm_request_id=req.id)
-
-        creds.ip_address = ipv4
-        creds.username = vm_username
-        creds.password = vm_password
-        creds.hostname = hostname
-
-        db.session.add(creds)
-        db.session.commit()
-
-    except Exception as e:
-        req.status = "FAILED"
-        db.session.commit()
+    if not enqueue_provisioning(req):
+        flash("Richiesta già presa in carico", "warning")
+        return redirect(url_for("admin.get_richieste"))
 
+    flash("Richiesta accettata, provisioning in coda", "info")
     return redirect(url_for("admin.get_richieste"))
+
+
+@app.route("/richieste/<int:req_id>/riprova", methods=["POST"])
+@login_required
+@user_has_role("admin")
+def riprova(req_id: int):
+
+    """
+    Rimette in coda il provisioning di una richiesta "FAILED"
+    Il nuovo tentativo riprende dall'ultimo passo completato (checkpoint) sullo stesso container,
+    senza rifare il clone
+
+    """
+
+    req = VmRequest.query.get_or_404(req_id)
+
+    if req.status != "FAILED":
+        flash(f"Non puoi riprovare: stato attuale {req.status}", "warning")
+        return redirect(url_for("admin.get_richieste"))
+
+    if not retry_job(req):
+        flash("Richiesta già rimessa in coda", "warning")
+        return redirect(url_for("admin.get_richieste"))
+
+    flash("Provisioning rimesso in coda, riprende dall'ultimo passo completato", "info")
+    return redirect(url_for("admin.get_richieste"))
+
+
+@app.route("/richieste/accetta-lotto", methods=["POST"])
+@login_required
+@user_has_role("admin")
+def accetta_lotto():
+
+    """
+    Approvazione in blocco: accetta le richieste selezionate nella lista (ids) oppure,
+    con "tutte", tutte le richieste PENDING del filtro per data della pagina (dal, al)
+    Le richieste vengono messe in coda a blocchi e provisionate in parallelo dai worker,
+    nei limiti di PORTAL_MAX_PARALLEL (cluster) e PORTAL_MAX_PARALLEL_PER_NODE (nodo)
+    Ritorna alla pagina di avanzamento del lotto
+
+    """
+
+    dal = request.form.get("dal") or None
+    al = request.form.get("al") or None
+
+    if request.form.get("tutte"):
+        try:
+            ids = pending_ids(dal=dal, al=al)
+        except ValueError:
+            abort(400)
+        descrizione = f"Tutte le richieste PENDING dal {dal or 'inizio'} al {al or 'oggi'}"
+    else:
+        try:
+            ids = [int(i) for i in request.form.getlist("ids")]
+        except ValueError:
+            abort(400)
+        descrizione = f"{len(ids)} richieste selezionate"
+
+    if not ids:
+        flash("Nessuna richiesta PENDING da accettare", "warning")
+        return redirect(url_for("admin.get_richieste"))
+
+    batch = create_batch(current_user.id, ids, descrizione)
+    if batch is None:
+        flash("Le richieste selezionate non sono più PENDING", "warning")
+        return redirect(url_for("admin.get_richieste"))
+
+    flash(f"{batch.total} richieste accettate, provisioning in coda", "info")
+    return redirect(url_for("admin.get_lotto", batch_id=batch.id))
+
+
+@app.route("/lotti/<int:batch_id>")
+@login_required
+@user_has_role("admin")
+def get_lotto(batch_id: int):
+
+    """
+    Funzione per visualizzare l'avanzamento di un'approvazione in blocco
+    Richieste per stato, velocità, stima del tempo rimanente e richieste fallite con l'errore
+    La pagina si aggiorna con lo stream SSE degli eventi e l'API /api/v1/batches/<id>
+
+    """
+
+    batch = ApprovalBatch.query.get_or_404(batch_id)
+    return render_template('admin/lotto.html', batch=batch, progress=batch_progress(batch),
+                           failures=batch_failures(batch))
@@ -0,0 +1,357 @@
+# blueprints/api.py
+import os
+from datetime import timezone, timedelta
+from functools import wraps
+
+from flask import Blueprint, jsonify, request, make_response, abort
+from flask_login import current_user
+from sqlalchemy.orm import joinedload, selectinload
+from werkzeug.exceptions import HTTPException
+
+from model.connection import db
+from model.model import User, VmType, VmRequest, VmCredentials, ApprovalBatch
+from blueprints.admin import STATI_RICHIESTA
+from utils.jobs import utcnow, retry_job
+from utils.pagination import keyset_page, PAGE_SIZE
+from utils.versions import table_versions, etag_for, last_modified
+from utils.batches import pending_ids, create_batch, batch_progress
+from dotenv import load_dotenv
+load_dotenv()
+
+# righe massime per pagina richiedibili con ?limit=
+MAX_LIMIT = int(os.getenv("PORTAL_API_MAX_LIMIT", "200"))
+
+app = Blueprint('api', __name__)
+
+
+def _iso(ts):
+    return ts.isoformat() if ts else None
+
+
+# campi esposti per ogni risorsa (selezionabili con ?fields=id,status,...)
+REQUEST_FIELDS = {
+    "id": lambda r: r.id,
+    "status": lambda r: r.status,
+    "request_ts": lambda r: _iso(r.request_ts),
+    "user_id": lambda r: r.user_id,
+    "username": lambda r: r.user.username,
+    "vm_type_id": lambda r: r.vm_type_id,
+    "vm_type": lambda r: r.vm_type.name,
+}
+
+CREDENTIAL_FIELDS = {
+    "id": lambda c: c.id,
+    "vm_request_id": lambda c: c.vm_request_id,
+    "vmid": lambda c: c.vmid,
+    "hostname": lambda c: c.hostname,
+    "ip_address": lambda c: c.ip_address,
+    "username": lambda c: c.username,
+    "password": lambda c: c.password,
+    "add_ts": lambda c: _iso(c.add_ts),
+}
+
+VM_TYPE_FIELDS = {
+    "id": lambda t: t.id,
+    "name": lambda t: t.name,
+    "cores": lambda t: t.cores,
+    "ram": lambda t: t.ram,
+    "disk": lambda t: t.disk,
+}
+
+USER_FIELDS = {
+    "id": lambda u: u.id,
+    "username": lambda u: u.username,
+    "email": lambda u: u.email,
+    "roles": lambda u: sorted(role.name for role in u.roles),
+    "add_ts": lambda u: _iso(u.add_ts),
+}
+
+
+@app.errorhandler(HTTPException)
+def _json_error(e: HTTPException):
+    # errori dell'API in JSON invece che nella pagina HTML di Flask
+    return jsonify({"error": e.description, "status": e.code}), e.code
+
+
+def api_role(*role_names):
+
+    """
+    Come user_has_role, ma per l'API: risponde 401/403 in JSON invece di fare redirect al login.
+    L'autenticazione è la stessa sessione del portale (cookie di Flask-Login)
+
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not current_user.is_authenticated:
+                abort(401, "Autenticazione richiesta")
+            if not any(current_user.has_role(role) for role in role_names):
+                abort(403, "Permesso negato")
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def versioned(*tables):
+
+    """
+    Risposte condizionali basate sui contatori delle modifiche delle tabelle (utils/versions.py).
+    Prima di eseguire la view legge le versioni delle tabelle indicate con una sola query:
+    se l'ETag (o Last-Modified) del client è ancora valido risponde 304 senza caricare nessun oggetto.
+    Le versioni sono lette prima dei dati: se una modifica arriva nel mezzo, il client riceve dati
+    più nuovi dell'ETag e li riscarica al giro successivo (mai un 304 su dati vecchi)
+
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            versions = table_versions(*tables)
+            if len(versions) < len(tables):
+                # tabella senza contatore (DB non allineato, vedi "flask seed"): la versione non cambierebbe
+                # con i dati, quindi niente ETag né 304, il client riceve sempre la risposta completa
+                response = make_response(jsonify(f(*args, **kwargs)))
+                response.headers["Cache-Control"] = "private, no-cache"
+                return response
+
+            # la stessa URL può dare risposte diverse a utenti diversi (richieste e credenziali proprie)
+            etag = etag_for(versions, request.path, sorted(request.args.items(multi=True)),
+                            current_user.id, current_user.has_role("admin"))
+
+            # Last-Modified ha la precisione del secondo: se l'ultima modifica è di questo secondo
+            # non lo si invia, altrimenti una seconda modifica nello stesso secondo darebbe un 304 sbagliato
+            modificato = last_modified(versions)
+            if modificato is not None:
+                modificato = modificato.replace(microsecond=0)
+                if utcnow() - modificato < timedelta(seconds=1):
+                    modificato = None
+                else:
+                    modificato = modificato.replace(tzinfo=timezone.utc)
+
+            if request.if_none_match:
+                fresco = request.if_none_match.contains(etag)
+            else:
+                fresco = bool(modificato and request.if_modified_since and modificato <= request.if_modified_since)
+
+            if fresco:
+                response = make_response("", 304)
+            else:
+                response = make_response(jsonify(f(*args, **kwargs)))
+
+            response.set_etag(etag)
+            if modificato:
+                response.last_modified = modificato
+            # i client devono sempre rivalidare (risposta privata: contiene dati dell'utente)
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+        return decorated_function
+    return decorator
+
+
+def _fields(available: dict) -> dict:
+    # ?fields=id,status: solo i campi richiesti, 400 se un campo non esiste
+    richiesti = request.args.get("fields")
+    if not richiesti:
+        return available
+    nomi = [n.strip() for n in richiesti.split(",") if n.strip()]
+    sconosciuti = [n for n in nomi if n not in available]
+    if sconosciuti:
+        abort(400, f"Campi non validi: {', '.join(sconosciuti)}")
+    return {n: available[n] for n in nomi}
+
+
+def _serialize(rows, fields: dict) -> list:
+    return [{name: fn(row) for name, fn in fields.items()} for row in rows]
+
+
+def _page(stmt, columns: list, fields: dict, desc: bool = True) -> dict:
+    # pagina a cursore (?after=, ?limit=) nel formato {"data": [...], "next": cursore o null}
+    try:
+        limit = int(request.args.get("limit", PAGE_SIZE))
+    except ValueError:
+        abort(400, "limit non valido")
+    if not 1 <= limit <= MAX_LIMIT:
+        abort(400, f"limit deve essere tra 1 e {MAX_LIMIT}")
+
+    try:
+        rows, next_cursor = keyset_page(stmt, columns, request.args.get("after"), page_size=limit, desc=desc)
+    except ValueError:
+        abort(400, "Cursore non valido")
+
+    return {"data": _serialize(rows, fields), "next": next_cursor}
+
+
+@app.route("/vm-types")
+@api_role("admin", "user")
+@versioned("vm_type")
+def list_vm_types():
+
+    """
+    Tipi di VM richiedibili (nome, core, RAM in MB, disco in GB)
+
+    """
+
+    fields = _fields(VM_TYPE_FIELDS)
+    return _page(db.select(VmType), [VmType.id], fields, desc=False)
+
+
+@app.route("/requests")
+@api_role("admin", "user")
+@versioned("vm_request", "vm_type", "user")
+def list_requests():
+
+    """
+    Richieste di VM dalla più recente: tutte per gli admin (filtri ?status= e ?user_id=),
+    solo le proprie per gli utenti (filtro ?status=)
+
+    """
+
+    fields = _fields(REQUEST_FIELDS)
+    stmt = db.select(VmRequest).options(joinedload(VmRequest.user), joinedload(VmRequest.vm_type))
+
+    status = request.args.get("status")
+    if status:
+        if status not in STATI_RICHIESTA:
+            abort(400, f"Stato non valido: {status}")
+        stmt = stmt.where(VmRequest.status == status)
+
+    if current_user.has_role("admin"):
+        if request.args.get("user_id"):
+            try:
+                stmt = stmt.where(VmRequest.user_id == int(request.args["user_id"]))
+            except ValueError:
+                abort(400, "user_id non valido")
+    else:
+        stmt = stmt.where(VmRequest.user_id == current_user.id)
+
+    return _page(stmt, [VmRequest.request_ts, VmRequest.id], fields)
+
+
+@app.route("/requests/<int:req_id>")
+@api_role("admin", "user")
+@versioned("vm_request", "vm_type", "user")
+def get_request(req_id: int):
+
+    """
+    Una richiesta di VM (gli utenti vedono solo le proprie)
+
+    """
+
+    fields = _fields(REQUEST_FIELDS)
+    req = db.session.get(VmRequest, req_id, options=[joinedload(VmRequest.user), joinedload(VmRequest.vm_type)])
+    if req is None or (req.user_id != current_user.id and not current_user.has_role("admin")):
+        abort(404, "Richiesta non trovata")
+
+    return {"data": _serialize([req], fields)[0]}
+
+
+@app.route("/requests/<int:req_id>/retry", methods=["POST"])
+@api_role("admin")
+def retry_request(req_id: int):
+
+    """
+    Rimette in coda una richiesta FAILED (come "Riprova" nella pagina delle richieste):
+    il provisioning riprende dall'ultimo checkpoint sullo stesso container
+    Risponde 202 con la richiesta, 409 se la richiesta non è FAILED
+
+    """
+
+    req = db.session.get(VmRequest, req_id)
+    if req is None:
+        abort(404, "Richiesta non trovata")
+    if req.status != "FAILED" or not retry_job(req):
+        abort(409, f"Non puoi riprovare: stato attuale {req.status}")
+
+    return jsonify({"data": _serialize([req], REQUEST_FIELDS)[0]}), 202
+
+
+@app.route("/credentials")
+@api_role("admin", "user")
+@versioned("vm_credentials", "vm_request")
+def list_credentials():
+
+    """
+    Credenziali d'accesso delle VM dell'utente (come la pagina user/lista), dalla più recente
+    Anche per gli admin sono solo le proprie: le password delle VM degli altri non sono esposte
+
+    """
+
+    fields = _fields(CREDENTIAL_FIELDS)
+    stmt = (db.select(VmCredentials).join(VmRequest, VmCredentials.vm_request_id == VmRequest.id)
+            .where(VmRequest.user_id == current_user.id))
+
+    return _page(stmt, [VmCredentials.add_ts, VmCredentials.id], fields)
+
+
+@app.route("/users")
+@api_role("admin")
+@versioned("user")
+def list_users():
+
+    """
+    Utenti del portale con i loro ruoli, in ordine di username (come la pagina admin/utenti)
+
+    """
+
+    fields = _fields(USER_FIELDS)
+    stmt = db.select(User)
+    if "roles" in fields:
+        stmt = stmt.options(selectinload(User.roles))
+
+    return _page(stmt, [User.username], fields)
+
+
+@app.route("/batches", methods=["POST"])
+@api_role("admin")
+def create_batch_api():
+
+    """
+    Approvazione in blocco. Corpo JSON con gli id delle richieste ({"ids": [1, 2, 3]})
+    oppure con un filtro sulle richieste PENDING ({"filter": {"dal": "2026-09-01", "al": ..., "vm_type_id": ..., "user_id": ...}})
+    Risponde 201 con l'avanzamento del lotto (vedi GET /batches/<id>)
+
+    """
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or ("ids" in body) == ("filter" in body):
+        abort(400, "Serve un oggetto JSON con \"ids\" oppure \"filter\"")
+
+    if "ids" in body:
+        ids = body["ids"]
+        if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+            abort(400, "ids deve essere una lista di interi")
+        descrizione = f"{len(ids)} richieste selezionate (API)"
+    else:
+        filtro = body["filter"]
+        if not isinstance(filtro, dict) or set(filtro) - {"dal", "al", "vm_type_id", "user_id"}:
+            abort(400, "Filtro non valido: chiavi ammesse dal, al, vm_type_id, user_id")
+        try:
+            ids = pending_ids(**filtro)
+        except (TypeError, ValueError):
+            abort(400, "Filtro non valido")
+        descrizione = "Richieste PENDING con filtro " + ", ".join(f"{k}={v}" for k, v in sorted(filtro.items()))
+
+    if not ids:
+        abort(400, "Nessuna richiesta da accettare")
+
+    batch = create_batch(current_user.id, ids, descrizione)
+    if batch is None:
+        abort(409, "Nessuna delle richieste indicate è ancora PENDING")
+    return jsonify({"data": batch_progress(batch)}), 201
+
+
+@app.route("/batches/<int:batch_id>")
+@api_role("admin")
+def get_batch(batch_id: int):
+
+    """
+    Avanzamento di un'approvazione in blocco: richieste per stato, completate, velocità e tempo stimato
+    (senza ETag: tempo trascorso e stima cambiano anche senza modifiche alle richieste)
+
+    """
+
+    batch = db.session.get(ApprovalBatch, batch_id)
+    if batch is None:
+        abort(404, "Lotto non trovato")
+    return {"data": batch_progress(batch)}
@@ -3,6 +3,7 @@ from flask_login import LoginManager, login_required, login_user, logout_user, c
 from flask import Blueprint, render_template, redirect, url_for, request, flash, abort
 from model.model import User,Role
 from model.connection import db
+from utils.principals import cache_principal, get_principal
 from functools import wraps
 
 login_manager = LoginManager()
@@ -44,11 +45,13 @@ def login_post():
         flash('Please check your login details and try again.')
         return redirect(url_for('auth.login'))
 
-    login_user(user, remember=remember)
+    # il Principal in cache serve le richieste successive senza query (vedi load_user)
+    principal = cache_principal(user)
+    login_user(principal, remember=remember)
 
-    if user.has_role("admin"):
+    if principal.has_role("admin"):
         return redirect(url_for('admin.get_richieste'))
-    elif user.has_role("user"):
+    elif principal.has_role("user"):
         return redirect(url_for('user.get_lista_vm'))
     else:
         flash("Account senza ruolo: contatta un admin.")
@@ -97,7 +100,9 @@ def signup_post():
 
 @login_manager.user_loader
 def load_user(user_id):
-    stmt = db.select(User).filter_by(id=user_id)
-    user = db.session.execute(stmt).scalar_one_or_none()    
-    return user
+    # utente e ruoli dalla cache dei Principal (utils/principals.py), query solo se manca o è scaduto
+    try:
+        return get_principal(int(user_id))
+    except ValueError:
+        return None
 
@@ -1,9 +1,15 @@
 # blueprints/user.py
 from flask_login import LoginManager, login_required, current_user
 from flask import Blueprint, render_template, redirect, url_for, request, flash
+from sqlalchemy.orm import joinedload
 from model.model import User, VmRequest, VmCredentials
 from model.connection import db
 from blueprints.auth import user_has_role
+from utils.cluster import cached_snapshot, guest_status
+from utils.events import publish_status, sse_response
+
+# stati delle richieste non ancora concluse, mostrate in cima alla lista VM
+STATI_IN_CORSO = ["PENDING", "QUEUED", "PROVISIONING"]
 
 app = Blueprint('user', __name__)
 
@@ -14,15 +20,39 @@ app = Blueprint('user', __name__)
 def get_creazione_form():
     return render_template('user/creazione.html')
 
+def _vmid(c: VmCredentials):
+    # le credenziali salvate prima della colonna vmid hanno solo l'hostname "vm-<utente>-<vmid>"
+    if c.vmid:
+        return c.vmid
+    coda = c.hostname.rsplit("-", 1)[-1]
+    return int(coda) if coda.isdigit() else None
+
 # route per visualizzare la lista delle VM dell'utente, fornisce tutte le credenziali d'accesso salvate in DB
+# lo stato dei container viene dalla fotografia del cluster in memoria (nessuna chiamata API per ogni pagina)
 @app.route('/lista')
 @login_required
 @user_has_role("user")
 def get_lista_vm():
     credenziali = (VmCredentials.query.join(VmRequest, VmCredentials.vm_request_id == VmRequest.id).filter(VmRequest.user_id == current_user.id).
                    order_by(VmCredentials.add_ts.desc()).all())
-    
-    return render_template('user/lista_vm.html', credentials=credenziali)
+
+    snapshot = cached_snapshot()
+    guests = snapshot.guests if snapshot else {}
+    stati = {c.id: guest_status(guests.get(_vmid(c))) for c in credenziali}
+
+    # richieste in corso, aggiornate in pagina dallo stream /user/eventi
+    in_corso = (VmRequest.query.filter(VmRequest.user_id == current_user.id, VmRequest.status.in_(STATI_IN_CORSO)).
+                options(joinedload(VmRequest.vm_type)).order_by(VmRequest.request_ts.desc()).all())
+
+    return render_template('user/lista_vm.html', credentials=credenziali, stati=stati, in_corso=in_corso)
+
+# stream SSE con i cambi di stato e i passi del provisioning delle richieste dell'utente
+# la lista VM lo usa per mostrare l'avanzamento senza ricaricare la pagina
+@app.route('/eventi')
+@login_required
+@user_has_role("user")
+def eventi():
+    return sse_response((f"user:{current_user.id}",), request.headers.get("Last-Event-ID"))
 
 # route per gestire la richiesta di creazione VM
 # controlla il tipo della VM e salva nel DB la richiesta con stato PENDING
@@ -38,5 +68,6 @@ def crea_vm():
     new_request = VmRequest(vm_type_id=vm_type_id, user_id=current_user.id, status='PENDING')
     db.session.add(new_request)
     db.session.commit()
+    publish_status(new_request)
     flash("Richiesta di creazione VM inviata")
     return redirect(url_for('user.get_creazione_form'))
\ No newline at end of file
@@ -0,0 +1,91 @@
+# config.py
+import os
+from sqlalchemy import event
+from dotenv import load_dotenv
+load_dotenv()
+
+
+# database del portale: SQLite (default, nella cartella instance) oppure Postgres,
+# es. DATABASE_URL=postgresql://portal:password@db:5432/portal
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///proxmox-portal.db")
+
+# connessioni tenute aperte dal pool e connessioni extra nei picchi (web + worker + pool manager)
+DB_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "20"))
+# attesa massima di una connessione libera dal pool (secondi)
+DB_POOL_TIMEOUT_S = int(os.getenv("DATABASE_POOL_TIMEOUT_S", "30"))
+# Postgres: connessioni più vecchie di così vengono riaperte (secondi, evita timeout di server e proxy)
+DB_POOL_RECYCLE_S = int(os.getenv("DATABASE_POOL_RECYCLE_S", "1800"))
+
+# SQLite: attesa del lock di scrittura prima di "database is locked" (millisecondi)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "15000"))
+# SQLite: journal WAL (letture e scrittura in parallelo) e fsync ridotto (NORMAL è sicuro con WAL)
+SQLITE_WAL = os.getenv("SQLITE_WAL", "1") != "0"
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+
+
+def database_url(url: str = None) -> str:
+    """Normalizza l'URL del database (postgres:// di alcuni provider -> postgresql://)."""
+    url = url or DATABASE_URL
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+def engine_options(url: str) -> dict:
+
+    """
+    Opzioni del motore SQLAlchemy per il backend dell'URL:
+    - SQLite: pool di connessioni condiviso tra i thread (web, worker, pool manager)
+    - Postgres: pool con overflow, riciclo delle connessioni e controllo prima dell'uso
+
+    """
+
+    if url.startswith("sqlite"):
+        if ":memory:" in url or url.rstrip("/") == "sqlite:":
+            # DB in memoria: una connessione per thread, il pool non serve
+            return {}
+        return {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT_S,
+        }
+
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT_S,
+        "pool_recycle": DB_POOL_RECYCLE_S,
+        "pool_pre_ping": True,
+    }
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # impostazioni per connessione: il busy timeout fa aspettare il lock invece di fallire subito
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+        if SQLITE_WAL:
+            cursor.execute("PRAGMA journal_mode = WAL")
+            cursor.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    finally:
+        cursor.close()
+
+
+def configure_database(app, db) -> None:
+
+    """
+    Configura il database dell'applicazione (URL da DATABASE_URL e opzioni del pool)
+    e registra le impostazioni di connessione di SQLite (WAL, synchronous, busy timeout)
+
+    """
+
+    url = database_url(app.config.get("SQLALCHEMY_DATABASE_URI"))
+    app.config["SQLALCHEMY_DATABASE_URI"] = url
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(url))
+
+    db.init_app(app)
+
+    with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            event.listen(db.engine, "connect", _sqlite_pragmas)
@@ -1,4 +1,6 @@
 import os
+import click
+from flask.cli import with_appcontext
 from model.connection import db
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -6,13 +8,20 @@ from werkzeug.security import generate_password_hash, check_password_hash
 
 user_roles = db.Table('user_roles',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('role_id', db.Integer, db.ForeignKey('role.id'))
+    db.Column('role_id', db.Integer, db.ForeignKey('role.id')),
+    # caricamento dei ruoli dell'utente (User.has_role)
+    db.Index('ix_user_roles_user_id', 'user_id'),
 )
 
 class Role(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=False)
 
+    __table_args__ = (
+        # ricerca del ruolo per nome (registrazione, seed_db)
+        db.Index('ix_role_name', 'name'),
+    )
+
     def __repr__(self):
         return f'<Role {self.name}>'
 
@@ -65,6 +74,9 @@ class VmType(db.Model):
     disk = db.Column(db.Integer, nullable=False)  # in GB
     template_vmid = db.Column(db.Integer, nullable=False)  # ID del template VM in Proxmox
 
+    # pool di container pronti (utils/warm_pool.py)
+    pool_target = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # container pronti da mantenere
+    pool_refill_per_min = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # nuovi clone al minuto
     
     def __repr__(self):
         return f'<VmType {self.name} cores={self.cores} ram={self.ram} disk={self.disk}>'
@@ -81,6 +93,15 @@ class VmRequest(db.Model):
     user = db.relationship('User', backref=db.backref('vm_requests', lazy='dynamic'))
     vm_type = db.relationship('VmType', backref=db.backref('vm_requests', lazy='dynamic'))
 
+    __table_args__ = (
+        # lista admin: ORDER BY request_ts DESC, id DESC (+ filtro per data)
+        db.Index('ix_vm_request_request_ts_id', 'request_ts', 'id'),
+        # lista admin filtrata per stato
+        db.Index('ix_vm_request_status_request_ts_id', 'status', 'request_ts', 'id'),
+        # lista VM dell'utente: WHERE user_id = ?
+        db.Index('ix_vm_request_user_id', 'user_id'),
+    )
+
     def __repr__(self):
         return f'<VmRequest id={self.id} user_id={self.user_id} vm_type_id={self.vm_type_id} status={self.status}>'
 
@@ -88,6 +109,7 @@ class VmCredentials(db.Model):
     id = db.Column(db.Integer, primary_key=True)
 
     vm_request_id = db.Column(db.Integer, db.ForeignKey('vm_request.id'), nullable=False)
+    vmid = db.Column(db.Integer, nullable=True)  # ID del container in Proxmox
     hostname = db.Column(db.String(100), nullable=False)
     ip_address = db.Column(db.String(45), nullable=False)
     username = db.Column(db.String(50), nullable=False)
@@ -96,42 +118,314 @@ class VmCredentials(db.Model):
 
     vm_request = db.relationship('VmRequest', backref=db.backref('credentials', uselist=False))
 
+    __table_args__ = (
+        # join con vm_request nella lista VM dell'utente, ordinata per add_ts
+        db.Index('ix_vm_credentials_vm_request_id_add_ts', 'vm_request_id', 'add_ts'),
+    )
+
     def __repr__(self):
         return f'<VmCredentials id={self.id} vm_request_id={self.vm_request_id} ip_address={self.ip_address}>'
 
-def init_db():  
+class ProvisioningJob(db.Model):
 
-    db.create_all()
+    # coda persistente dei provisioning: una riga per richiesta accettata
+    # stati: QUEUED -> RUNNING -> DONE / FAILED
+    id = db.Column(db.Integer, primary_key=True)
 
-    # Verifica se i ruoli esistono già
-    if not db.session.execute(db.select(Role).filter_by(name='admin')).scalars().first():
-        admin_role = Role(name='admin')
-        db.session.add(admin_role)
-        db.session.commit()
+    vm_request_id = db.Column(db.Integer, db.ForeignKey('vm_request.id'), nullable=False, unique=True)
+    status = db.Column(db.String(20), nullable=False, default='QUEUED')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=True)  # limite dei tentativi (None = PORTAL_JOB_MAX_ATTEMPTS), alzato da "Riprova"
+    worker_id = db.Column(db.String(100), nullable=True)  # worker che ha preso in carico il job
+    locked_ts = db.Column(db.DateTime, nullable=True)     # inizio del lease del worker
+    last_error = db.Column(db.Text, nullable=True)
+    node = db.Column(db.String(50), nullable=True)        # nodo su cui gira il provisioning (limite per nodo)
+    batch_id = db.Column(db.Integer, db.ForeignKey('approval_batch.id'), nullable=True)  # approvazione in blocco
+    # avanzamento del provisioning: un nuovo tentativo riparte dopo l'ultimo checkpoint sullo stesso container
+    # checkpoint: cloned -> resized -> configured -> started -> ip_known -> user_created (utils/provisioning.py)
+    checkpoint = db.Column(db.String(20), nullable=True)
+    checkpoint_ts = db.Column(db.DateTime, nullable=True)
+    vmid = db.Column(db.Integer, nullable=True)
+    hostname = db.Column(db.String(100), nullable=True)
+    ip_address = db.Column(db.String(45), nullable=True)
+    task_upid = db.Column(db.String(255), nullable=True)  # task del clone in corso (atteso alla ripresa)
+    add_ts = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    update_ts = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+
+    vm_request = db.relationship('VmRequest', backref=db.backref('job', uselist=False))
+    batch = db.relationship('ApprovalBatch', backref=db.backref('jobs', lazy='dynamic'))
+
+    __table_args__ = (
+        # polling dei worker: job QUEUED (o RUNNING con lease scaduto) in ordine di id
+        db.Index('ix_provisioning_job_status_id', 'status', 'id'),
+        # avanzamento di un'approvazione in blocco
+        db.Index('ix_provisioning_job_batch_id', 'batch_id'),
+    )
+
+    def __repr__(self):
+        return (f'<ProvisioningJob id={self.id} vm_request_id={self.vm_request_id} status={self.status} '
+                f'attempts={self.attempts} checkpoint={self.checkpoint}>')
+
+class ApprovalBatch(db.Model):
+
+    # approvazione in blocco di più richieste PENDING (utils/batches.py)
+    id = db.Column(db.Integer, primary_key=True)
+
+    admin_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    description = db.Column(db.String(255), nullable=True)  # richieste selezionate o filtro usato
+    total = db.Column(db.Integer, nullable=False, default=0)  # richieste messe in coda
+    add_ts = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+
+    admin = db.relationship('User')
+
+    def __repr__(self):
+        return f'<ApprovalBatch id={self.id} total={self.total}>'
+
+class ProvisioningStage(db.Model):
+
+    # timeline del provisioning: una riga per ogni passo eseguito per una richiesta (utils/timeline.py)
+    # stati: OK / FAILED
+    id = db.Column(db.Integer, primary_key=True)
+
+    vm_request_id = db.Column(db.Integer, db.ForeignKey('vm_request.id'), nullable=False)
+    attempt = db.Column(db.Integer, nullable=False, default=1)  # tentativo del job (ProvisioningJob.attempts)
+    stage = db.Column(db.String(30), nullable=False)            # es. queue, clone, resize, start, ssh_user
+    node = db.Column(db.String(50), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='OK')
+    error = db.Column(db.Text, nullable=True)
+    start_ts = db.Column(db.DateTime, nullable=False)
+    end_ts = db.Column(db.DateTime, nullable=False)
+    duration_s = db.Column(db.Float, nullable=False)
+
+    vm_request = db.relationship('VmRequest', backref=db.backref('stages', lazy='dynamic'))
+
+    __table_args__ = (
+        # timeline di una richiesta
+        db.Index('ix_provisioning_stage_vm_request_id', 'vm_request_id'),
+        # statistiche della pagina admin su una finestra di tempo
+        db.Index('ix_provisioning_stage_start_ts', 'start_ts'),
+    )
+
+    def __repr__(self):
+        return f'<ProvisioningStage vm_request_id={self.vm_request_id} attempt={self.attempt} stage={self.stage} status={self.status} duration_s={self.duration_s}>'
+
+class WarmContainer(db.Model):
+
+    # container del pool già clonati, configurati e avviati, in attesa di una richiesta
+    # stati: CREATING -> READY -> CLAIMED, oppure FAILED
+    id = db.Column(db.Integer, primary_key=True)
+
+    vm_type_id = db.Column(db.Integer, db.ForeignKey('vm_type.id'), nullable=False)
+    vmid = db.Column(db.Integer, nullable=True, unique=True)
+    node = db.Column(db.String(50), nullable=False)
+    hostname = db.Column(db.String(100), nullable=True)
+    ip_address = db.Column(db.String(45), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='CREATING')
+    vm_request_id = db.Column(db.Integer, db.ForeignKey('vm_request.id'), nullable=True)  # richiesta a cui è stato assegnato
+    last_error = db.Column(db.Text, nullable=True)
+    add_ts = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    ready_ts = db.Column(db.DateTime, nullable=True)
+    claimed_ts = db.Column(db.DateTime, nullable=True)
+
+    vm_type = db.relationship('VmType', backref=db.backref('warm_containers', lazy='dynamic'))
+
+    __table_args__ = (
+        # assegnazione di un container pronto e conteggi del gestore del pool
+        db.Index('ix_warm_container_vm_type_id_status', 'vm_type_id', 'status'),
+    )
+
+    def __repr__(self):
+        return f'<WarmContainer id={self.id} vm_type_id={self.vm_type_id} vmid={self.vmid} status={self.status}>'
+
+class IpSubnet(db.Model):
+
+    # subnet gestite dall'IPAM del portale (utils/ipam.py)
+    id = db.Column(db.Integer, primary_key=True)
+
+    cidr = db.Column(db.String(43), unique=True, nullable=False)  # es. 192.168.56.0/24
+    gateway = db.Column(db.String(45), nullable=True)
+    range_start = db.Column(db.String(45), nullable=True)  # primo indirizzo assegnabile (default: primo host)
+    range_end = db.Column(db.String(45), nullable=True)    # ultimo indirizzo assegnabile (default: ultimo host)
+    bridge = db.Column(db.String(20), nullable=False, default='vmbr0')
+    node = db.Column(db.String(50), nullable=True)  # nodo Proxmox su cui è usabile (None = tutti)
+
+    def __repr__(self):
+        return f'<IpSubnet {self.cidr} gw={self.gateway} bridge={self.bridge}>'
 
-    if not db.session.execute(db.select(Role).filter_by(name='user')).scalars().first():
-        user_role = Role(name='user')
-        db.session.add(user_role)
-        db.session.commit()
+class IpAllocation(db.Model):
+
+    # lease degli indirizzi IP assegnati ai container
+    # stati: ALLOCATED -> RELEASED (l'indirizzo torna disponibile)
+    id = db.Column(db.Integer, primary_key=True)
+
+    subnet_id = db.Column(db.Integer, db.ForeignKey('ip_subnet.id'), nullable=False)
+    address = db.Column(db.String(45), unique=True, nullable=False)
+    vm_request_id = db.Column(db.Integer, db.ForeignKey('vm_request.id'), nullable=True)
+    vmid = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='ALLOCATED')
+    lease_ts = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    release_ts = db.Column(db.DateTime, nullable=True)
+
+    subnet = db.relationship('IpSubnet', backref=db.backref('allocations', lazy='dynamic'))
+    vm_request = db.relationship('VmRequest', backref=db.backref('ip_allocations', lazy='dynamic'))
+
+    def __repr__(self):
+        return f'<IpAllocation {self.address} vmid={self.vmid} vm_request_id={self.vm_request_id} status={self.status}>'
+
+class VmidReservation(db.Model):
+
+    # vmid riservati dal portale prima del clone, al posto di cluster/nextid (utils/vmids.py)
+    # stati: RESERVED (clone in corso) -> IN_USE (container creato) -> RELEASED (container eliminato, riutilizzabile)
+    vmid = db.Column(db.Integer, primary_key=True, autoincrement=False)
+
+    status = db.Column(db.String(20), nullable=False, default='RESERVED')
+    node = db.Column(db.String(50), nullable=True)
+    vm_request_id = db.Column(db.Integer, db.ForeignKey('vm_request.id'), nullable=True)
+    lease_ts = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    release_ts = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        # riuso dei vmid rilasciati, dal rilascio più vecchio
+        db.Index('ix_vmid_reservation_status_release_ts', 'status', 'release_ts'),
+    )
+
+    def __repr__(self):
+        return f'<VmidReservation {self.vmid} status={self.status} node={self.node} vm_request_id={self.vm_request_id}>'
+
+class TemplateReplica(db.Model):
+
+    # copie del template master su ogni nodo/storage, per clonare sempre in locale (utils/templates.py)
+    # chiave: vmid del template master (i tipi di VM con lo stesso template condividono le repliche)
+    # stati: SYNCING (copia in corso) -> READY -> STALE (il master è cambiato) -> SYNCING ... / FAILED
+    # RETIRED: replica sostituita, da eliminare su Proxmox (può avere ancora linked clone)
+    id = db.Column(db.Integer, primary_key=True)
+
+    master_vmid = db.Column(db.Integer, nullable=False)
+    node = db.Column(db.String(50), nullable=False)
+    storage = db.Column(db.String(50), nullable=False)
+    # vmid della replica READY (per il nodo/storage del master coincide con master_vmid)
+    vmid = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='SYNCING')
+    # digest della configurazione del master da cui è stata copiata la replica
+    master_digest = db.Column(db.String(64), nullable=True)
+    # lo storage supporta i linked clone (lvmthin, zfspool, rbd)
+    linked = db.Column(db.Boolean, nullable=False, default=False)
+    last_error = db.Column(db.Text, nullable=True)
+    sync_ts = db.Column(db.DateTime, nullable=True)
+    add_ts = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+
+    __table_args__ = (
+        # una sola replica attiva per template, nodo e storage; ricerca della sorgente del clone
+        # (le repliche "RETIRED" aspettano di essere eliminate e non contano)
+        db.Index('ix_template_replica_master_node_storage', 'master_vmid', 'node', 'storage', unique=True,
+                 sqlite_where=db.text("status != 'RETIRED'"), postgresql_where=db.text("status != 'RETIRED'")),
+    )
+
+    def __repr__(self):
+        return f'<TemplateReplica {self.master_vmid}@{self.node}/{self.storage} vmid={self.vmid} status={self.status}>'
+
+class TableVersion(db.Model):
+
+    # contatore delle modifiche per tabella, incrementato al commit della transazione delle modifiche (utils/versions.py)
+    # usato per gli ETag / Last-Modified dell'API JSON (blueprints/api.py)
+    table_name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    change_ts = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+
+    def __repr__(self):
+        return f'<TableVersion {self.table_name} version={self.version}>'
+
+# tabelle con contatore delle modifiche
+VERSIONED_TABLES = ("user", "vm_type", "vm_request", "vm_credentials")
+
+# ultima migrazione dello schema creato all'avvio dalle versioni precedenti (init_db / create_all)
+LEGACY_REVISION = "0206f17e74a4"
+
+
+def check_schema() -> None:
+
+    """
+    Controlla che il DB non sia uno di quelli creati dalle versioni precedenti senza migrazioni:
+    tabelle presenti ma nessuna alembic_version e tabelle più recenti mancanti.
+    Su un DB così "flask db stamp head" segnerebbe come applicate migrazioni mai eseguite:
+    va prima allineato a LEGACY_REVISION e poi aggiornato.
+    Solleva RuntimeError con i comandi da eseguire
+
+    """
+
+    tabelle = set(db.inspect(db.engine).get_table_names())
+    if "alembic_version" in tabelle or "user" not in tabelle:
+        return
+    mancanti = sorted(set(db.metadata.tables) - tabelle)
+    if mancanti:
+        raise RuntimeError(
+            f"Database creato da una versione precedente del portale (mancano {', '.join(mancanti)}): "
+            f"eseguire una volta 'flask --app app db stamp {LEGACY_REVISION}' e poi 'flask --app app db upgrade'"
+        )
+
+
+def seed_db() -> dict:
+
+    """
+    Inserisce i dati iniziali se mancano: ruoli admin e user, utente admin (PORTAL_ADMIN_USERNAME),
+    tipi di VM di esempio e contatori delle tabelle esposte dall'API.
+    Idempotente: rieseguirlo non duplica nulla. Una query per tipo di dato e un solo commit
+    Le tabelle devono già esistere ("flask db upgrade"): un DB delle versioni precedenti viene rifiutato (check_schema)
+    Ritorna quanti record sono stati aggiunti per tipo
+
+    """
+
+    check_schema()
+    aggiunti = {"ruoli": 0, "utenti": 0, "tipi_vm": 0, "contatori": 0}
+
+    # Verifica se i ruoli esistono già
+    ruoli = {r.name: r for r in db.session.execute(
+        db.select(Role).where(Role.name.in_(("admin", "user")))
+    ).scalars()}
+    for name in ("admin", "user"):
+        if name not in ruoli:
+            ruoli[name] = Role(name=name)
+            db.session.add(ruoli[name])
+            aggiunti["ruoli"] += 1
 
     # Verifica se l'utente admin esiste già
-    if not db.session.execute(db.select(User).filter_by(username='admin')).scalars().first():
-        admin_user = User(username=os.getenv("PORTAL_ADMIN_USERNAME"), email="admin@example.com")
+    username = os.getenv("PORTAL_ADMIN_USERNAME", "admin")
+    if not db.session.execute(db.select(User.id).filter_by(username=username)).first():
+        admin_user = User(username=username, email="admin@example.com")
         admin_user.set_password(os.getenv("PORTAL_ADMIN_PASSWORD", "Admin$00"))
 
         # Aggiunge il ruolo 'admin' all'utente
-        admin_role = db.session.execute(db.select(Role).filter_by(name='admin')).scalars().first()
-        admin_user.roles.append(admin_role)
+        admin_user.roles.append(ruoli["admin"])
 
         db.session.add(admin_user)
-        db.session.commit()
-
+        aggiunti["utenti"] += 1
 
     # Aggiungi tipi di VM di esempio se non esistono
-    if not db.session.execute(db.select(VmType)).scalars().first():
-        bronze = VmType(name='bronze', cores=1, ram=512, disk=10, template_vmid=int(os.getenv("PROXMOX_TEMPLATE_ID", "1102")))
-        silver = VmType(name='silver', cores=2, ram=1024, disk=15, template_vmid=int(os.getenv("PROXMOX_TEMPLATE_ID", "1102")))
-        gold = VmType(name='gold', cores=4, ram=2048, disk=20, template_vmid=int(os.getenv("PROXMOX_TEMPLATE_ID", "1102")))
-
-        db.session.add_all([bronze, silver, gold])
-        db.session.commit()
\ No newline at end of file
+    if not db.session.execute(db.select(VmType.id).limit(1)).first():
+        template_vmid = int(os.getenv("PROXMOX_TEMPLATE_ID", "1102"))
+        db.session.add_all([
+            VmType(name='bronze', cores=1, ram=512, disk=10, template_vmid=template_vmid),
+            VmType(name='silver', cores=2, ram=1024, disk=15, template_vmid=template_vmid),
+            VmType(name='gold', cores=4, ram=2048, disk=20, template_vmid=template_vmid),
+        ])
+        aggiunti["tipi_vm"] += 3
+
+    # contatori delle modifiche delle tabelle esposte dall'API
+    esistenti = set(db.session.execute(db.select(TableVersion.table_name)).scalars())
+    mancanti = [TableVersion(table_name=name, version=0) for name in VERSIONED_TABLES if name not in esistenti]
+    db.session.add_all(mancanti)
+    aggiunti["contatori"] += len(mancanti)
+
+    db.session.commit()
+    return aggiunti
+
+
+# comando "flask seed": dati iniziali, da eseguire dopo "flask db upgrade"
+@click.command("seed")
+@with_appcontext
+def seed_command() -> None:
+    try:
+        aggiunti = seed_db()
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(", ".join(f"{k}={v}" for k, v in aggiunti.items()) + " aggiunti")
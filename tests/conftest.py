@@ -0,0 +1,47 @@
+# tests/conftest.py
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# prima di importare il portale: niente servizi in background né Proxmox
+os.environ.update({
+    "PORTAL_ADMIN_USERNAME": "admin",
+    "PORTAL_ADMIN_PASSWORD": "Admin$00",
+    "PORTAL_WORKERS": "0",
+    "PORTAL_POOL_MANAGER": "0",
+    "PORTAL_TEMPLATE_SYNC": "0",
+    "PROXMOX_SNAPSHOT_REFRESH": "0",
+})
+
+import pytest
+
+
+@pytest.fixture
+def app(tmp_path):
+    # un DB SQLite nuovo per ogni test, con tabelle e dati iniziali
+    from app import create_app
+    from model.connection import db
+    from model.model import seed_db
+    from utils.principals import invalidate_principal
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'portal.db'}", "TESTING": True},
+                     services=False)
+    with app.app_context():
+        db.create_all()
+        seed_db()
+        invalidate_principal()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login_as(client, user_id: int) -> None:
+    # sessione di Flask-Login senza passare dal form (e dall'hash della password)
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(user_id)
+        sess["_fresh"] = True
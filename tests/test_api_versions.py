@@ -0,0 +1,92 @@
+# tests/test_api_versions.py
+import os
+from conftest import login_as
+from model.connection import db
+from model.model import User, TableVersion, VERSIONED_TABLES
+
+
+def _admin_id() -> int:
+    return db.session.execute(db.select(User.id).filter_by(username="admin")).scalar_one()
+
+
+def test_etag_changes_when_row_changes(client):
+    login_as(client, _admin_id())
+
+    prima = client.get("/api/v1/users")
+    assert prima.status_code == 200 and prima.headers["ETag"]
+    assert client.get("/api/v1/users", headers={"If-None-Match": prima.headers["ETag"]}).status_code == 304
+
+    admin = db.session.get(User, _admin_id())
+    admin.email = "admin@portal.local"
+    db.session.commit()
+
+    dopo = client.get("/api/v1/users", headers={"If-None-Match": prima.headers["ETag"]})
+    assert dopo.status_code == 200
+    assert dopo.headers["ETag"] != prima.headers["ETag"]
+    assert "admin@portal.local" in dopo.get_data(as_text=True)
+
+
+def test_no_conditional_response_without_counter(client):
+    login_as(client, _admin_id())
+    etag = client.get("/api/v1/users").headers["ETag"]
+
+    # DB senza righe dei contatori: nessun ETag e mai un 304
+    db.session.execute(db.delete(TableVersion))
+    db.session.commit()
+
+    r = client.get("/api/v1/users", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert "ETag" not in r.headers
+
+
+def test_migrations_create_counters(tmp_path):
+    from flask_migrate import Migrate, upgrade
+    from app import create_app
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'migrato.db'}"}, services=False)
+    Migrate(app, db, directory=os.path.join(os.path.dirname(os.path.dirname(__file__)), "migrations"))
+    with app.app_context():
+        upgrade()
+        contatori = set(db.session.execute(db.select(TableVersion.table_name)).scalars())
+        db.session.remove()
+        db.engine.dispose()
+
+    assert contatori == set(VERSIONED_TABLES)
+
+
+def _version(table: str) -> int:
+    return db.session.execute(db.select(TableVersion.version).filter_by(table_name=table)).scalar_one()
+
+
+def test_counter_ignores_conditional_update_without_rows(app):
+    from model.model import VmType, VmRequest
+    from utils.jobs import enqueue_many
+
+    req = VmRequest(user_id=_admin_id(), vm_type_id=db.session.execute(db.select(VmType.id)).scalars().first())
+    db.session.add(req)
+    db.session.commit()
+    prima = _version("vm_request")
+
+    # UPDATE condizionale a vuoto (la richiesta non è FAILED) seguito da commit: gli ETag restano validi
+    db.session.execute(db.update(VmRequest).where(VmRequest.id == req.id, VmRequest.status == "FAILED")
+                       .values(status="QUEUED"))
+    db.session.commit()
+    assert _version("vm_request") == prima
+
+    # UPDATE ... RETURNING che tocca la richiesta PENDING
+    assert enqueue_many([req.id]) == [req.id]
+    assert _version("vm_request") == prima + 1
+    assert enqueue_many([req.id]) == []
+    assert _version("vm_request") == prima + 1
+
+
+def test_counter_not_bumped_on_rollback(app):
+    prima = _version("user")
+
+    admin = db.session.get(User, _admin_id())
+    admin.email = "annullato@portal.local"
+    db.session.flush()
+    db.session.rollback()
+    db.session.commit()
+
+    assert _version("user") == prima
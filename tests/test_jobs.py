@@ -0,0 +1,133 @@
+# tests/test_jobs.py
+import threading
+from datetime import timedelta
+
+import pytest
+
+import utils.jobs as jobs
+from model.connection import db
+from model.model import User, VmType, VmRequest, ProvisioningJob
+
+
+def _accoda(n: int, status: str = "QUEUED") -> list:
+    # n richieste dell'admin con il relativo job, tutti nello stato indicato
+    user_id = db.session.execute(db.select(User.id).filter_by(username="admin")).scalar_one()
+    vm_type_id = db.session.execute(db.select(VmType.id).limit(1)).scalar_one()
+    richieste = [VmRequest(user_id=user_id, vm_type_id=vm_type_id, status=status) for _ in range(n)]
+    db.session.add_all(richieste)
+    db.session.flush()
+    job_list = [ProvisioningJob(vm_request_id=r.id, status=status) for r in richieste]
+    db.session.add_all(job_list)
+    db.session.commit()
+    return job_list
+
+
+def test_two_workers_never_claim_the_same_job(app, monkeypatch):
+    monkeypatch.setattr(jobs, "MAX_PARALLEL", 0)
+    totale = 30
+    _accoda(totale)
+
+    presi = {}
+    errori = []
+    partenza = threading.Barrier(4)
+
+    def worker(nome: str):
+        # ogni thread ha il suo app context, quindi la sua sessione e la sua connessione al DB
+        with app.app_context():
+            try:
+                partenza.wait()
+                while (job := jobs.claim_next_job(nome)) is not None:
+                    presi.setdefault(job.id, []).append(nome)
+            except Exception as e:
+                errori.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=worker, args=(f"test:{i}",)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=60)
+
+    assert not errori
+    assert len(presi) == totale
+    assert all(len(nomi) == 1 for nomi in presi.values())
+
+    db.session.expire_all()
+    for job in ProvisioningJob.query.all():
+        assert job.status == "RUNNING" and job.attempts == 1
+        assert job.worker_id == presi[job.id][0]
+
+
+def test_claim_respects_max_parallel(app, monkeypatch):
+    monkeypatch.setattr(jobs, "MAX_PARALLEL", 3)
+    _accoda(5)
+
+    presi = [jobs.claim_next_job("test:a") for _ in range(5)]
+    assert [job is not None for job in presi] == [True, True, True, False, False]
+
+    # un job che finisce libera un posto
+    presi[0].status = "DONE"
+    db.session.commit()
+    assert jobs.claim_next_job("test:b") is not None
+    assert jobs.claim_next_job("test:b") is None
+
+
+def test_expired_lease_is_claimed_again(app, monkeypatch):
+    monkeypatch.setattr(jobs, "MAX_PARALLEL", 0)
+    job, = _accoda(1)
+
+    assert jobs.claim_next_job("altro-host:1:1:0").id == job.id
+    # lease ancora valido: nessun altro worker lo prende
+    assert jobs.claim_next_job("test:b") is None
+
+    job.locked_ts = jobs.utcnow() - timedelta(seconds=jobs.LEASE_S + 1)
+    db.session.commit()
+
+    ripreso = jobs.claim_next_job("test:b")
+    assert ripreso.id == job.id
+    assert ripreso.worker_id == "test:b" and ripreso.attempts == 2
+
+
+def test_recover_interrupted_jobs_requeues_dead_worker(app, monkeypatch):
+    monkeypatch.setattr(jobs, "MAX_PARALLEL", 0)
+    morto, vivo = _accoda(2, status="PROVISIONING")
+    for job in (morto, vivo):
+        job.status = "RUNNING"
+        job.locked_ts = jobs.utcnow()
+    # worker di un processo precedente di questo host (stesso pid, avvio diverso) e worker attuale
+    host, pid, _ = jobs._PROCESSO.split(":")
+    morto.worker_id = f"{host}:{pid}:0:0"
+    vivo.worker_id = f"{jobs._PROCESSO}:0"
+    db.session.commit()
+
+    assert jobs.recover_interrupted_jobs() == 1
+
+    db.session.expire_all()
+    assert (morto.status, morto.worker_id, morto.vm_request.status) == ("QUEUED", None, "QUEUED")
+    assert (vivo.status, vivo.vm_request.status) == ("RUNNING", "PROVISIONING")
+
+
+@pytest.mark.parametrize("status", ["PENDING", "QUEUED", "PROVISIONING", "READY", "REJECTED"])
+def test_retry_job_ignores_requests_not_failed(app, status):
+    job, = _accoda(1, status=status)
+
+    assert jobs.retry_job(job.vm_request) is False
+
+    db.session.expire_all()
+    assert job.vm_request.status == status and job.status == status
+
+
+def test_retry_job_requeues_failed(app):
+    job, = _accoda(1, status="FAILED")
+    job.attempts = 3
+    job.worker_id = "test:a"
+    db.session.commit()
+
+    assert jobs.retry_job(job.vm_request) is True
+
+    db.session.expire_all()
+    assert (job.status, job.vm_request.status, job.worker_id) == ("QUEUED", "QUEUED", None)
+    assert job.max_attempts == 3 + jobs.MAX_ATTEMPTS
+    # già rimesso in coda: un secondo "Riprova" non fa nulla
+    assert jobs.retry_job(job.vm_request) is False
@@ -0,0 +1,34 @@
+# tests/test_migrations.py
+import os
+
+import pytest
+from flask_migrate import Migrate, upgrade, stamp
+
+from model.connection import db
+from model.model import LEGACY_REVISION, check_schema, seed_db
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+
+
+def test_legacy_database_is_refused_until_migrated(tmp_path):
+    from app import create_app
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'vecchio.db'}"}, services=False)
+    Migrate(app, db, directory=MIGRATIONS)
+    with app.app_context():
+        # DB come lo creavano le versioni precedenti all'avvio: schema di LEGACY_REVISION, senza alembic_version
+        upgrade(revision=LEGACY_REVISION)
+        db.session.execute(db.text("DROP TABLE alembic_version"))
+        db.session.commit()
+
+        with pytest.raises(RuntimeError, match=f"db stamp {LEGACY_REVISION}"):
+            seed_db()
+
+        stamp(revision=LEGACY_REVISION)
+        upgrade()
+        check_schema()
+        assert seed_db()["contatori"] == 0
+        assert "provisioning_job" in db.inspect(db.engine).get_table_names()
+
+        db.session.remove()
+        db.engine.dispose()
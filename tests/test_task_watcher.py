@@ -0,0 +1,95 @@
+# tests/test_task_watcher.py
+import asyncio
+
+import pytest
+
+from utils.task_watcher import TaskWatcher, MAX_POLL_ERRORS
+
+
+class _Chiamata:
+    # un endpoint dell'API finta: get() ritorna il valore o solleva l'errore
+    def __init__(self, risposta):
+        self.risposta = risposta
+
+    def get(self, **kwargs):
+        if isinstance(self.risposta, Exception):
+            raise self.risposta
+        return self.risposta
+
+
+class FakeProxmox:
+
+    """API Proxmox finta: lista delle task per nodo e stato delle singole task (oppure errori)."""
+
+    def __init__(self, lista, stati=None):
+        self.lista = lista
+        self.stati = stati or {}
+        self.chiamate_lista = 0
+
+    def nodes(self, node):
+        return self
+
+    @property
+    def tasks(self):
+        proxmox = self
+
+        class _Tasks:
+            def get(self, **kwargs):
+                proxmox.chiamate_lista += 1
+                return _Chiamata(proxmox.lista).get()
+
+            def __call__(self, upid):
+                return type("_Task", (), {"status": _Chiamata(proxmox.stati[upid])})()
+
+        return _Tasks()
+
+
+def _upid(n: int) -> str:
+    return f"UPID:pve1:0000{n:04X}:00000000:6700000{n}:vzclone:100:root@pam:"
+
+
+def _run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+def test_tasks_fail_after_repeated_poll_errors():
+    proxmox = FakeProxmox(RuntimeError("403 Forbidden"))
+    watcher = TaskWatcher(min_interval_s=0.01, max_interval_s=0.01)
+
+    async def aspetta():
+        return await asyncio.gather(*(watcher.wait(proxmox, "pve1", _upid(n), timeout_s=300) for n in (1, 2)),
+                                    return_exceptions=True)
+
+    esiti = _run(aspetta())
+
+    assert all(isinstance(e, RuntimeError) and "403 Forbidden" in str(e) for e in esiti)
+    assert proxmox.chiamate_lista == MAX_POLL_ERRORS
+    assert watcher.pending() == 0
+
+
+def test_bad_upid_fails_alone():
+    buona, cattiva = _upid(1), _upid(2)
+    # nessuna delle due è nella lista del nodo: dopo MISSING_TICKS giri si chiede lo stato singolo
+    proxmox = FakeProxmox([], {buona: {"status": "stopped", "exitstatus": "OK"},
+                               cattiva: RuntimeError("500 no such task")})
+    watcher = TaskWatcher(min_interval_s=0.01, max_interval_s=0.01)
+
+    async def aspetta():
+        return await asyncio.gather(watcher.wait(proxmox, "pve1", buona, timeout_s=300),
+                                    watcher.wait(proxmox, "pve1", cattiva, timeout_s=300),
+                                    return_exceptions=True)
+
+    ok, errore = _run(aspetta())
+
+    assert ok == "OK"
+    assert isinstance(errore, RuntimeError) and "no such task" in str(errore)
+    assert watcher.pending() == 0
+
+
+def test_failed_exitstatus_raises():
+    upid = _upid(1)
+    proxmox = FakeProxmox([{"upid": upid, "endtime": 1, "status": "command failed"}])
+    watcher = TaskWatcher(min_interval_s=0.01, max_interval_s=0.01)
+
+    with pytest.raises(RuntimeError, match="command failed"):
+        _run(watcher.wait(proxmox, "pve1", upid))
@@ -0,0 +1,165 @@
+# tools/query_plans.py
+"""
+Stampa i piani di esecuzione (SQLite: EXPLAIN QUERY PLAN, Postgres: EXPLAIN) di tutte le query
+emesse dalle pagine del portale, per vedere subito se una query torna a fare una scansione completa.
+
+Le pagine vengono eseguite con il test client di Flask e le query catturate dal motore SQLAlchemy.
+Senza --database-url usa un DB SQLite temporaneo popolato con dati sintetici (ed esegue anche i flussi
+che scrivono: login, signup, richiesta VM, rifiuto); con --database-url esegue solo le pagine in lettura.
+
+Uso:
+    python tools/query_plans.py [--rows 5000] [--database-url postgresql://...] [--fail-on-scan]
+"""
+import os, sys, argparse, tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def is_full_scan(riga: str) -> bool:
+    # SQLite: "SCAN tabella" senza indice (SCAN ... USING INDEX è una lettura ordinata dell'indice)
+    # Postgres: "Seq Scan on tabella"
+    riga = riga.strip()
+    return (riga.startswith("SCAN ") and "USING" not in riga) or "Seq Scan" in riga
+
+
+def seed(db, rows: int) -> None:
+
+    """
+    Popola il DB temporaneo: un utente ogni 10 richieste, richieste in tutti gli stati
+    distribuite nell'ultimo anno, credenziali per le richieste READY
+
+    """
+
+    from werkzeug.security import generate_password_hash
+    from model.model import User, Role, VmType, VmRequest, VmCredentials
+
+    role = Role.query.filter_by(name="user").first()
+    password_hash = generate_password_hash("password")
+    vm_types = VmType.query.all()
+    stati = ["PENDING", "QUEUED", "PROVISIONING", "READY", "FAILED", "REJECTED"]
+
+    utenti = []
+    for i in range(max(rows // 10, 1)):
+        user = User(username=f"utente{i:05d}", email=f"utente{i:05d}@example.com", password_hash=password_hash)
+        user.roles.append(role)
+        utenti.append(user)
+    db.session.add_all(utenti)
+    db.session.flush()
+
+    inizio = datetime.now() - timedelta(days=365)
+    for i in range(rows):
+        req = VmRequest(user_id=utenti[i % len(utenti)].id, vm_type_id=vm_types[i % len(vm_types)].id,
+                        status=stati[i % len(stati)], request_ts=inizio + timedelta(minutes=i * 5))
+        db.session.add(req)
+        if req.status == "READY":
+            db.session.flush()
+            db.session.add(VmCredentials(vm_request_id=req.id, vmid=1000 + i, hostname=f"vm-u-{1000 + i}",
+                                         ip_address="192.168.56.10", username="u", password="p"))
+    db.session.commit()
+
+
+def explain(conn, dialect: str, statement: str, params) -> list:
+    if dialect == "sqlite":
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", params).fetchall()
+        return [row[-1] for row in rows]
+    rows = conn.exec_driver_sql(f"EXPLAIN {statement}", params).fetchall()
+    return [row[0] for row in rows]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Piani di esecuzione delle query del portale")
+    parser.add_argument("--database-url", help="DB da analizzare (default: SQLite temporaneo con dati sintetici)")
+    parser.add_argument("--rows", type=int, default=5000, help="Richieste sintetiche nel DB temporaneo")
+    parser.add_argument("--fail-on-scan", action="store_true", help="Esce con codice 1 se una query scansiona una tabella")
+    args = parser.parse_args()
+
+    temporaneo = not args.database_url
+    if temporaneo:
+        args.database_url = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "query-plans.db")
+
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("PORTAL_ADMIN_USERNAME", "admin")
+
+    from sqlalchemy import event
+    from app import create_app
+    from model.connection import db
+    from model.model import User, Role, VmRequest, seed_db
+
+    # niente thread in background: solo le query delle pagine
+    app = create_app(services=False)
+    catturate = {}
+    corrente = {"endpoint": None}
+
+    with app.app_context():
+        if temporaneo:
+            db.create_all()
+            seed_db()
+            seed(db, args.rows)
+
+        engine = db.engine
+        dialect = engine.dialect.name
+
+        admin = User.query.join(User.roles).filter(Role.name == "admin").first()
+        utente = User.query.join(User.roles).filter(Role.name == "user").first()
+        pendente = VmRequest.query.filter_by(status="PENDING").first()
+        ids = {"admin": admin.id if admin else None, "user": utente.id if utente else None}
+        email_utente = utente.email if utente else None
+        pendente_id = pendente.id if pendente else None
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def cattura(conn, cursor, statement, parameters, context, executemany):
+        if corrente["endpoint"] and statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            catturate.setdefault((corrente["endpoint"], statement), parameters)
+
+    client = app.test_client()
+
+    def visita(nome: str, method: str, url: str, ruolo: str = None, **kwargs):
+        if ruolo and ids.get(ruolo):
+            with client.session_transaction() as sess:
+                sess["_user_id"] = str(ids[ruolo])
+                sess["_fresh"] = True
+        corrente["endpoint"] = nome
+        try:
+            client.open(url, method=method, **kwargs)
+        finally:
+            corrente["endpoint"] = None
+
+    oggi = datetime.now().date()
+    visita("admin.get_richieste", "GET", "/admin/richieste", "admin")
+    visita("admin.get_richieste (status)", "GET", "/admin/richieste?status=PENDING", "admin")
+    visita("admin.get_richieste (date)", "GET", f"/admin/richieste?dal={oggi - timedelta(days=30)}&al={oggi}", "admin")
+    risposta = client.get("/admin/richieste")
+    if b"after=" in risposta.data:
+        after = risposta.data.split(b"after=", 1)[1].split(b'"', 1)[0].decode()
+        visita("admin.get_richieste (pagina 2)", "GET", f"/admin/richieste?after={after}", "admin")
+    visita("admin.get_utenti", "GET", "/admin/utenti", "admin")
+    visita("user.get_lista_vm", "GET", "/user/lista", "user")
+
+    if temporaneo:
+        visita("auth.login_post", "POST", "/auth/login", data={"email": email_utente, "password": "password"})
+        visita("auth.signup_post", "POST", "/auth/signup",
+               data={"username": "nuovoutente", "email": "nuovo@example.com", "password": "password"})
+        visita("user.crea_vm", "POST", "/user/creazione_vm", "user", data={"vm_type_id": "1"})
+        if pendente_id:
+            visita("admin.rifiuta", "POST", f"/admin/richieste/{pendente_id}/rifiuta", "admin")
+
+    scansioni = 0
+    with engine.connect() as conn:
+        for (endpoint, statement), params in catturate.items():
+            piano = explain(conn, dialect, statement, params)
+            scan = [riga for riga in piano if is_full_scan(riga)]
+            scansioni += bool(scan)
+
+            print(f"=== {endpoint}{'   [SCAN]' if scan else ''}")
+            print("    " + " ".join(statement.split()))
+            for riga in piano:
+                print(f"      {riga}")
+            print()
+
+    print(f"{len(catturate)} query analizzate, {scansioni} con scansione completa ({dialect})")
+    return 1 if args.fail_on_scan and scansioni else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
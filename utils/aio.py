@@ -0,0 +1,118 @@
+# utils/aio.py
+import os, asyncio, threading, functools, logging
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.metrics import gauge
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# coroutine eseguite insieme al massimo da run_pipelines (default)
+PIPELINES = int(os.getenv("PORTAL_ASYNC_PIPELINES", "200"))
+# thread per le operazioni che restano bloccanti (comandi SSH con paramiko)
+BLOCKING_THREADS = int(os.getenv("PORTAL_ASYNC_THREADS", "16"))
+
+
+class LoopDriver:
+
+    """
+    Event loop asyncio in un thread dedicato, condiviso dal processo.
+    Le attese del provisioning (task Proxmox, IP del container, porte, login SSH) girano qui
+    come coroutine: centinaia di attese contemporanee costano un solo thread invece di uno per VM.
+    Le funzioni sincrone di utils/proxmox.py, utils/interfaces.py e utils/ssh.py sono wrapper
+    che eseguono la versione async su questo loop e ne aspettano il risultato (run)
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._in_corso = 0
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                loop = asyncio.new_event_loop()
+                pronto = threading.Event()
+
+                def _run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(pronto.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=_run, name="asyncio-driver", daemon=True)
+                self._thread.start()
+                pronto.wait()
+                self._loop = loop
+            return self._loop
+
+    def submit(self, coro):
+        """Avvia la coroutine sul loop e ritorna subito un concurrent.futures.Future."""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        with self._lock:
+            self._in_corso += 1
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future) -> None:
+        with self._lock:
+            self._in_corso -= 1
+
+    def run(self, coro):
+
+        """
+        Esegue la coroutine sul loop e ne ritorna il risultato (o alza la sua eccezione)
+        Non va chiamata da una coroutine del loop stesso: lì si usa await
+
+        """
+
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("run() chiamata dal thread dell'event loop: usare await")
+        return self.submit(coro).result()
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._in_corso
+
+
+_driver = LoopDriver()
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_THREADS, thread_name_prefix="aio-blocking")
+
+gauge("portal_async_pending", "Coroutine in corso sul loop asyncio condiviso", lambda: _driver.pending())
+
+
+def loop_driver() -> LoopDriver:
+    return _driver
+
+
+def run_sync(coro):
+    """Esegue una coroutine sul loop condiviso dal codice sincrono (worker, pool) e ne ritorna il risultato."""
+    return _driver.run(coro)
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Esegue una funzione bloccante (es. paramiko) nel pool di BLOCKING_THREADS thread senza fermare il loop."""
+    return await asyncio.get_running_loop().run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+async def run_pipelines(coros, limit: int = PIPELINES) -> list:
+
+    """
+    Esegue molte coroutine (es. un provisioning completo ciascuna) sullo stesso loop,
+    al massimo limit alla volta
+    Ritorna i risultati nello stesso ordine; una coroutine fallita non ferma le altre
+    e al suo posto viene ritornata l'eccezione
+
+    """
+
+    posti = asyncio.Semaphore(limit)
+
+    async def _una(coro):
+        async with posti:
+            return await coro
+
+    return await asyncio.gather(*(_una(c) for c in coros), return_exceptions=True)
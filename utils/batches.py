@@ -0,0 +1,104 @@
+# utils/batches.py
+from datetime import datetime, timedelta
+
+from model.connection import db
+from model.model import VmRequest, ProvisioningJob, ApprovalBatch, User
+from utils.jobs import enqueue_many, utcnow
+
+
+# stati finali di una richiesta messa in coda
+STATI_FINALI = ("READY", "FAILED")
+
+
+def pending_ids(dal: str = None, al: str = None, vm_type_id: int = None, user_id: int = None) -> list:
+
+    """
+    Id delle richieste PENDING che corrispondono al filtro, dalla più vecchia
+    dal/al sono date ISO (YYYY-MM-DD) come nei filtri della pagina delle richieste
+    Alza ValueError se una data non è valida
+
+    """
+
+    stmt = db.select(VmRequest.id).where(VmRequest.status == "PENDING")
+    if dal:
+        stmt = stmt.where(VmRequest.request_ts >= datetime.fromisoformat(dal))
+    if al:
+        stmt = stmt.where(VmRequest.request_ts < datetime.fromisoformat(al) + timedelta(days=1))
+    if vm_type_id:
+        stmt = stmt.where(VmRequest.vm_type_id == vm_type_id)
+    if user_id:
+        stmt = stmt.where(VmRequest.user_id == user_id)
+
+    return list(db.session.execute(stmt.order_by(VmRequest.request_ts, VmRequest.id)).scalars())
+
+
+def create_batch(admin_id: int, req_ids: list, description: str = None) -> ApprovalBatch:
+
+    """
+    Approva in blocco le richieste indicate: crea il lotto e mette in coda quelle ancora PENDING
+    (le altre vengono saltate). Il provisioning viene eseguito dai worker con i limiti di
+    parallelismo per cluster e per nodo (utils/jobs.py)
+    Ritorna il lotto con il numero di richieste effettivamente messe in coda,
+    oppure None se nessuna delle richieste era ancora PENDING
+
+    """
+
+    batch = ApprovalBatch(admin_id=admin_id, description=(description or "")[:255] or None, total=0)
+    db.session.add(batch)
+    db.session.commit()
+
+    batch.total = len(enqueue_many(list(dict.fromkeys(req_ids)), batch_id=batch.id))
+    if not batch.total:
+        db.session.delete(batch)
+        db.session.commit()
+        return None
+
+    db.session.commit()
+    return batch
+
+
+def batch_progress(batch: ApprovalBatch) -> dict:
+
+    """
+    Avanzamento di un'approvazione in blocco: richieste per stato, completate (READY o FAILED),
+    velocità (completate al minuto) e stima del tempo rimanente, con una sola query raggruppata
+
+    """
+
+    righe = db.session.execute(
+        db.select(VmRequest.status, db.func.count())
+        .join(ProvisioningJob, ProvisioningJob.vm_request_id == VmRequest.id)
+        .where(ProvisioningJob.batch_id == batch.id)
+        .group_by(VmRequest.status)
+    ).all()
+    stati = dict(righe)
+
+    completate = sum(stati.get(s, 0) for s in STATI_FINALI)
+    trascorsi = max((utcnow() - batch.add_ts).total_seconds(), 0) if batch.add_ts else 0
+    al_minuto = completate / trascorsi * 60 if trascorsi and completate else 0
+    rimanenti = batch.total - completate
+
+    return {
+        "id": batch.id,
+        "description": batch.description,
+        "add_ts": batch.add_ts.isoformat() if batch.add_ts else None,
+        "total": batch.total,
+        "statuses": stati,
+        "completed": completate,
+        "percent": round(completate / batch.total * 100, 1) if batch.total else 100.0,
+        "elapsed_s": round(trascorsi, 1),
+        "per_min": round(al_minuto, 1),
+        "eta_s": round(rimanenti / al_minuto * 60, 1) if al_minuto and rimanenti > 0 else None,
+    }
+
+
+def batch_failures(batch: ApprovalBatch, limit: int = 50) -> list:
+    """Richieste fallite del lotto con utente ed errore del job (al massimo limit)."""
+    return db.session.execute(
+        db.select(VmRequest.id, User.username, ProvisioningJob.last_error)
+        .join(ProvisioningJob, ProvisioningJob.vm_request_id == VmRequest.id)
+        .join(User, VmRequest.user_id == User.id)
+        .where(ProvisioningJob.batch_id == batch.id, VmRequest.status == "FAILED")
+        .order_by(VmRequest.id)
+        .limit(limit)
+    ).all()
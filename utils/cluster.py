@@ -0,0 +1,177 @@
+# utils/cluster.py
+import os, time, threading, logging
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# durata massima della fotografia del cluster prima di rileggerla (secondi)
+SNAPSHOT_TTL_S = float(os.getenv("PROXMOX_SNAPSHOT_TTL_S", "10"))
+# aggiornamento periodico in background della fotografia (0 = solo quando serve)
+SNAPSHOT_REFRESH = os.getenv("PROXMOX_SNAPSHOT_REFRESH", "1") != "0"
+# oltre questa età la fotografia non viene più mostrata nelle pagine (secondi)
+SNAPSHOT_MAX_STALE_S = float(os.getenv("PROXMOX_SNAPSHOT_MAX_STALE_S", "60"))
+# con l'API non raggiungibile l'errore dell'aggiornamento viene registrato al massimo una volta in questo intervallo
+ERROR_LOG_INTERVAL_S = 60
+
+
+class ClusterSnapshot:
+
+    """
+    Fotografia del cluster letta con due sole chiamate API:
+    /cluster/resources (nodi, storage, container) e /cluster/tasks (task in corso per nodo).
+    Viene condivisa da tutte le richieste finché non scade il TTL.
+
+    """
+
+    def __init__(self, resources: list, tasks: list):
+        self.ts = time.monotonic()
+        self.resources = resources or []
+        self.nodes = {r["node"]: r for r in self.resources if r.get("type") == "node"}
+        self.storages = {(r["node"], r["storage"]): r for r in self.resources if r.get("type") == "storage"}
+        self.guests = {int(r["vmid"]): r for r in self.resources if r.get("type") in ("lxc", "qemu") and "vmid" in r}
+
+        # container piazzati dal portale dopo la lettura (vedi utils/placement.py)
+        self.placed = {}
+
+        self.running_tasks = {}
+        for t in tasks or []:
+            if "endtime" not in t and t.get("node"):
+                self.running_tasks[t["node"]] = self.running_tasks.get(t["node"], 0) + 1
+
+    def age_s(self) -> float:
+        return time.monotonic() - self.ts
+
+    def vm_node(self, vmid: int):
+        guest = self.guests.get(int(vmid))
+        return guest.get("node") if guest else None
+
+    def guests_on(self, node: str) -> int:
+        guests = sum(1 for g in self.guests.values() if g.get("node") == node and not g.get("template"))
+        return guests + self.placed.get(node, 0)
+
+
+_snapshot = None
+_lock = threading.Lock()
+_refreshing = threading.Lock()
+# ultimo errore registrato dall'aggiornamento in background (monotonic), None dopo un aggiornamento riuscito
+_last_error_log = None
+
+
+def cluster_snapshot(max_age_s: float = SNAPSHOT_TTL_S) -> ClusterSnapshot:
+
+    """
+    Ritorna la fotografia del cluster, rileggendola dall'API solo se più vecchia di max_age_s
+    Un solo thread alla volta la rilegge, gli altri usano quella appena letta
+
+    """
+
+    global _snapshot
+
+    snap = _snapshot
+    if snap is not None and snap.age_s() < max_age_s:
+        return snap
+
+    with _lock:
+        snap = _snapshot
+        if snap is not None and snap.age_s() < max_age_s:
+            return snap
+
+        from utils.proxmox import proxmox_client
+        proxmox = proxmox_client()
+        _snapshot = ClusterSnapshot(proxmox.cluster.resources.get(), proxmox.cluster.tasks.get())
+        return _snapshot
+
+
+def invalidate_snapshot() -> None:
+    global _snapshot
+    _snapshot = None
+
+
+def _refresh() -> None:
+    global _last_error_log
+
+    if not _refreshing.acquire(blocking=False):
+        return
+    try:
+        cluster_snapshot(max_age_s=SNAPSHOT_TTL_S / 2)
+        _last_error_log = None
+    except Exception as e:
+        now = time.monotonic()
+        if _last_error_log is None:
+            logger.exception("Aggiornamento della fotografia del cluster fallito")
+            _last_error_log = now
+        elif now - _last_error_log >= ERROR_LOG_INTERVAL_S:
+            logger.warning("Aggiornamento della fotografia del cluster ancora in errore: %s", e)
+            _last_error_log = now
+    finally:
+        _refreshing.release()
+
+
+def cached_snapshot(max_stale_s: float = SNAPSHOT_MAX_STALE_S):
+
+    """
+    Ritorna la fotografia già in memoria senza mai chiamare l'API né avviare thread (per le pagine web):
+    la tiene aggiornata il refresher in background (start_snapshot_refresher), oppure la rilegge
+    chi la usa per il placement. Se manca o è più vecchia di max_stale_s ritorna None
+
+    """
+
+    snap = _snapshot
+    if snap is None or snap.age_s() > max_stale_s:
+        return None
+    return snap
+
+
+def start_snapshot_refresher():
+
+    """
+    Avvia il thread che rilegge la fotografia del cluster ogni metà TTL,
+    così le pagine la trovano sempre già pronta (se PROXMOX_SNAPSHOT_REFRESH non è 0)
+
+    """
+
+    if not SNAPSHOT_REFRESH:
+        return None
+
+    def loop():
+        while True:
+            _refresh()
+            time.sleep(SNAPSHOT_TTL_S / 2)
+
+    thread = threading.Thread(target=loop, name="cluster-snapshot-refresher", daemon=True)
+    thread.start()
+    return thread
+
+
+def _durata(secondi: int) -> str:
+    giorni, resto = divmod(int(secondi), 86400)
+    ore, resto = divmod(resto, 3600)
+    minuti = resto // 60
+    if giorni:
+        return f"{giorni}g {ore}h"
+    if ore:
+        return f"{ore}h {minuti}m"
+    return f"{minuti}m"
+
+
+def guest_status(guest: dict) -> dict:
+
+    """
+    Stato di un container dalla fotografia: stato, uptime, CPU (%) e memoria (MB)
+    Con guest None (container non trovato) ritorna lo stato "sconosciuto"
+
+    """
+
+    if not guest:
+        return {"status": "sconosciuto", "uptime": "-", "cpu": "-", "mem": "-"}
+
+    running = guest.get("status") == "running"
+    mem_mb = int(guest.get("mem") or 0) // 1024 ** 2
+    maxmem_mb = int(guest.get("maxmem") or 0) // 1024 ** 2
+    return {
+        "status": guest.get("status", "sconosciuto"),
+        "uptime": _durata(guest.get("uptime") or 0) if running else "-",
+        "cpu": f"{float(guest.get('cpu') or 0) * 100:.1f}%" if running else "-",
+        "mem": f"{mem_mb}/{maxmem_mb} MB" if running else f"-/{maxmem_mb} MB",
+    }
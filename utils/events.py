@@ -0,0 +1,179 @@
+# utils/events.py
+import os, json, time, queue, threading, itertools
+from collections import deque
+
+from flask import Response
+from utils.metrics import counter, gauge
+from dotenv import load_dotenv
+load_dotenv()
+
+
+# eventi tenuti in memoria per chi si riconnette con Last-Event-ID
+BACKLOG = int(os.getenv("PORTAL_SSE_BACKLOG", "500"))
+# eventi in attesa per iscritto: oltre questo limite un client troppo lento viene scollegato (si riconnette)
+QUEUE_SIZE = int(os.getenv("PORTAL_SSE_QUEUE_SIZE", "100"))
+# ogni quanto inviare un commento di keepalive su uno stream senza eventi (secondi)
+KEEPALIVE_S = float(os.getenv("PORTAL_SSE_KEEPALIVE_S", "15"))
+# durata massima di uno stream: il browser si riconnette da solo (con Last-Event-ID) e libera il thread del server
+MAX_STREAM_S = float(os.getenv("PORTAL_SSE_MAX_S", "25"))
+# stream aperti insieme al massimo nel processo (ognuno occupa un thread del server, 0 = nessun limite)
+MAX_STREAMS = int(os.getenv("PORTAL_SSE_MAX_STREAMS", "20"))
+# oltre il limite il browser viene invitato a riprovare dopo questo intervallo (millisecondi)
+BUSY_RETRY_MS = 10000
+
+EVENTS_PUBLISHED = counter("portal_events_published_total", "Eventi pubblicati agli stream SSE", ("event",))
+EVENTS_DROPPED = counter("portal_events_dropped_total", "Iscritti SSE scollegati perché troppo lenti")
+STREAMS_REJECTED = counter("portal_sse_rejected_total", "Stream SSE rifiutati per il limite PORTAL_SSE_MAX_STREAMS")
+
+
+class Subscription:
+
+    """Coda degli eventi di un client SSE iscritto a uno o più topic."""
+
+    def __init__(self, topics: tuple):
+        self.topics = frozenset(topics)
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.closed = False
+
+    def get(self, timeout_s: float):
+        """Prossimo evento (id, tipo, dati) oppure None se non arriva niente entro timeout_s."""
+        try:
+            return self.queue.get(timeout=timeout_s)
+        except queue.Empty:
+            return None
+
+
+class Broker:
+
+    """
+    Pub/sub in memoria del processo: i worker pubblicano i cambi di stato e i passi
+    del provisioning, gli stream SSE aperti li ricevono sui topic a cui sono iscritti
+    ("admin" per tutte le richieste, "user:<id>" per quelle di un utente).
+    Gli ultimi BACKLOG eventi restano disponibili per le riconnessioni (Last-Event-ID)
+
+    """
+
+    def __init__(self, backlog: int = BACKLOG):
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self._history = deque(maxlen=backlog)
+        self._subs = set()
+
+    def publish(self, topics: tuple, event: str, data: dict) -> int:
+        with self._lock:
+            event_id = next(self._seq)
+            self._history.append((event_id, frozenset(topics), event, data))
+            iscritti = [s for s in self._subs if s.topics & set(topics)]
+
+        for sub in iscritti:
+            try:
+                sub.queue.put_nowait((event_id, event, data))
+            except queue.Full:
+                # il client non legge: lo si scollega, alla riconnessione recupera dal backlog
+                sub.closed = True
+                self.unsubscribe(sub)
+                EVENTS_DROPPED.inc()
+
+        EVENTS_PUBLISHED.inc(event=event)
+        return event_id
+
+    def subscribe(self, topics: tuple, last_id: int = None, limit: int = 0):
+        """Iscrive un client ai topic; ritorna None se ci sono già limit iscritti (0 = nessun limite)."""
+        sub = Subscription(topics)
+        with self._lock:
+            if limit and len(self._subs) >= limit:
+                return None
+            if last_id is not None:
+                # eventi persi durante la disconnessione (al massimo QUEUE_SIZE, i più recenti)
+                persi = [(i, e, d) for i, t, e, d in self._history if i > last_id and t & sub.topics]
+                for item in persi[-QUEUE_SIZE:]:
+                    sub.queue.put_nowait(item)
+            self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            self._subs.discard(sub)
+
+    def subscribers(self) -> int:
+        with self._lock:
+            return len(self._subs)
+
+
+broker = Broker()
+
+gauge("portal_sse_subscribers", "Stream SSE aperti", broker.subscribers)
+
+
+def request_topics(user_id: int) -> tuple:
+    return ("admin", f"user:{user_id}")
+
+
+def publish_status(req) -> None:
+    """Cambio di stato di una richiesta (da chiamare dopo il commit)."""
+    broker.publish(request_topics(req.user_id), "status", {
+        "id": req.id,
+        "status": req.status,
+        "ts": time.time(),
+    })
+
+
+def publish_statuses(rows, status: str) -> None:
+    """Stesso cambio di stato per più richieste, rows = [(id richiesta, id utente), ...]."""
+    for req_id, user_id in rows:
+        broker.publish(request_topics(user_id), "status", {"id": req_id, "status": status, "ts": time.time()})
+
+
+def publish_stage(vm_request_id: int, user_id: int, name: str, status: str, node: str = None,
+                  duration_s: float = None) -> None:
+    """Passo del provisioning iniziato (status="RUNNING") o terminato ("OK"/"FAILED")."""
+    broker.publish(request_topics(user_id), "stage", {
+        "id": vm_request_id,
+        "stage": name,
+        "status": status,
+        "node": node,
+        "duration_s": round(duration_s, 3) if duration_s is not None else None,
+        "ts": time.time(),
+    })
+
+
+def _format(event_id: int, event: str, data: dict) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(topics: tuple, last_event_id: str = None) -> Response:
+
+    """
+    Risposta text/event-stream con gli eventi dei topic indicati.
+    Lo stream si chiude dopo MAX_STREAM_S: EventSource si riconnette inviando Last-Event-ID
+    e riceve gli eventi pubblicati nel frattempo
+    Con già MAX_STREAMS stream aperti la risposta chiede solo di riprovare più tardi (retry),
+    senza occupare il thread: gli eventi persi arrivano alla riconnessione
+
+    """
+
+    try:
+        last_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_id = None
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    sub = broker.subscribe(topics, last_id, limit=MAX_STREAMS)
+    if sub is None:
+        STREAMS_REJECTED.inc()
+        return Response(f"retry: {BUSY_RETRY_MS}\n\n", mimetype="text/event-stream", headers=headers)
+
+    def stream():
+        fine = time.monotonic() + MAX_STREAM_S
+        try:
+            yield "retry: 3000\n\n"
+            while not sub.closed and time.monotonic() < fine:
+                item = sub.get(min(KEEPALIVE_S, max(fine - time.monotonic(), 0)))
+                if item is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _format(*item)
+        finally:
+            broker.unsubscribe(sub)
+
+    return Response(stream(), mimetype="text/event-stream", headers=headers)
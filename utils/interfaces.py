@@ -1,5 +1,7 @@
 # utils/interfaces.py
-import time,ipaddress
+import asyncio,ipaddress
+from utils.metrics import POLL_ITERATIONS
+from utils.aio import run_sync, run_blocking
 
 
 def _normalize_ip(ip: str) -> str:
@@ -35,43 +37,67 @@ def _is_valid_ipv4(ip: str) -> bool:
     except Exception:
         return False
 
-# funzione per estrapolare l'IP in DHCP del container clonato, fonte ChatGPT
-def wait_lxc_ipv4_from_interfaces(proxmox, node: str, vmid: int, timeout_s: int = 180) -> str:
+def _ipv4_from_interfaces(ifaces) -> str:
+    # primo IPv4 valido delle interfacce del container (eth0 per prima), None se non c'è ancora
+    if not isinstance(ifaces, list):
+        return None
 
-    """    
-    :param proxmox: parametro contente le connessioni Proxmox
-    :param node: parametro contenente il nodo di proxmox
-    :param vmid: id del container appena creato
-    :param timeout_s: timeout della richiesta. se raggiunto va in timeout
+    # mette al primo posto eth0 che dovrebbe contenere l'IP in DHCP
+    eth0_first = sorted(ifaces, key=lambda x: 0 if x.get("name") == "eth0" else 1)
 
-    Funzione che estrae l'IP in DHCP del container clonato
+    for nic in eth0_first:
+        inet = nic.get("inet")
+
+        # stringa "x.x.x.x/24"
+        if isinstance(inet, str) and _is_valid_ipv4(inet):
+            return _normalize_ip(inet)
+
+        # lista di stringhe
+        if isinstance(inet, list):
+            for item in inet:
+                if isinstance(item, str) and _is_valid_ipv4(item):
+                    return _normalize_ip(item)
+    return None
+
+
+async def wait_lxc_ipv4_async(proxmox, node: str, vmid: int, timeout_s: int = 180) -> str:
+
+    """
+    Versione async di wait_lxc_ipv4_from_interfaces: aspetta l'IP DHCP del container
+    senza occupare un thread tra un controllo e l'altro (ogni lettura delle interfacce
+    usa il client proxmox nel pool di thread di run_blocking)
     Ritorna l'IP come stringa
 
     """
 
-    deadline = time.time() + timeout_s
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout_s
 
-    while time.time() < deadline:
+    while loop.time() < deadline:
         # ottiene le interfacce di rete del container
-        ifaces = proxmox.nodes(node).lxc(vmid).interfaces.get()
+        POLL_ITERATIONS.inc(loop="lxc_ipv4")
+        ip = _ipv4_from_interfaces(await run_blocking(proxmox.nodes(node).lxc(vmid).interfaces.get))
+        if ip:
+            return ip
 
-        if isinstance(ifaces, list):
-            # mette al primo posto eth0 che dovrebbe contenere l'IP in DHCP
-            eth0_first = sorted(ifaces, key=lambda x: 0 if x.get("name") == "eth0" else 1)
+        await asyncio.sleep(1)
 
-            for nic in eth0_first:
-                inet = nic.get("inet")
+    raise RuntimeError(f"IP DHCP non trovato")
 
-                # stringa "x.x.x.x/24"
-                if isinstance(inet, str) and _is_valid_ipv4(inet):
-                    return _normalize_ip(inet)
 
-                # lista di stringhe
-                if isinstance(inet, list):
-                    for item in inet:
-                        if isinstance(item, str) and _is_valid_ipv4(item):
-                            return _normalize_ip(item)
+# funzione per estrapolare l'IP in DHCP del container clonato, fonte ChatGPT
+def wait_lxc_ipv4_from_interfaces(proxmox, node: str, vmid: int, timeout_s: int = 180) -> str:
 
-        time.sleep(1)
+    """    
+    :param proxmox: parametro contente le connessioni Proxmox
+    :param node: parametro contenente il nodo di proxmox
+    :param vmid: id del container appena creato
+    :param timeout_s: timeout della richiesta. se raggiunto va in timeout
+
+    Funzione che estrae l'IP in DHCP del container clonato
+    Wrapper sincrono di wait_lxc_ipv4_async, eseguita sul loop condiviso (utils/aio.py)
+    Ritorna l'IP come stringa
+
+    """
 
-    raise RuntimeError(f"IP DHCP non trovato")
\ No newline at end of file
+    return run_sync(wait_lxc_ipv4_async(proxmox, node, vmid, timeout_s))
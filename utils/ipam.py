@@ -0,0 +1,261 @@
+# utils/ipam.py
+import os, ipaddress, logging
+from datetime import timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy.exc import IntegrityError
+
+from model.connection import db
+from model.model import IpSubnet, IpAllocation
+from utils.jobs import utcnow
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# i lease più giovani di così non vengono mai rilasciati dalla riconciliazione (clone ancora in corso)
+RECONCILE_GRACE_S = int(os.getenv("PORTAL_IPAM_GRACE_S", "600"))
+
+
+def _subnets(node: str = None) -> list:
+    query = IpSubnet.query
+    if node:
+        query = query.filter(db.or_(IpSubnet.node.is_(None), IpSubnet.node == node))
+    return query.order_by(IpSubnet.id).all()
+
+
+def ipam_enabled(node: str = None) -> bool:
+
+    """
+    L'IPAM è attivo se c'è almeno una subnet configurata (usabile sul nodo indicato).
+    Senza subnet i container continuano a prendere l'IP via DHCP
+
+    """
+
+    return bool(_subnets(node))
+
+
+def _assignable(subnet: IpSubnet):
+
+    """
+    Indirizzi assegnabili della subnet, nell'ordine: range configurato (o tutti gli host)
+    esclusi rete, broadcast e gateway
+
+    """
+
+    net = ipaddress.ip_network(subnet.cidr, strict=False)
+    start = ipaddress.ip_address(subnet.range_start) if subnet.range_start else None
+    end = ipaddress.ip_address(subnet.range_end) if subnet.range_end else None
+    gateway = ipaddress.ip_address(subnet.gateway) if subnet.gateway else None
+
+    for addr in net.hosts():
+        if start and addr < start:
+            continue
+        if end and addr > end:
+            break
+        if addr == gateway:
+            continue
+        yield str(addr)
+
+
+def _allocate_in_subnet(subnet: IpSubnet, vmid: int, vm_request_id: int = None):
+    occupati = set(db.session.execute(
+        db.select(IpAllocation.address).where(IpAllocation.subnet_id == subnet.id, IpAllocation.status == "ALLOCATED")
+    ).scalars())
+    rilasciati = set(db.session.execute(
+        db.select(IpAllocation.address).where(IpAllocation.subnet_id == subnet.id, IpAllocation.status == "RELEASED")
+    ).scalars())
+
+    for address in _assignable(subnet):
+        if address in occupati:
+            continue
+
+        if address in rilasciati:
+            # riuso di un indirizzo rilasciato: vince il primo che aggiorna la riga
+            res = db.session.execute(
+                db.update(IpAllocation)
+                .where(IpAllocation.address == address, IpAllocation.status == "RELEASED")
+                .values(status="ALLOCATED", vmid=vmid, vm_request_id=vm_request_id, lease_ts=utcnow(), release_ts=None)
+            )
+            db.session.commit()
+            if res.rowcount == 1:
+                return IpAllocation.query.filter_by(address=address).first()
+            continue
+
+        # indirizzo mai usato: il vincolo unique su address evita doppie assegnazioni
+        lease = IpAllocation(subnet_id=subnet.id, address=address, vmid=vmid, vm_request_id=vm_request_id,
+                             status="ALLOCATED", lease_ts=utcnow())
+        db.session.add(lease)
+        try:
+            db.session.commit()
+            return lease
+        except IntegrityError:
+            db.session.rollback()
+
+    return None
+
+
+def allocate_ip(vmid: int, node: str = None, vm_request_id: int = None):
+
+    """
+    Assegna un indirizzo IP libero al container vmid prendendolo dalle subnet configurate
+    Se le subnet sono piene, rilascia i lease dei container non più esistenti e riprova
+    Ritorna il lease (IpAllocation) oppure None se l'IPAM non è configurato
+
+    """
+
+    subnets = _subnets(node)
+    if not subnets:
+        return None
+
+    for tentativo in range(2):
+        for subnet in subnets:
+            lease = _allocate_in_subnet(subnet, vmid, vm_request_id)
+            if lease:
+                return lease
+
+        if tentativo == 0:
+            from utils.proxmox import proxmox_client
+            reconcile_leases(proxmox_client())
+
+    raise RuntimeError("IPAM: nessun indirizzo IP libero nelle subnet configurate")
+
+
+def net0_config(lease: IpAllocation) -> str:
+
+    """
+    Ritorna la configurazione net0 del container con l'IP statico del lease
+    es. name=eth0,bridge=vmbr0,ip=192.168.56.120/24,gw=192.168.56.1
+
+    """
+
+    subnet = lease.subnet
+    prefix = ipaddress.ip_network(subnet.cidr, strict=False).prefixlen
+    net0 = f"name=eth0,bridge={subnet.bridge},ip={lease.address}/{prefix}"
+    if subnet.gateway:
+        net0 += f",gw={subnet.gateway}"
+    return net0
+
+
+def lease_for(vmid: int):
+    """Lease ancora assegnato al container vmid (ripresa di un provisioning interrotto), None se non c'è."""
+    return db.session.execute(
+        db.select(IpAllocation).where(IpAllocation.vmid == vmid, IpAllocation.status == "ALLOCATED")
+    ).scalars().first()
+
+
+def bind_ip_to_request(vmid: int, vm_request_id: int) -> None:
+
+    """
+    Collega alla richiesta il lease di un container già esistente (container del pool assegnato)
+
+    """
+
+    db.session.execute(
+        db.update(IpAllocation)
+        .where(IpAllocation.vmid == vmid, IpAllocation.status == "ALLOCATED")
+        .values(vm_request_id=vm_request_id)
+    )
+    db.session.commit()
+
+
+def release_ip(vmid: int = None, address: str = None) -> int:
+
+    """
+    Rilascia il lease di un container eliminato (per vmid o per indirizzo)
+    Ritorna il numero di lease rilasciati
+
+    """
+
+    query = db.update(IpAllocation).where(IpAllocation.status == "ALLOCATED")
+    if vmid is not None:
+        query = query.where(IpAllocation.vmid == vmid)
+    elif address is not None:
+        query = query.where(IpAllocation.address == address)
+    else:
+        return 0
+
+    res = db.session.execute(query.values(status="RELEASED", release_ts=utcnow()))
+    db.session.commit()
+    return res.rowcount
+
+
+def reconcile_leases(proxmox, grace_s: int = RECONCILE_GRACE_S) -> int:
+
+    """
+    Rilascia i lease dei container che non esistono più nel cluster
+    I lease più giovani di grace_s vengono lasciati stare (clone ancora in corso)
+    Ritorna il numero di lease rilasciati
+
+    """
+
+    esistenti = {int(r["vmid"]) for r in proxmox.cluster.resources.get(type="vm") if "vmid" in r}
+    limite = utcnow() - timedelta(seconds=grace_s)
+
+    orfani = [
+        lease.id for lease in IpAllocation.query.filter(
+            IpAllocation.status == "ALLOCATED", IpAllocation.lease_ts < limite
+        ).all()
+        if lease.vmid is None or lease.vmid not in esistenti
+    ]
+    if not orfani:
+        return 0
+
+    res = db.session.execute(
+        db.update(IpAllocation)
+        .where(IpAllocation.id.in_(orfani), IpAllocation.status == "ALLOCATED")
+        .values(status="RELEASED", release_ts=utcnow())
+    )
+    db.session.commit()
+    logger.info("IPAM: rilasciati %s lease di container non più esistenti", res.rowcount)
+    return res.rowcount
+
+
+# comandi "flask ipam ...": gestione delle subnet e dei lease
+@click.group("ipam")
+def ipam_command() -> None:
+    pass
+
+
+@ipam_command.command("subnet-add")
+@click.argument("cidr")
+@click.option("--gateway", help="Gateway della subnet")
+@click.option("--start", "range_start", help="Primo indirizzo assegnabile")
+@click.option("--end", "range_end", help="Ultimo indirizzo assegnabile")
+@click.option("--bridge", default="vmbr0", show_default=True, help="Bridge Proxmox di net0")
+@click.option("--node", help="Nodo Proxmox su cui è usabile (default: tutti)")
+@with_appcontext
+def subnet_add_command(cidr, gateway, range_start, range_end, bridge, node) -> None:
+    net = ipaddress.ip_network(cidr, strict=False)
+    for addr in (gateway, range_start, range_end):
+        if addr and ipaddress.ip_address(addr) not in net:
+            raise click.ClickException(f"{addr} non appartiene a {net}")
+
+    db.session.add(IpSubnet(cidr=str(net), gateway=gateway, range_start=range_start, range_end=range_end,
+                            bridge=bridge, node=node))
+    db.session.commit()
+    click.echo(f"Subnet {net} aggiunta")
+
+
+@ipam_command.command("list")
+@with_appcontext
+def ipam_list_command() -> None:
+    for subnet in _subnets():
+        usati = subnet.allocations.filter(IpAllocation.status == "ALLOCATED").count()
+        click.echo(f"{subnet.cidr} gw={subnet.gateway} range={subnet.range_start or '-'}..{subnet.range_end or '-'} "
+                   f"bridge={subnet.bridge} node={subnet.node or '*'} in uso={usati}")
+
+
+@ipam_command.command("release")
+@click.argument("address")
+@with_appcontext
+def ipam_release_command(address: str) -> None:
+    click.echo(f"{release_ip(address=address)} lease rilasciati")
+
+
+@ipam_command.command("reconcile")
+@with_appcontext
+def ipam_reconcile_command() -> None:
+    from utils.proxmox import proxmox_client
+    click.echo(f"{reconcile_leases(proxmox_client())} lease rilasciati")
@@ -0,0 +1,482 @@
+# utils/jobs.py
+import os, time, socket, threading, logging
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask.cli import with_appcontext
+from flask import current_app
+
+from model.connection import db
+from model.model import VmRequest, ProvisioningJob
+from utils.metrics import counter, histogram, gauge, STAGE_BUCKETS
+from utils.events import publish_status, publish_statuses
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# numero di thread worker avviati dentro al processo web (0 = nessuno, si usa "flask worker")
+WORKERS = int(os.getenv("PORTAL_WORKERS", "2"))
+# ogni quanto un worker inattivo ricontrolla la coda (secondi)
+POLL_S = float(os.getenv("PORTAL_JOB_POLL_S", "5"))
+# durata massima del lease di un job: oltre questo tempo un job RUNNING è considerato orfano
+LEASE_S = int(os.getenv("PORTAL_JOB_LEASE_S", "3600"))
+# tentativi massimi per job (i job orfani vengono ripresi fino a questo limite)
+MAX_ATTEMPTS = int(os.getenv("PORTAL_JOB_MAX_ATTEMPTS", "3"))
+# provisioning in parallelo su tutto il cluster, contando i worker di tutti i processi (0 = nessun limite)
+MAX_PARALLEL = int(os.getenv("PORTAL_MAX_PARALLEL", "10"))
+# provisioning in parallelo (clone/avvio) sullo stesso nodo (0 = nessun limite)
+MAX_PARALLEL_PER_NODE = int(os.getenv("PORTAL_MAX_PARALLEL_PER_NODE", "4"))
+# ogni quanto riprovare quando tutti i nodi hanno già MAX_PARALLEL_PER_NODE provisioning in corso (secondi)
+NODE_SLOT_POLL_S = float(os.getenv("PORTAL_NODE_SLOT_POLL_S", "2"))
+# richieste messe in coda per transazione dall'approvazione in blocco
+CHUNK = 200
+
+# metriche Prometheus dei job (vedi utils/metrics.py)
+JOB_SECONDS = histogram("portal_provisioning_seconds", "Durata totale del provisioning di una richiesta",
+                        ("result",), STAGE_BUCKETS)
+JOB_RESULTS = counter("portal_provisioning_jobs_total", "Job di provisioning terminati per esito", ("result",))
+JOB_RETRIES = counter("portal_provisioning_retries_total", "Job di provisioning ripresi dopo un tentativo precedente")
+
+
+def _jobs_per_stato() -> dict:
+    righe = db.session.execute(
+        db.select(ProvisioningJob.status, db.func.count()).group_by(ProvisioningJob.status)
+    ).all()
+    return {(status,): n for status, n in righe}
+
+
+gauge("portal_provisioning_jobs", "Job di provisioning per stato", _jobs_per_stato, ("status",))
+
+# svegliato ad ogni nuovo job per non aspettare il prossimo giro di polling
+_nuovo_job = threading.Event()
+
+# identifica questo processo nei worker_id (host:pid:avvio): dopo un riavvio con lo stesso pid
+# (es. pid 1 in un container) i job del processo precedente restano riconoscibili
+_PROCESSO = f"{socket.gethostname()}:{os.getpid()}:{int(time.time())}"
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def enqueue_provisioning(req: VmRequest) -> bool:
+
+    """
+    Mette in coda il provisioning di una richiesta "PENDING".
+    Il cambio di stato è condizionale (UPDATE ... WHERE status = 'PENDING'): se due admin
+    accettano la stessa richiesta contemporaneamente, solo uno dei due la mette in coda.
+    Ritorna True se la richiesta è stata messa in coda, False altrimenti
+
+    """
+
+    res = db.session.execute(
+        db.update(VmRequest)
+        .where(VmRequest.id == req.id, VmRequest.status == "PENDING")
+        .values(status="QUEUED")
+    )
+    if res.rowcount != 1:
+        db.session.rollback()
+        return False
+
+    job = ProvisioningJob.query.filter_by(vm_request_id=req.id).first()
+    if not job:
+        job = ProvisioningJob(vm_request_id=req.id)
+
+    job.status = "QUEUED"
+    job.worker_id = None
+    job.locked_ts = None
+    job.last_error = None
+
+    db.session.add(job)
+    db.session.commit()
+
+    publish_status(req)
+    _nuovo_job.set()
+    return True
+
+
+def enqueue_many(req_ids: list, batch_id: int = None) -> list:
+
+    """
+    Mette in coda il provisioning di più richieste "PENDING" (approvazione in blocco).
+    Come enqueue_provisioning il cambio di stato è condizionale: le richieste non più
+    PENDING (già accettate o rifiutate nel frattempo) vengono saltate.
+    Lavora a blocchi di CHUNK richieste con un commit ciascuno, per non tenere bloccato
+    il DB mentre il resto del portale continua a scrivere.
+    Ritorna gli id delle richieste messe in coda
+
+    """
+
+    messe_in_coda = []
+    for i in range(0, len(req_ids), CHUNK):
+        blocco = req_ids[i:i + CHUNK]
+        righe = db.session.execute(
+            db.update(VmRequest)
+            .where(VmRequest.id.in_(blocco), VmRequest.status == "PENDING")
+            .values(status="QUEUED")
+            .returning(VmRequest.id, VmRequest.user_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if not righe:
+            db.session.rollback()
+            continue
+
+        ids = [req_id for req_id, _ in righe]
+        esistenti = {job.vm_request_id: job for job in db.session.execute(
+            db.select(ProvisioningJob).where(ProvisioningJob.vm_request_id.in_(ids))
+        ).scalars()}
+
+        for req_id in ids:
+            job = esistenti.get(req_id) or ProvisioningJob(vm_request_id=req_id)
+            job.status = "QUEUED"
+            job.worker_id = None
+            job.locked_ts = None
+            job.last_error = None
+            job.batch_id = batch_id
+            db.session.add(job)
+        db.session.commit()
+
+        publish_statuses(righe, "QUEUED")
+        messe_in_coda.extend(ids)
+        _nuovo_job.set()
+
+    return messe_in_coda
+
+
+def retry_job(req: VmRequest) -> bool:
+
+    """
+    Rimette in coda il provisioning di una richiesta "FAILED" (azione "Riprova").
+    Il job conserva checkpoint, nodo e vmid: il nuovo tentativo riprende dal passo successivo
+    all'ultimo completato sullo stesso container (utils/provisioning.py). Il job riceve altri MAX_ATTEMPTS
+    tentativi (la numerazione continua, come nella timeline).
+    Come enqueue_provisioning il cambio di stato è condizionale (UPDATE ... WHERE status = 'FAILED')
+    Ritorna True se la richiesta è stata rimessa in coda, False altrimenti
+
+    """
+
+    job = req.job
+    if job is None:
+        return False
+
+    res = db.session.execute(
+        db.update(VmRequest)
+        .where(VmRequest.id == req.id, VmRequest.status == "FAILED")
+        .values(status="QUEUED")
+    )
+    if res.rowcount != 1:
+        db.session.rollback()
+        return False
+
+    job.status = "QUEUED"
+    job.max_attempts = job.attempts + MAX_ATTEMPTS
+    job.worker_id = None
+    job.locked_ts = None
+    db.session.commit()
+
+    db.session.refresh(req)
+    publish_status(req)
+    _nuovo_job.set()
+    return True
+
+
+def _process_gone(worker_id: str) -> bool:
+    # True se il worker_id è di un processo di questo host che non esiste più
+    try:
+        host, pid, avvio, _ = worker_id.split(":")
+        pid = int(pid)
+    except (AttributeError, ValueError):
+        return False
+    if host != socket.gethostname():
+        return False
+    if pid == os.getpid():
+        # stesso pid ma avvio diverso: è un processo precedente, riavviato
+        return f"{host}:{pid}:{avvio}" != _PROCESSO
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def recover_interrupted_jobs() -> int:
+
+    """
+    Passo di ripristino all'avvio: i job RUNNING di processi di questo host che non esistono più
+    (riavvio, crash) vengono rimessi subito in coda invece di aspettare la scadenza del lease.
+    Riprendono dal loro ultimo checkpoint. I job di altri host vengono ripresi alla scadenza del lease
+    Ritorna il numero di job rimessi in coda
+
+    """
+
+    righe = db.session.execute(
+        db.select(ProvisioningJob.id, ProvisioningJob.worker_id, VmRequest.id, VmRequest.user_id)
+        .join(VmRequest, ProvisioningJob.vm_request_id == VmRequest.id)
+        .where(ProvisioningJob.status == "RUNNING",
+               ProvisioningJob.worker_id.like(f"{socket.gethostname()}:%"))
+    ).all()
+
+    richieste = []
+    for job_id, worker_id, req_id, user_id in righe:
+        if not _process_gone(worker_id):
+            continue
+        # UPDATE condizionale sul worker: se nel frattempo il job è stato preso da un altro, resta suo
+        res = db.session.execute(
+            db.update(ProvisioningJob)
+            .where(ProvisioningJob.id == job_id, ProvisioningJob.status == "RUNNING",
+                   ProvisioningJob.worker_id == worker_id)
+            .values(status="QUEUED", worker_id=None, locked_ts=None)
+        )
+        if res.rowcount != 1:
+            continue
+        db.session.execute(
+            db.update(VmRequest)
+            .where(VmRequest.id == req_id, VmRequest.status == "PROVISIONING")
+            .values(status="QUEUED")
+        )
+        richieste.append((req_id, user_id))
+    db.session.commit()
+
+    publish_statuses(richieste, "QUEUED")
+    if richieste:
+        logger.info("Ripristino: %s job interrotti rimessi in coda", len(richieste))
+        _nuovo_job.set()
+    return len(richieste)
+
+
+def _lease_valid(job, now: datetime):
+    # job RUNNING con lease non scaduto, cioè con un worker vivo che ci sta lavorando
+    return db.and_(job.status == "RUNNING", job.locked_ts >= now - timedelta(seconds=LEASE_S))
+
+
+def running_per_node(exclude_job_id: int = None) -> dict:
+    """Provisioning in corso per nodo (job RUNNING con lease valido, escluso exclude_job_id), {nodo: numero}."""
+    righe = db.session.execute(
+        db.select(ProvisioningJob.node, db.func.count())
+        .where(_lease_valid(ProvisioningJob, utcnow()), ProvisioningJob.node.is_not(None),
+               ProvisioningJob.id != (exclude_job_id or 0))
+        .group_by(ProvisioningJob.node)
+    ).all()
+    return dict(righe)
+
+
+def reserve_node_slot(job_id: int, node: str) -> bool:
+
+    """
+    Assegna il nodo al job se sul nodo ci sono meno di MAX_PARALLEL_PER_NODE provisioning in corso.
+    Il conteggio è dentro allo stesso UPDATE (subquery), quindi due worker non occupano
+    insieme l'ultimo posto libero. Il posto si libera da solo quando il job finisce (non più RUNNING).
+    Ritorna True se il nodo è stato assegnato
+
+    """
+
+    stmt = db.update(ProvisioningJob).where(ProvisioningJob.id == job_id).values(node=node)
+    if MAX_PARALLEL_PER_NODE > 0:
+        altro = db.aliased(ProvisioningJob)
+        in_corso = (db.select(db.func.count()).select_from(altro)
+                    .where(_lease_valid(altro, utcnow()), altro.node == node, altro.id != job_id)
+                    .scalar_subquery())
+        stmt = stmt.where(in_corso < MAX_PARALLEL_PER_NODE)
+
+    res = db.session.execute(stmt.execution_options(synchronize_session=False))
+    db.session.commit()
+    return res.rowcount == 1
+
+
+def claim_next_job(worker_id: str):
+
+    """
+    Prende in carico il prossimo job in coda (o un job RUNNING con lease scaduto).
+    La presa in carico è un UPDATE condizionale sullo stato letto: funziona anche con
+    più processi worker sullo stesso DB, il primo che aggiorna la riga vince.
+    Con MAX_PARALLEL il job viene preso solo se i provisioning in corso nel cluster sono meno del limite
+    (conteggio nello stesso UPDATE, come per i posti dei nodi)
+    Ritorna il job preso in carico oppure None se la coda è vuota o il limite è raggiunto
+
+    """
+
+    now = utcnow()
+    scaduto = now - timedelta(seconds=LEASE_S)
+
+    disponibile = db.or_(
+        ProvisioningJob.status == "QUEUED",
+        db.and_(ProvisioningJob.status == "RUNNING", ProvisioningJob.locked_ts < scaduto),
+    )
+
+    limite = []
+    if MAX_PARALLEL > 0:
+        altro = db.aliased(ProvisioningJob)
+        in_corso = db.select(db.func.count()).select_from(altro).where(_lease_valid(altro, now)).scalar_subquery()
+        limite.append(in_corso < MAX_PARALLEL)
+
+    candidati = db.session.execute(
+        db.select(ProvisioningJob.id).where(disponibile).order_by(ProvisioningJob.id).limit(5)
+    ).scalars().all()
+
+    for job_id in candidati:
+        res = db.session.execute(
+            db.update(ProvisioningJob)
+            .where(ProvisioningJob.id == job_id, disponibile, *limite)
+            .values(status="RUNNING", worker_id=worker_id, locked_ts=now,
+                    attempts=ProvisioningJob.attempts + 1)
+        )
+        db.session.commit()
+        if res.rowcount == 1:
+            return db.session.get(ProvisioningJob, job_id)
+
+    return None
+
+
+def run_job(job: ProvisioningJob) -> None:
+
+    """
+    Esegue il provisioning di un job preso in carico e ne aggiorna lo stato.
+    La richiesta passa da "QUEUED" a "PROVISIONING" e poi a "READY" o "FAILED".
+
+    """
+
+    # import qui per non caricare proxmoxer/paramiko finché non serve un worker
+    from utils.provisioning import provision_request
+    from utils.proxmox import proxmox_stats
+    from utils.timeline import recording
+
+    req = job.vm_request
+
+    limite = job.max_attempts or MAX_ATTEMPTS
+    if job.attempts > limite:
+        job.status = "FAILED"
+        job.last_error = f"Superato il numero massimo di tentativi ({limite})"
+        req.status = "FAILED"
+        db.session.commit()
+        publish_status(req)
+        JOB_RESULTS.inc(result="FAILED")
+        return
+
+    if job.attempts > 1:
+        JOB_RETRIES.inc()
+
+    req.status = "PROVISIONING"
+    db.session.commit()
+    publish_status(req)
+
+    # passi del provisioning salvati nella timeline della richiesta (utils/timeline.py)
+    # e pubblicati agli stream SSE degli admin e dell'utente (utils/events.py)
+    with recording(req.id, job.attempts, user_id=req.user_id) as timeline:
+        if job.attempts == 1:
+            # attesa in coda dall'accettazione alla presa in carico
+            timeline.add("queue", job.add_ts, job.locked_ts or utcnow())
+
+        start = time.perf_counter()
+        try:
+            provision_request(req)
+            job.status = "DONE"
+            job.last_error = None
+            db.session.commit()
+            publish_status(req)
+            JOB_SECONDS.observe(time.perf_counter() - start, result="DONE")
+            JOB_RESULTS.inc(result="DONE")
+
+        except Exception as e:
+            JOB_SECONDS.observe(time.perf_counter() - start, result="FAILED")
+            JOB_RESULTS.inc(result="FAILED")
+            logger.exception("Provisioning della richiesta %s fallito", req.id)
+            db.session.rollback()
+
+            job.status = "FAILED"
+            job.last_error = str(e) or e.__class__.__name__
+            req.status = "FAILED"
+            db.session.commit()
+            publish_status(req)
+
+        timeline.save()
+
+    logger.info("Proxmox API: %(requests)s richieste, %(connections)s connessioni aperte, "
+                "%(reused)s riusate, latenza media %(avg_latency_ms)s ms", proxmox_stats())
+
+
+class WorkerPool:
+
+    """
+    Pool di thread che consumano la coda dei job di provisioning.
+    Ogni thread lavora dentro al proprio app context, quindi con la propria sessione DB.
+
+    """
+
+    def __init__(self, app, size: int = WORKERS):
+        self.app = app
+        self.size = size
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self) -> None:
+        for n in range(self.size):
+            t = threading.Thread(target=self._loop, args=(n,), name=f"provisioning-worker-{n}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout_s: float = 5) -> None:
+        self._stop.set()
+        _nuovo_job.set()
+        for t in self._threads:
+            t.join(timeout_s)
+
+    def _loop(self, n: int) -> None:
+        worker_id = f"{_PROCESSO}:{n}"
+
+        while not self._stop.is_set():
+            job = None
+            try:
+                with self.app.app_context():
+                    job = claim_next_job(worker_id)
+                    if job:
+                        run_job(job)
+            except Exception:
+                logger.exception("Errore nel worker %s", worker_id)
+
+            if not job:
+                _nuovo_job.wait(POLL_S)
+                _nuovo_job.clear()
+
+
+def start_workers(app, size: int = WORKERS):
+
+    """
+    Avvia i worker di provisioning dentro al processo (se PORTAL_WORKERS > 0).
+    Prima rimette in coda i job interrotti da un riavvio (recover_interrupted_jobs)
+    Il pool viene salvato in app.extensions per poterlo fermare
+
+    """
+
+    if size <= 0:
+        return None
+
+    with app.app_context():
+        recover_interrupted_jobs()
+
+    pool = WorkerPool(app, size)
+    pool.start()
+    app.extensions["provisioning_workers"] = pool
+    return pool
+
+
+# comando "flask worker": consuma la coda in un processo separato dal server web
+@click.command("worker")
+@click.option("--threads", default=max(WORKERS, 1), show_default=True, help="Numero di thread worker")
+@with_appcontext
+def worker_command(threads: int) -> None:
+    ripresi = recover_interrupted_jobs()
+    if ripresi:
+        click.echo(f"{ripresi} job interrotti rimessi in coda")
+
+    pool = WorkerPool(current_app._get_current_object(), threads)
+    pool.start()
+    click.echo(f"{threads} worker di provisioning avviati (CTRL+C per uscire)")
+
+    try:
+        while not pool._stop.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pool.stop()
@@ -0,0 +1,227 @@
+# utils/metrics.py
+import os, re, time, threading, bisect
+from contextlib import contextmanager
+from flask import Response, request, abort
+from dotenv import load_dotenv
+load_dotenv()
+
+
+# token richiesto per leggere /metrics (Authorization: Bearer ...), vuoto = accesso libero
+METRICS_TOKEN = os.getenv("PORTAL_METRICS_TOKEN", "")
+
+# intervalli (secondi) degli istogrammi: chiamate API/SSH e passi del provisioning
+CALL_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STAGE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 900)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _labels_text(names: tuple, values: tuple, extra: str = "") -> str:
+    parti = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parti.append(extra)
+    return "{" + ",".join(parti) + "}" if parti else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+
+    """Contatore Prometheus (solo incrementi) con etichette."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(n, "")) for n in self.labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def collect(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels_text(self.labels, key)} {_number(v)}" for key, v in values]
+
+
+class Histogram:
+
+    """Istogramma Prometheus (bucket cumulativi, somma e conteggio) con etichette."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = CALL_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # etichette -> [conteggi per bucket, somma, conteggio]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if i < len(self.buckets):
+                entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self) -> list:
+        with self._lock:
+            values = sorted((key, (list(e[0]), e[1], e[2])) for key, e in self._values.items())
+
+        righe = []
+        for key, (counts, total, count) in values:
+            cumulato = 0
+            for le, n in zip(self.buckets, counts):
+                cumulato += n
+                etichette = _labels_text(self.labels, key, 'le="%s"' % _number(le))
+                righe.append(f"{self.name}_bucket{etichette} {cumulato}")
+            etichette = _labels_text(self.labels, key, 'le="+Inf"')
+            righe.append(f"{self.name}_bucket{etichette} {count}")
+            righe.append(f"{self.name}_sum{_labels_text(self.labels, key)} {_number(total)}")
+            righe.append(f"{self.name}_count{_labels_text(self.labels, key)} {count}")
+        return righe
+
+
+class Gauge:
+
+    """Valore istantaneo letto da una funzione al momento dell'esportazione."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, fn, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.fn = fn
+
+    def collect(self) -> list:
+        valore = self.fn()
+        if not self.labels:
+            return [f"{self.name} {_number(valore)}"]
+        # con etichette la funzione ritorna {(valori etichette): valore}
+        return [f"{self.name}{_labels_text(self.labels, key)} {_number(v)}" for key, v in sorted(valore.items())]
+
+
+def _register(metric):
+    with _registry_lock:
+        esistente = _registry.get(metric.name)
+        if esistente is not None:
+            return esistente
+        _registry[metric.name] = metric
+        return metric
+
+
+def counter(name: str, help_text: str, labels: tuple = ()) -> Counter:
+    """Ritorna il contatore name, creandolo alla prima chiamata."""
+    return _register(Counter(name, help_text, labels))
+
+
+def histogram(name: str, help_text: str, labels: tuple = (), buckets: tuple = CALL_BUCKETS) -> Histogram:
+    """Ritorna l'istogramma name, creandolo alla prima chiamata."""
+    return _register(Histogram(name, help_text, labels, buckets))
+
+
+def gauge(name: str, help_text: str, fn, labels: tuple = ()) -> Gauge:
+    """Registra un valore istantaneo calcolato da fn a ogni lettura di /metrics."""
+    return _register(Gauge(name, help_text, fn, labels))
+
+
+def render() -> str:
+    """Tutte le metriche del processo nel formato testuale di Prometheus."""
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda m: m.name)
+
+    righe = []
+    for m in metrics:
+        try:
+            valori = m.collect()
+        except Exception:
+            # un gauge che non si riesce a leggere (es. DB non raggiungibile) non blocca le altre metriche
+            continue
+        righe.append(f"# HELP {m.name} {m.help}")
+        righe.append(f"# TYPE {m.name} {m.kind}")
+        righe.extend(valori)
+    return "\n".join(righe) + "\n"
+
+
+# metriche del provisioning
+STAGE_SECONDS = histogram("portal_provisioning_stage_seconds", "Durata dei passi del provisioning",
+                          ("stage",), STAGE_BUCKETS)
+STAGE_FAILURES = counter("portal_provisioning_stage_failures_total", "Passi del provisioning falliti",
+                         ("stage", "error"))
+POLL_ITERATIONS = counter("portal_poll_iterations_total", "Giri dei cicli di attesa (task, IP, porta, SSH)",
+                          ("loop",))
+
+
+@contextmanager
+def stage(name: str):
+
+    """
+    Misura un passo del provisioning (clone, resize, start, attesa IP/SSH, ...):
+    la durata va in portal_provisioning_stage_seconds, gli errori in
+    portal_provisioning_stage_failures_total con il tipo di eccezione
+
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        STAGE_FAILURES.inc(stage=name, error=e.__class__.__name__)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+
+
+# segmenti variabili dei percorsi API, sostituiti per non creare una serie per ogni container
+_UPID = re.compile(r"/UPID:[^/]+")
+_NODE = re.compile(r"/nodes/[^/]+")
+_ID = re.compile(r"/\d+(?=/|$)")
+
+
+def api_endpoint(url: str) -> str:
+    """Percorso API senza host, nodo, vmid e UPID (es. /nodes/{node}/lxc/{id}/status/start)."""
+    path = url.split("/api2/json", 1)[-1].split("?", 1)[0]
+    path = _UPID.sub("/{upid}", path)
+    path = _NODE.sub("/nodes/{node}", path)
+    return _ID.sub("/{id}", path)
+
+
+def metrics_view():
+    """Endpoint /metrics per Prometheus (protetto da PORTAL_METRICS_TOKEN se impostato)."""
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        abort(401)
+    return Response(render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,86 @@
+# utils/pagination.py
+import os, json, base64
+from datetime import datetime
+
+from model.connection import db
+from dotenv import load_dotenv
+load_dotenv()
+
+# righe per pagina delle liste
+PAGE_SIZE = int(os.getenv("PORTAL_PAGE_SIZE", "50"))
+
+
+def encode_cursor(values: list) -> str:
+
+    """
+    Codifica i valori delle colonne di ordinamento dell'ultima riga di una pagina
+    in un cursore opaco da mettere nell'URL (?after=...)
+
+    """
+
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: list) -> list:
+
+    """
+    Decodifica un cursore riportando i valori al tipo delle colonne di ordinamento
+    Alza ValueError se il cursore non è valido
+
+    """
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except Exception:
+        raise ValueError("Cursore non valido")
+
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError("Cursore non valido")
+
+    return [
+        datetime.fromisoformat(v) if v is not None and col.type.python_type is datetime else v
+        for col, v in zip(columns, values)
+    ]
+
+
+def _after(columns: list, values: list, desc: bool):
+
+    """
+    Condizione "riga successiva al cursore" per l'ordinamento sulle colonne indicate
+    es. (ts, id) decrescente: ts < :ts OR (ts = :ts AND id < :id)
+    Scritta con OR/AND invece che con i row value per essere usabile dagli indici su ogni DB
+
+    """
+
+    condizioni = []
+    for i, (col, value) in enumerate(zip(columns, values)):
+        uguali = [c == v for c, v in zip(columns[:i], values[:i])]
+        oltre = col < value if desc else col > value
+        condizioni.append(db.and_(*uguali, oltre))
+    return db.or_(*condizioni)
+
+
+def keyset_page(stmt, columns: list, cursor: str = None, page_size: int = PAGE_SIZE, desc: bool = True) -> tuple:
+
+    """
+    Esegue una select paginata con keyset pagination sulle colonne indicate
+    (l'ultima deve essere univoca, es. id). Legge page_size + 1 righe per sapere se c'è una pagina successiva.
+    Ritorna la tupla (righe, cursore della pagina successiva o None)
+
+    """
+
+    if cursor:
+        stmt = stmt.where(_after(columns, decode_cursor(cursor, columns), desc))
+
+    ordine = [col.desc() if desc else col.asc() for col in columns]
+    rows = db.session.execute(stmt.order_by(*ordine).limit(page_size + 1)).scalars().all()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        ultima = rows[-1]
+        next_cursor = encode_cursor([getattr(ultima, col.key) for col in columns])
+
+    return rows, next_cursor
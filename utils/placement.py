@@ -0,0 +1,176 @@
+# utils/placement.py
+import os, importlib, threading, logging
+from dotenv import load_dotenv
+load_dotenv()
+
+from utils.cluster import cluster_snapshot
+
+logger = logging.getLogger(__name__)
+
+# politica di scelta del nodo: nome registrato (least-loaded, bin-packing, spread) o "modulo:funzione"
+PLACEMENT_POLICY = os.getenv("PROXMOX_PLACEMENT_POLICY", "least-loaded")
+# nodi utilizzabili, separati da virgola (vuoto = tutti i nodi online)
+PLACEMENT_NODES = [n.strip() for n in os.getenv("PROXMOX_NODES", "").split(",") if n.strip()]
+# storage su cui vengono creati i dischi dei container
+STORAGE = os.getenv("PROXMOX_STORAGE", "local-lvm")
+
+_policies = {}
+_lock = threading.Lock()
+# nodi già segnalati senza lo storage PROXMOX_STORAGE (un solo avviso per nodo)
+_senza_storage = set()
+
+MB = 1024 ** 2
+GB = 1024 ** 3
+
+
+class NodesBusy(RuntimeError):
+    """Ci sono nodi con risorse sufficienti, ma sono tutti esclusi (es. limite di provisioning per nodo)."""
+
+
+class NodeCapacity:
+
+    """
+    Capacità di un nodo letta dalla fotografia del cluster
+    cpu è la frazione di CPU in uso (0..1), memoria e disco sono in byte
+    disk_free è None se lo storage PROXMOX_STORAGE non è nella fotografia: il disco non viene controllato
+
+    """
+
+    def __init__(self, name: str, node: dict, storage: dict, running_tasks: int, guests: int):
+        self.name = name
+        self.cpu = float(node.get("cpu") or 0)
+        self.maxcpu = int(node.get("maxcpu") or 0)
+        self.mem = int(node.get("mem") or 0)
+        self.maxmem = int(node.get("maxmem") or 0)
+        self.disk_free = int(storage.get("maxdisk") or 0) - int(storage.get("disk") or 0) if storage else None
+        self.running_tasks = running_tasks
+        self.guests = guests
+
+    @property
+    def mem_free(self) -> int:
+        return self.maxmem - self.mem
+
+    def fits(self, vm_type) -> bool:
+        if self.mem_free < int(vm_type.ram) * MB:
+            return False
+        return self.disk_free is None or self.disk_free >= int(vm_type.disk) * GB
+
+    def load(self) -> float:
+        mem = self.mem / self.maxmem if self.maxmem else 1
+        return max(self.cpu, mem) + 0.1 * self.running_tasks
+
+    def __repr__(self):
+        return (f'<NodeCapacity {self.name} cpu={self.cpu:.2f} mem_free={self.mem_free // MB}MB '
+                f'disk_free={"?" if self.disk_free is None else self.disk_free // GB}GB tasks={self.running_tasks} guests={self.guests}>')
+
+
+def default_node() -> str:
+    return os.getenv("PROXMOX_DEFAULT_NODE", "px1")
+
+
+def register_policy(name: str):
+
+    """
+    Decoratore per registrare una politica di placement
+    La politica riceve (nodi candidati, vm_type) e ritorna il NodeCapacity scelto
+
+    """
+
+    def decorator(f):
+        _policies[name] = f
+        return f
+    return decorator
+
+
+@register_policy("least-loaded")
+def least_loaded(nodes: list, vm_type) -> NodeCapacity:
+    # nodo più scarico tra CPU, memoria e task in corso
+    return min(nodes, key=lambda n: (n.load(), n.name))
+
+
+@register_policy("bin-packing")
+def bin_packing(nodes: list, vm_type) -> NodeCapacity:
+    # riempie prima i nodi più pieni in cui il container ci sta ancora
+    return min(nodes, key=lambda n: (n.mem_free, n.name))
+
+
+@register_policy("spread")
+def spread(nodes: list, vm_type) -> NodeCapacity:
+    # distribuisce i container: nodo con meno guest, poi con più memoria libera
+    return min(nodes, key=lambda n: (n.guests, -n.mem_free, n.name))
+
+
+def get_policy(name: str = None):
+    name = name or PLACEMENT_POLICY
+    if name in _policies:
+        return _policies[name]
+    if ":" in name:
+        module, func = name.split(":", 1)
+        return getattr(importlib.import_module(module), func)
+    raise ValueError(f"Politica di placement sconosciuta: {name}")
+
+
+def node_capacities(snapshot=None) -> list:
+
+    """
+    Capacità dei nodi online utilizzabili (PROXMOX_NODES), dalla fotografia del cluster
+
+    """
+
+    snapshot = snapshot or cluster_snapshot()
+    capacita = []
+    for name, node in snapshot.nodes.items():
+        if node.get("status") != "online":
+            continue
+        if PLACEMENT_NODES and name not in PLACEMENT_NODES:
+            continue
+        storage = snapshot.storages.get((name, STORAGE))
+        if storage is None and name not in _senza_storage:
+            # storage rinominato o PROXMOX_STORAGE sbagliato: il nodo resta utilizzabile senza controllo del disco
+            _senza_storage.add(name)
+            logger.warning("Storage %s non trovato sul nodo %s: spazio su disco non controllato", STORAGE, name)
+        capacita.append(NodeCapacity(
+            name, node, storage,
+            snapshot.running_tasks.get(name, 0), snapshot.guests_on(name),
+        ))
+    return capacita
+
+
+def choose_node(vm_type, policy: str = None, exclude=()) -> str:
+
+    """
+    Sceglie il nodo su cui creare un container del tipo di VM
+    Usa la fotografia del cluster in cache (nessuna chiamata API in più per ogni richiesta);
+    la scelta viene annotata sulla fotografia, così le richieste che arrivano prima del
+    prossimo aggiornamento tengono conto dei container appena piazzati.
+    I nodi in exclude non vengono scelti: se erano gli unici adatti alza NodesBusy.
+    Se la fotografia non è disponibile ritorna il nodo di default
+
+    """
+
+    try:
+        snapshot = cluster_snapshot()
+    except Exception:
+        logger.exception("Fotografia del cluster non disponibile, uso il nodo di default")
+        return default_node()
+
+    with _lock:
+        adatti = [n for n in node_capacities(snapshot) if n.fits(vm_type)]
+        if not adatti:
+            raise RuntimeError(f"Nessun nodo con risorse sufficienti per il tipo {vm_type.name}")
+        candidati = [n for n in adatti if n.name not in exclude]
+        if not candidati:
+            raise NodesBusy(f"Nodi adatti al tipo {vm_type.name} tutti occupati: {', '.join(sorted(exclude))}")
+
+        scelto = get_policy(policy)(candidati, vm_type)
+
+        # prenotazione locale fino al prossimo aggiornamento della fotografia
+        node = snapshot.nodes[scelto.name]
+        node["mem"] = int(node.get("mem") or 0) + int(vm_type.ram) * MB
+        storage = snapshot.storages.get((scelto.name, STORAGE))
+        if storage:
+            storage["disk"] = int(storage.get("disk") or 0) + int(vm_type.disk) * GB
+        snapshot.running_tasks[scelto.name] = snapshot.running_tasks.get(scelto.name, 0) + 1
+        snapshot.placed[scelto.name] = snapshot.placed.get(scelto.name, 0) + 1
+
+    return scelto.name
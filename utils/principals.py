@@ -0,0 +1,129 @@
+# utils/principals.py
+import os, time, threading
+from collections import OrderedDict
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session, selectinload
+from model.connection import db
+from model.model import User, Role
+from dotenv import load_dotenv
+load_dotenv()
+
+
+# utenti autenticati tenuti in memoria dal processo
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PORTAL_PRINCIPAL_CACHE_SIZE", "1000"))
+# durata massima di una voce in cache (secondi): limita il ritardo con cui un altro processo vede i cambi di ruolo
+PRINCIPAL_TTL_S = float(os.getenv("PORTAL_PRINCIPAL_TTL_S", "300"))
+
+# cache LRU, user_id -> (Principal, scadenza)
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+# contatori della cache (vedi principal_stats)
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+class Principal(UserMixin):
+
+    """
+    Utente autenticato come lo vede Flask-Login (current_user): id, username, email e ruoli.
+    Non è legato alla sessione del DB, quindi has_role non esegue query.
+
+    """
+
+    def __init__(self, id: int, username: str, email: str, roles):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.roles = frozenset(roles)
+
+    def has_role(self, role_name):
+        return role_name in self.roles
+
+    def __repr__(self):
+        return f'<Principal id={self.id} username={self.username} roles={sorted(self.roles)}>'
+
+
+def cache_principal(user: User) -> Principal:
+    """Crea il Principal dell'utente (ruoli già caricati) e lo mette in cache."""
+    principal = Principal(user.id, user.username, user.email, (role.name for role in user.roles))
+
+    with _lock:
+        _cache[principal.id] = (principal, time.monotonic() + PRINCIPAL_TTL_S)
+        _cache.move_to_end(principal.id)
+        while len(_cache) > PRINCIPAL_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return principal
+
+
+def get_principal(user_id: int):
+
+    """
+    Ritorna il Principal dell'utente dalla cache; se manca o è scaduto lo rilegge
+    con due query indicizzate (utente, ruoli). Ritorna None se l'utente non esiste
+
+    """
+
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(user_id)
+        if entry and entry[1] > now:
+            _cache.move_to_end(user_id)
+            _stats["hits"] += 1
+            return entry[0]
+        _stats["misses"] += 1
+
+    stmt = db.select(User).options(selectinload(User.roles)).filter_by(id=user_id)
+    user = db.session.execute(stmt).scalar_one_or_none()
+    if user is None:
+        invalidate_principal(user_id)
+        return None
+    return cache_principal(user)
+
+
+def invalidate_principal(user_id: int = None) -> None:
+    """Scarta dalla cache il Principal dell'utente (tutti se user_id è None)."""
+    with _lock:
+        if user_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(user_id, None)
+        _stats["invalidations"] += 1
+
+
+def principal_stats() -> dict:
+    """Contatori della cache dei Principal: voci, hit, miss e invalidazioni."""
+    with _lock:
+        stats = dict(_stats)
+        stats["size"] = len(_cache)
+    return stats
+
+
+# invalidazione automatica: utenti modificati/eliminati (ruoli compresi) e ruoli modificati
+@event.listens_for(Session, "after_flush")
+def _collect_changes(session, flush_context):
+    cambiati = session.info.setdefault("principals_changed", set())
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            cambiati.add(obj.id)
+        elif isinstance(obj, Role) and session.is_modified(obj, include_collections=False):
+            # ruolo rinominato: cambia il ruolo di tutti i suoi utenti
+            cambiati.add(None)
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            cambiati.add(obj.id)
+        elif isinstance(obj, Role):
+            cambiati.add(None)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_soft_rollback")
+def _apply_changes(session, *args):
+    cambiati = session.info.pop("principals_changed", None)
+    if not cambiati:
+        return
+    if None in cambiati:
+        invalidate_principal()
+    else:
+        for user_id in cambiati:
+            invalidate_principal(user_id)
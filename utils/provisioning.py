@@ -0,0 +1,350 @@
+# utils/provisioning.py
+import time, logging
+
+from model.connection import db
+from model.model import VmRequest, VmType, User, VmCredentials, ProvisioningJob
+
+from utils.proxmox import proxmox_client, wait_task
+from utils.ssh import gen_password, create_user_over_ssh
+from utils.interfaces import wait_lxc_ipv4_from_interfaces
+from utils.ipam import allocate_ip, net0_config, bind_ip_to_request, release_ip, lease_for
+from utils.vmids import reserve_vmid, mark_vmid_in_use, mark_vmid_foreign, vmid_reserved_for
+from utils.templates import clone_source
+from utils.placement import choose_node, default_node, NodesBusy
+from utils.timeline import stage, set_node
+from utils.jobs import (running_per_node, reserve_node_slot, MAX_PARALLEL_PER_NODE, NODE_SLOT_POLL_S,
+                        LEASE_S, utcnow)
+
+logger = logging.getLogger(__name__)
+
+
+# dimensione del disco del template di partenza (GB)
+TEMPLATE_DISK_GB = 8
+
+# tentativi di clone con un nuovo vmid se quello riservato è stato preso da un container creato fuori dal portale
+CLONE_CONFLICT_RETRIES = 2
+
+# utente presente nel template con sudo NOPASSWD, usato per creare l'utente finale
+BOOTSTRAP_USER = "default_user"
+BOOTSTRAP_PASS = "Admin123"
+
+# passi del provisioning in ordine: l'ultimo completato viene salvato sul job (ProvisioningJob.checkpoint)
+CHECKPOINTS = ("cloned", "resized", "configured", "started", "ip_known", "user_created")
+
+
+class BuildState:
+
+    """
+    Avanzamento della costruzione di un container: nodo, vmid, hostname, IP,
+    UPID del clone in corso e ultimo passo completato (checkpoint).
+    Per i job di provisioning viene salvato sul job ad ogni passo (save), per i container
+    del pool resta in memoria. resumed indica che si riparte da un tentativo precedente
+
+    """
+
+    def __init__(self, node: str = None, vmid: int = None, hostname: str = None, ip_address: str = None,
+                 checkpoint: str = None, task_upid: str = None, save=None):
+        self.node = node
+        self.vmid = vmid
+        self.hostname = hostname
+        self.ip_address = ip_address
+        self.checkpoint = checkpoint
+        self.task_upid = task_upid
+        self.resumed = vmid is not None
+        self._save = save
+
+    @classmethod
+    def of_job(cls, job: ProvisioningJob) -> "BuildState":
+        """Stato salvato sul job, con il salvataggio dei checkpoint sul job stesso."""
+
+        def save(state):
+            job.node = state.node
+            job.vmid = state.vmid
+            job.hostname = state.hostname
+            job.ip_address = state.ip_address
+            job.checkpoint = state.checkpoint
+            job.task_upid = state.task_upid
+            job.checkpoint_ts = utcnow()
+            # ogni checkpoint rinnova il lease: un job lungo ma vivo non viene considerato orfano
+            job.locked_ts = job.checkpoint_ts
+            db.session.commit()
+
+        return cls(job.node, job.vmid, job.hostname, job.ip_address, job.checkpoint, job.task_upid, save=save)
+
+    def done(self, step: str) -> bool:
+        """True se il passo è già stato completato (checkpoint uguale o successivo)."""
+        return self.checkpoint is not None and CHECKPOINTS.index(self.checkpoint) >= CHECKPOINTS.index(step)
+
+    def save(self) -> None:
+        if self._save:
+            self._save(self)
+
+    def reached(self, step: str) -> None:
+        """Passo completato: aggiorna e salva il checkpoint."""
+        self.checkpoint = step
+        self.save()
+
+
+def choose_node_for_job(req: VmRequest, vm_type: VmType, node: str = None) -> str:
+
+    """
+    Sceglie il nodo come choose_node, rispettando il limite di provisioning in parallelo per nodo
+    (MAX_PARALLEL_PER_NODE): i nodi pieni vengono esclusi e il posto sul nodo scelto viene
+    riservato sul job. Se tutti i nodi adatti sono pieni aspetta che se ne liberi uno,
+    al massimo metà del lease del job (poi un altro worker lo considererebbe orfano)
+    Con node (ripresa di un container già creato) aspetta un posto su quel nodo
+
+    """
+
+    job = req.job
+    if job is None or MAX_PARALLEL_PER_NODE <= 0:
+        return node or choose_node(vm_type)
+
+    deadline = time.monotonic() + LEASE_S / 2
+    while True:
+        pieni = {n for n, in_corso in running_per_node(job.id).items() if in_corso >= MAX_PARALLEL_PER_NODE}
+        try:
+            scelto = node or choose_node(vm_type, exclude=pieni)
+            if reserve_node_slot(job.id, scelto):
+                return scelto
+        except NodesBusy:
+            pass
+
+        if time.monotonic() > deadline:
+            raise RuntimeError("Nessun nodo libero: limite di provisioning in parallelo per nodo raggiunto")
+        time.sleep(NODE_SLOT_POLL_S)
+
+
+def _container_status(proxmox, node: str, vmid: int):
+    # stato del container (status, lock) oppure None se il container non esiste
+    try:
+        return proxmox.nodes(node).lxc(vmid).status.current.get()
+    except Exception as e:
+        if "does not exist" in str(e):
+            return None
+        raise
+
+
+def _upid_node(upid: str, default: str) -> str:
+    # nodo su cui gira una task, dall'UPID (UPID:nodo:pid:...)
+    parti = upid.split(":")
+    return parti[1] if len(parti) > 2 and parti[1] else default
+
+
+def build_container(proxmox, node: str, vm_type: VmType, hostname_for, vm_request_id: int = None,
+                    state: BuildState = None) -> tuple:
+
+    """
+    Clona il template del tipo di VM (dalla replica locale al nodo se esiste, linked clone
+    dove lo storage lo supporta, vedi utils/templates.py), ridimensiona il disco,
+    configura CPU, RAM e rete e avvia il container
+    Con l'IPAM configurato (utils/ipam.py) l'IP statico viene assegnato nella configurazione
+    ed è noto prima dell'avvio, altrimenti viene letto l'IP assegnato via DHCP
+    Con state (BuildState di un tentativo precedente) i passi già completati vengono saltati
+    e si riprende sullo stesso vmid: il clone in corso viene atteso invece di essere ripetuto,
+    il resize è a dimensione assoluta e l'avvio viene saltato se il container è già acceso
+    :param hostname_for: funzione che dato il nuovo vmid ritorna l'hostname da assegnare
+    Ritorna la tupla (vmid, hostname, ipv4)
+
+    """
+
+    state = state or BuildState()
+    state.node = node
+    template_vmid = int(vm_type.template_vmid)
+
+    # vmid riservato nel DB (utils/vmids.py), niente cluster/nextid
+    # alla ripresa si tiene quello del tentativo precedente, se la prenotazione è ancora della richiesta
+    if not state.done("cloned") and state.vmid is not None and not vmid_reserved_for(state.vmid, vm_request_id):
+        state.vmid = None
+    if state.vmid is None:
+        with stage("vmid"):
+            state.vmid = reserve_vmid(node=node, vm_request_id=vm_request_id)
+        state.hostname = hostname_for(state.vmid)
+        state.task_upid = None
+        state.save()
+
+    # IP statico dall'IPAM (None se non ci sono subnet configurate), alla ripresa quello già assegnato
+    lease = lease_for(state.vmid) if state.resumed else None
+    if lease is None and not state.done("configured"):
+        with stage("ip_allocate"):
+            lease = allocate_ip(state.vmid, node=node, vm_request_id=vm_request_id)
+
+    # clone template
+    if not state.done("cloned"):
+        with stage("clone"):
+            esistente = _container_status(proxmox, node, state.vmid) if state.resumed else None
+
+            if esistente is None:
+                # il clone parte dalla replica del template sul nodo scelto (utils/templates.py),
+                # se non c'è dal nodo che ospita il template master, con target il nodo scelto
+                template_node, source_vmid, linked = clone_source(template_vmid, node)
+                for tentativo in range(CLONE_CONFLICT_RETRIES + 1):
+                    clone_params = dict(newid=state.vmid, hostname=state.hostname, full=0 if linked else 1)
+                    if template_node != node:
+                        clone_params["target"] = node
+                    try:
+                        state.task_upid = proxmox.nodes(template_node).lxc(source_vmid).clone.post(**clone_params)
+                        break
+                    except Exception as e:
+                        # vmid creato fuori dal portale dopo l'ultima fotografia del cluster: se ne riserva un altro
+                        if "already exists" not in str(e) or tentativo == CLONE_CONFLICT_RETRIES:
+                            raise
+                        mark_vmid_foreign(state.vmid)
+                        if lease:
+                            release_ip(vmid=state.vmid)
+                        state.vmid = reserve_vmid(node=node, vm_request_id=vm_request_id)
+                        state.hostname = hostname_for(state.vmid)
+                        lease = allocate_ip(state.vmid, node=node, vm_request_id=vm_request_id)
+
+                # UPID salvato prima dell'attesa: se il processo si ferma, la ripresa aspetta lo stesso clone
+                state.save()
+                wait_task(proxmox, template_node, state.task_upid, timeout_s=900)
+
+            elif esistente.get("lock"):
+                # clone del tentativo precedente ancora in corso
+                if not state.task_upid:
+                    raise RuntimeError(f"Container {state.vmid} bloccato (lock {esistente['lock']})")
+                wait_task(proxmox, _upid_node(state.task_upid, node), state.task_upid, timeout_s=900)
+
+            mark_vmid_in_use(state.vmid, node)
+            state.task_upid = None
+        state.reached("cloned")
+
+    # ridimensiona il disco in base al tipo di VM scelto
+    # dimensione assoluta invece di "+N": ripetere il passo non fa crescere il disco due volte
+    if not state.done("resized"):
+        dimensione_disk = int(vm_type.disk)
+        if dimensione_disk > TEMPLATE_DISK_GB:
+
+            with stage("resize"):
+                upid_resize = proxmox.nodes(node).lxc(state.vmid).resize.put(
+                    disk="rootfs",
+                    size=f"{dimensione_disk}G",
+                )
+
+                wait_task(proxmox, node, upid_resize, timeout_s=300)
+        state.reached("resized")
+
+    # ram,cpu,hostname e rete
+    if not state.done("configured"):
+        config = dict(
+            cores=int(vm_type.cores),
+            memory=int(vm_type.ram),
+            hostname=state.hostname,
+        )
+        if lease:
+            config["net0"] = net0_config(lease)
+
+        with stage("config"):
+            proxmox.nodes(node).lxc(state.vmid).config.put(**config)
+        state.reached("configured")
+
+    # avvio vm (alla ripresa solo se non è già acceso)
+    if not state.done("started"):
+        with stage("start"):
+            corrente = _container_status(proxmox, node, state.vmid) if state.resumed else None
+            if not corrente or corrente.get("status") != "running":
+                upid_start = proxmox.nodes(node).lxc(state.vmid).status.start.post()
+                wait_task(proxmox, node, upid_start, timeout_s=300)
+        state.reached("started")
+
+    # ottiene l'ip della VM: già noto con l'IPAM, altrimenti attesa del DHCP
+    if not state.done("ip_known"):
+        if lease:
+            state.ip_address = lease.address
+        else:
+            with stage("ip_wait"):
+                state.ip_address = wait_lxc_ipv4_from_interfaces(proxmox, node, state.vmid, timeout_s=120)
+        state.reached("ip_known")
+
+    return state.vmid, state.hostname, state.ip_address
+
+
+def provision_request(req: VmRequest) -> VmCredentials:
+
+    """
+    Provisiona la VM di una richiesta accettata
+    Se il pool del tipo di VM ha un container già pronto (utils/warm_pool.py) lo assegna
+    rinominandolo, altrimenti esegue il clone completo con build_container
+    Crea un nuovo utente all'interno della VM tramite SSH con le credenziali generate
+    Salva le credenziali di accesso alla VM nel DB e porta la richiesta in "READY"
+
+    Ogni passo completato viene salvato sul job come checkpoint (CHECKPOINTS): un nuovo tentativo
+    dopo un errore o un riavvio riprende dal passo successivo sullo stesso container,
+    senza rifare il clone
+
+    Viene eseguita dai worker della coda (utils/jobs.py), mai dentro una richiesta HTTP.
+    In caso di errore alza l'eccezione: lo stato "FAILED" viene gestito dal worker.
+
+    """
+
+    # import qui: warm_pool usa build_container di questo modulo
+    from utils.warm_pool import claim_warm_container
+
+    user = db.session.get(User, req.user_id)
+    vm_type = db.session.get(VmType, req.vm_type_id)
+    if not vm_type:
+        raise RuntimeError("Tipo VM non trovato")
+
+    job = req.job
+    state = BuildState.of_job(job) if job else BuildState()
+    if state.checkpoint:
+        logger.info("Provisioning della richiesta %s ripreso dopo il checkpoint %s (vmid %s su %s)",
+                    req.id, state.checkpoint, state.vmid, state.node)
+
+    # ottiene dati di accesso per API Proxmox
+    proxmox = proxmox_client()
+
+    warm = None
+    if state.vmid is None:
+        with stage("warm_claim"):
+            warm = claim_warm_container(vm_type, req)
+
+    if warm:
+        # container già clonato e avviato: basta rinominarlo
+        set_node(warm.node)
+        hostname = f"vm-{user.username}-{warm.vmid}"
+        with stage("rename"):
+            proxmox.nodes(warm.node).lxc(warm.vmid).config.put(hostname=hostname)
+            bind_ip_to_request(warm.vmid, req.id)
+        state.node, state.vmid, state.hostname, state.ip_address = warm.node, warm.vmid, hostname, warm.ip_address
+        state.reached("ip_known")
+
+    elif not state.done("ip_known"):
+        # alla ripresa il container esiste già: si resta sul suo nodo
+        with stage("placement"):
+            node = choose_node_for_job(req, vm_type, node=state.node if state.vmid else None)
+        set_node(node)
+        build_container(proxmox, node, vm_type, lambda vmid: f"vm-{user.username}-{vmid}",
+                        vm_request_id=req.id, state=state)
+    else:
+        set_node(state.node)
+
+    # imposta username e password per la VM
+    vm_username = user.username
+    vm_password = gen_password(12)
+
+    # crea l'utente all'interno della VM tramite SSH (idempotente: l'utente viene creato solo se manca)
+    with stage("ssh_user"):
+        create_user_over_ssh(host_ip=state.ip_address,bootstrap_user=BOOTSTRAP_USER,bootstrap_pass=BOOTSTRAP_PASS,
+            new_user=vm_username,new_pass=vm_password,make_sudo=True,lock_bootstrap=False,timeout_s=240,
+            hostname=state.hostname)
+
+    # salva le credenziali di accesso da fornire all'utente
+    creds = VmCredentials.query.filter_by(vm_request_id=req.id).first()
+    if not creds:
+        creds = VmCredentials(vm_request_id=req.id)
+
+    creds.vmid = state.vmid
+    creds.ip_address = state.ip_address
+    creds.username = vm_username
+    creds.password = vm_password
+    creds.hostname = state.hostname
+
+    # aggiorna stato: credenziali, stato e ultimo checkpoint nello stesso commit
+    req.status = "READY"
+    db.session.add(creds)
+    state.reached("user_created")
+    db.session.commit()
+
+    return creds
@@ -1,37 +1,201 @@
 # utils/proxmox.py
-import os,time
+import os,time,threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from proxmoxer import ProxmoxAPI
-from flask import current_app
+from utils.task_watcher import task_watcher
+from utils.aio import run_sync
+from utils.metrics import counter, histogram, api_endpoint
 from dotenv import load_dotenv
 load_dotenv()
 
 
-# funzione che estrae dal .env le variabili per connettersi a Proxmox
-def proxmox_client():
-    return ProxmoxAPI(
+# porta dell'API Proxmox
+PROXMOX_PORT = int(os.getenv("PROXMOX_PORT", "8006"))
+# connessioni keep-alive mantenute verso l'API (una per worker che lavora in parallelo)
+POOL_SIZE = int(os.getenv("PROXMOX_POOL_SIZE", "10"))
+# tentativi di riconnessione in caso di errore di connessione (la richiesta non è ancora partita)
+CONNECT_RETRIES = int(os.getenv("PROXMOX_CONNECT_RETRIES", "2"))
+
+# registro dei client condivisi dal processo, chiave (host, user, token)
+_clients = {}
+_lock = threading.Lock()
+
+# contatori delle chiamate API (vedi proxmox_stats)
+_stats = {"requests": 0, "errors": 0, "latency_s": 0.0, "reconnects": 0, "connections": 0}
+_stats_lock = threading.Lock()
+_adapters = {}
+
+# metriche Prometheus delle chiamate API (vedi utils/metrics.py)
+API_SECONDS = histogram("portal_proxmox_request_seconds", "Durata delle chiamate all'API Proxmox",
+                        ("method", "endpoint"))
+API_REQUESTS = counter("portal_proxmox_requests_total", "Chiamate all'API Proxmox per codice di risposta",
+                       ("method", "endpoint", "code"))
+API_RECONNECTS = counter("portal_proxmox_reconnects_total", "Client Proxmox ricreati dopo un errore di connessione")
+
+
+def _client_key() -> tuple:
+    return (
         os.getenv("PROXMOX_HOST", "192.168.56.15"),
-        user=os.getenv("PROXMOX_USER" , "root@pam"),
-        token_name=os.getenv("PROXMOX_TOKEN_NAME"),
+        os.getenv("PROXMOX_USER" , "root@pam"),
+        os.getenv("PROXMOX_TOKEN_NAME"),
+    )
+
+
+def _session(proxmox: ProxmoxAPI) -> requests.Session:
+    # sessione HTTP del client: proxmoxer non permette di passarne una propria e la tiene in _store (privato),
+    # per questo la versione è fissata in requirements.txt. Se cambia, meglio un errore chiaro che un pool ignorato
+    session = getattr(proxmox, "_store", {}).get("session")
+    if not isinstance(session, requests.Session):
+        raise RuntimeError("Versione di proxmoxer non supportata: sessione HTTP non trovata (vedi requirements.txt)")
+    return session
+
+
+def _new_client(key: tuple) -> ProxmoxAPI:
+
+    """
+    Crea un client Proxmox con una sessione HTTP keep-alive:
+    - pool di POOL_SIZE connessioni riusate tra le chiamate e tra i thread
+    - nuovo tentativo automatico sugli errori di connessione
+    - ogni chiamata aggiorna i contatori di proxmox_stats
+
+    """
+
+    host, user, token_name = key
+    proxmox = ProxmoxAPI(
+        host,
+        port=PROXMOX_PORT,
+        user=user,
+        token_name=token_name,
         token_value=os.getenv("PROXMOX_TOKEN_VALUE"),
         verify_ssl=False,
     )
 
+    # solo gli errori di connessione vengono ritentati: una POST (es. clone) non parte mai due volte
+    retry = Retry(total=None, connect=CONNECT_RETRIES, read=0, redirect=0, status=0, other=0, backoff_factor=0.2)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, pool_block=True, max_retries=retry)
+
+    session = _session(proxmox)
+    session.mount("https://", adapter)
+    _adapters[key] = adapter
+
+    send = session.request
+
+    def request(method, url, *args, **kwargs):
+        start = time.perf_counter()
+        endpoint = api_endpoint(url)
+        code = "error"
+        try:
+            resp = send(method, url, *args, **kwargs)
+            code = resp.status_code
+            return resp
+        except requests.ConnectionError:
+            # connessione persa anche dopo i tentativi: il prossimo proxmox_client() ne crea una nuova
+            with _stats_lock:
+                _stats["errors"] += 1
+            reset_proxmox_client(key)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with _stats_lock:
+                _stats["requests"] += 1
+                _stats["latency_s"] += elapsed
+            API_SECONDS.observe(elapsed, method=method, endpoint=endpoint)
+            API_REQUESTS.inc(method=method, endpoint=endpoint, code=code)
+
+    session.request = request
+    return proxmox
+
+
+# funzione che estrae dal .env le variabili per connettersi a Proxmox
+def proxmox_client():
+
+    """
+    Ritorna il client Proxmox condiviso dal processo (thread-safe).
+    Il client viene creato alla prima chiamata e riusato, insieme alle sue connessioni
+    keep-alive, da tutte le chiamate successive
+
+    """
+
+    key = _client_key()
+    with _lock:
+        proxmox = _clients.get(key)
+        if proxmox is None:
+            proxmox = _new_client(key)
+            _clients[key] = proxmox
+        return proxmox
+
+
+def reset_proxmox_client(key: tuple = None) -> None:
+
+    """
+    Scarta il client condiviso (es. dopo un errore di connessione o un cambio di token):
+    la chiamata successiva a proxmox_client() ne crea uno nuovo
+
+    """
+
+    key = key or _client_key()
+    with _lock:
+        proxmox = _clients.pop(key, None)
+        adapter = _adapters.pop(key, None)
+
+    if proxmox is not None:
+        API_RECONNECTS.inc()
+        with _stats_lock:
+            _stats["reconnects"] += 1
+            _stats["connections"] += _count_connections(adapter)
+        _session(proxmox).close()
+
+
+def _count_connections(adapter: HTTPAdapter) -> int:
+    pools = adapter.poolmanager.pools
+    return sum(pools[k].num_connections for k in list(pools.keys()) if k in pools)
+
+
+def proxmox_stats() -> dict:
+
+    """
+    Contatori delle chiamate all'API Proxmox del processo:
+    numero di richieste, errori, latenza media, connessioni TCP/TLS aperte e riusate
+
+    """
+
+    with _lock:
+        adapters = list(_adapters.values())
+
+    with _stats_lock:
+        stats = dict(_stats)
+
+    stats["connections"] += sum(_count_connections(a) for a in adapters)
+    stats["reused"] = max(stats["requests"] - stats["connections"], 0)
+    stats["avg_latency_ms"] = round(stats["latency_s"] / stats["requests"] * 1000, 2) if stats["requests"] else 0.0
+    return stats
+
+
+async def wait_task_async(proxmox, node: str, upid: str, timeout_s: int = 600) -> str:
+
+    """
+    Attende il completamento di una task Proxmox senza occupare un thread tra un controllo e l'altro.
+    La task viene seguita dal TaskWatcher del loop (utils/task_watcher.py), che controlla
+    tutte le task in corso con una sola richiesta per nodo, invece di un polling per ogni task.
+    Le richieste usano il client proxmox indicato (connessioni del pool e metriche di proxmox_client),
+    eseguite nel pool di thread di run_blocking
+    Alza RuntimeError se la task fallisce (exitstatus diverso da "OK") o scade il timeout.
+
+    """
+
+    return await task_watcher().wait(proxmox, node, upid, timeout_s=timeout_s)
+
 
 # fonte chatgpt, causa: creazione fallita perchè provavo ad avviarla mentre il clone era ancora in corso
 def wait_task(proxmox, node: str, upid: str, timeout_s: int = 600):
     
     """
     Funzione che attende il completamento di una task Proxmox.
-    Verifica continuamente lo stato della task fino a quando non viene completata o scade il timeout.
-
-    """
-    deadline = time.time() + timeout_s
-    while time.time() < deadline:
-        st = proxmox.nodes(node).tasks(upid).status.get()
-        if st.get("status") == "stopped":
-            exitstatus = st.get("exitstatus")
-            if exitstatus == "OK":
-                return
-            raise RuntimeError(f"Task Proxmox fallito: {exitstatus}")
-        time.sleep(1)
-    raise RuntimeError("Timeout: task Proxmox non terminato in tempo")
+    Wrapper sincrono di wait_task_async, eseguita sul loop condiviso (utils/aio.py): il thread
+    che chiama resta in attesa, il polling è fatto dal TaskWatcher del loop con il client proxmox
+    Alza RuntimeError se la task fallisce (exitstatus diverso da "OK") o scade il timeout.
+
+    """
+    return run_sync(wait_task_async(proxmox, node, upid, timeout_s))
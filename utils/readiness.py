@@ -0,0 +1,195 @@
+# utils/readiness.py
+import os, heapq, random, asyncio, weakref, itertools, logging
+from utils.metrics import POLL_ITERATIONS, histogram, gauge
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# attesa tra due prove sullo stesso host: parte dal minimo, raddoppia fino al massimo, con jitter
+MIN_INTERVAL_S = float(os.getenv("PORTAL_PROBE_MIN_S", "0.2"))
+MAX_INTERVAL_S = float(os.getenv("PORTAL_PROBE_MAX_S", "1"))
+# timeout della connessione TCP e della lettura del banner SSH di ogni prova (secondi)
+CONNECT_TIMEOUT_S = float(os.getenv("PORTAL_PROBE_CONNECT_S", "2"))
+# prove (socket aperti) contemporanee al massimo
+CONCURRENCY = int(os.getenv("PORTAL_PROBE_CONCURRENCY", "256"))
+
+# righe che un server SSH può mandare prima dell'identificazione "SSH-..." (RFC 4253, 4.2)
+_BANNER_LINES = 10
+
+READY_SECONDS = histogram("portal_readiness_seconds", "Attesa di un host dalla prima prova alla porta/SSH pronta",
+                          ("check",), buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+
+
+class _Probe:
+
+    def __init__(self, host: str, port: int, banner: bool):
+        loop = asyncio.get_running_loop()
+        self.key = (host, port, banner)
+        self.host = host
+        self.port = port
+        self.banner = banner
+        self.start = loop.time()
+        self.future = loop.create_future()
+        self.waiters = 0
+        self.attempts = 0
+        self.last_error = None
+
+    @property
+    def check(self) -> str:
+        return "ssh_banner" if self.banner else "tcp_port"
+
+
+class ReadinessProber:
+
+    """
+    Controlla con una sola coroutine quando molti host diventano raggiungibili:
+    porta TCP aperta oppure banner SSH ricevuto (senza login).
+    Le prove di tutti gli host sono connessioni non bloccanti sullo stesso event loop,
+    programmate su un'unica coda per scadenza con backoff esponenziale e jitter
+    (gli host avviati insieme non vengono provati tutti nello stesso istante).
+    Più attese sullo stesso host condividono le prove; ognuna viene risvegliata
+    appena l'host risponde.
+
+    """
+
+    def __init__(self, min_interval_s: float = MIN_INTERVAL_S, max_interval_s: float = MAX_INTERVAL_S,
+                 connect_timeout_s: float = CONNECT_TIMEOUT_S, concurrency: int = CONCURRENCY):
+        self.min_interval_s = min_interval_s
+        self.max_interval_s = max_interval_s
+        self.connect_timeout_s = connect_timeout_s
+        self._probes = {}
+        self._coda = []
+        self._seq = itertools.count()
+        self._in_volo = set()
+        self._posti = asyncio.Semaphore(concurrency)
+        self._sveglia = asyncio.Event()
+        self._runner = None
+        # contatori: prove fatte e host diventati pronti
+        self.checks = 0
+        self.ready = 0
+
+    async def wait(self, host: str, port: int, banner: bool = True, timeout_s: float = 180) -> float:
+
+        """
+        Aspetta che host:port accetti connessioni (e con banner che mandi l'identificazione SSH)
+        Ritorna i secondi passati dalla prima prova sull'host
+        Alza RuntimeError se l'host non è pronto entro timeout_s
+
+        """
+
+        key = (host, int(port), bool(banner))
+        probe = self._probes.get(key)
+        if probe is None:
+            probe = self._probes[key] = _Probe(host, int(port), bool(banner))
+            self._schedule(probe, 0)
+        probe.waiters += 1
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._loop(), name="readiness-prober")
+
+        try:
+            # shield: chi smette di aspettare non annulla l'attesa degli altri sullo stesso host
+            return await asyncio.wait_for(asyncio.shield(probe.future), timeout_s)
+        except asyncio.TimeoutError:
+            cosa = "SSH" if probe.banner else f"Porta {probe.port}"
+            raise RuntimeError(f"{cosa} non disponibile su {host} entro {timeout_s}s. "
+                               f"Ultimo errore: {probe.last_error}") from None
+        finally:
+            probe.waiters -= 1
+            if probe.waiters == 0 and self._probes.get(key) is probe:
+                # nessuno aspetta più: l'host esce dalla coda
+                del self._probes[key]
+
+    def pending(self) -> int:
+        return len(self._probes)
+
+    def _schedule(self, probe: _Probe, delay_s: float) -> None:
+        due = asyncio.get_running_loop().time() + delay_s
+        heapq.heappush(self._coda, (due, next(self._seq), probe))
+        self._sveglia.set()
+
+    def _backoff(self, attempts: int) -> float:
+        base = min(self.max_interval_s, self.min_interval_s * 2 ** (attempts - 1))
+        return random.uniform(base / 2, base)
+
+    async def _loop(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while self._probes:
+            now = loop.time()
+            while self._coda and self._coda[0][0] <= now:
+                _, _, probe = heapq.heappop(self._coda)
+                if self._probes.get(probe.key) is probe:
+                    task = asyncio.create_task(self._check(probe))
+                    self._in_volo.add(task)
+                    task.add_done_callback(self._in_volo.discard)
+
+            attesa = self._coda[0][0] - now if self._coda else None
+            self._sveglia.clear()
+            try:
+                await asyncio.wait_for(self._sveglia.wait(), attesa)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _check(self, probe: _Probe) -> None:
+        async with self._posti:
+            probe.attempts += 1
+            self.checks += 1
+            POLL_ITERATIONS.inc(loop=probe.check)
+            try:
+                await self._probe_once(probe)
+                pronto = True
+            except (OSError, asyncio.TimeoutError, ValueError) as e:
+                probe.last_error = e.__class__.__name__ if not str(e) else str(e)
+                pronto = False
+
+        if self._probes.get(probe.key) is not probe:
+            return
+        if pronto:
+            del self._probes[probe.key]
+            elapsed = asyncio.get_running_loop().time() - probe.start
+            READY_SECONDS.observe(elapsed, check=probe.check)
+            self.ready += 1
+            if not probe.future.done():
+                probe.future.set_result(elapsed)
+            self._sveglia.set()
+        else:
+            self._schedule(probe, self._backoff(probe.attempts))
+
+    async def _probe_once(self, probe: _Probe) -> None:
+
+        """
+        Una prova: connessione TCP e, con banner, lettura della riga di identificazione "SSH-..."
+        La connessione viene chiusa subito, senza key exchange né login
+
+        """
+
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(probe.host, probe.port),
+                                                self.connect_timeout_s)
+        try:
+            if not probe.banner:
+                return
+            for _ in range(_BANNER_LINES):
+                riga = await asyncio.wait_for(reader.readline(), self.connect_timeout_s)
+                if not riga:
+                    raise ConnectionError("connessione chiusa prima del banner SSH")
+                if riga.startswith(b"SSH-"):
+                    return
+            raise ValueError("banner SSH non ricevuto")
+        finally:
+            writer.close()
+
+
+# un prober per event loop (di solito solo quello condiviso di utils/aio.py)
+_probers = weakref.WeakKeyDictionary()
+gauge("portal_readiness_hosts", "Host in attesa di porta o banner SSH",
+      lambda: sum(p.pending() for p in list(_probers.values())))
+
+
+def readiness_prober() -> ReadinessProber:
+    """Prober del loop corrente (da chiamare dentro al loop)."""
+    loop = asyncio.get_running_loop()
+    prober = _probers.get(loop)
+    if prober is None:
+        prober = _probers[loop] = ReadinessProber()
+    return prober
@@ -1,5 +1,22 @@
 # utils/ssh.py
-import time,socket,secrets,string,shlex,paramiko
+import os,time,random,asyncio,secrets,string,shlex,threading,paramiko
+from utils.metrics import counter, histogram, POLL_ITERATIONS
+from utils.aio import run_sync, run_blocking
+from utils.readiness import readiness_prober
+
+# porta SSH dei container
+SSH_PORT = int(os.getenv("PORTAL_SSH_PORT", "22"))
+# connessioni SSH inutilizzate da più di così vengono chiuse (secondi)
+IDLE_S = float(os.getenv("PORTAL_SSH_IDLE_S", "60"))
+
+# cache delle connessioni autenticate, chiave (host, user) -> [SSHClient, ultimo utilizzo]
+_connections = {}
+_lock = threading.Lock()
+
+# metriche Prometheus delle operazioni SSH (vedi utils/metrics.py)
+SSH_SECONDS = histogram("portal_ssh_seconds", "Durata delle operazioni SSH (connessione, comando)", ("op",))
+SSH_ERRORS = counter("portal_ssh_errors_total", "Operazioni SSH fallite", ("op",))
+SSH_RECONNECTS = counter("portal_ssh_reconnects_total", "Comandi SSH ripetuti su una nuova connessione")
 
 # metodi generai in parte da ChatGPT per risolvere vari problemi come la mancata connessione SSH e mancata creazione dell'utente
 # genera una password casuale 
@@ -20,65 +37,183 @@ def gen_password(n: int = 16) -> str:
     password = "".join(car_random)
     return password
 
+async def wait_port_async(host: str, port: int = 22, timeout_s: int = 180) -> None:
+    """Aspetta che la porta TCP sia raggiungibile (es: 22 per SSH), con il prober condiviso di utils/readiness.py."""
+    await readiness_prober().wait(host, port, banner=False, timeout_s=timeout_s)
+
+
 # funzione simile a wait_task
 def wait_port(host: str, port: int = 22, timeout_s: int = 180) -> None:
-    """Aspetta che la porta TCP sia raggiungibile (es: 22 per SSH)."""
-    deadline = time.time() + timeout_s
-    while time.time() < deadline:
-        try:
-            with socket.create_connection((host, port), timeout=3):
-                return
-        except OSError:
-            time.sleep(2)
-    raise RuntimeError(f"Porta {port} non disponibile su {host} entro {timeout_s}s")
+    """Aspetta che la porta TCP sia raggiungibile (wrapper sincrono di wait_port_async)."""
+    run_sync(wait_port_async(host, port, timeout_s))
 
 
-def ssh_exec(host: str, user: str, password: str, cmd: str, timeout: int = 30) -> str:
-    """Esegue un comando via SSH (non interattivo) e ritorna stdout. Alza eccezione se rc != 0."""
+def _connect(host: str, user: str, password: str, timeout: int = 30) -> paramiko.SSHClient:
     client = paramiko.SSHClient()
     client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    try:
+        with SSH_SECONDS.time(op="connect"):
+            client.connect(hostname=host,port=SSH_PORT,username=user,password=password,timeout=timeout,banner_timeout=timeout,
+                auth_timeout=timeout,allow_agent=False,look_for_keys=False,)
+    except Exception:
+        SSH_ERRORS.inc(op="connect")
+        raise
+    return client
+
 
+def _close(client: paramiko.SSHClient) -> None:
     try:
-        client.connect(hostname=host,username=user,password=password,timeout=timeout,banner_timeout=timeout,
-            auth_timeout=timeout,allow_agent=False,look_for_keys=False,)
+        client.close()
+    except Exception:
+        pass
 
-        stdin, stdout, stderr = client.exec_command(cmd)
-        out = stdout.read().decode("utf-8", "ignore")
-        err = stderr.read().decode("utf-8", "ignore")
-        rc = stdout.channel.recv_exit_status()
 
-        if rc != 0:
-            raise RuntimeError(f"SSH cmd non riuscito")
-        return out.strip()
+def ssh_client(host: str, user: str, password: str, timeout: int = 30) -> paramiko.SSHClient:
 
-    finally:
-        try:
-            client.close()
-        except Exception:
-            pass
+    """
+    Ritorna una connessione SSH autenticata verso host, riusando quella in cache se ancora attiva
+    Una sola connessione (key exchange + login) serve tutti i comandi verso lo stesso host/utente;
+    le connessioni inutilizzate da più di IDLE_S secondi vengono chiuse
 
+    """
 
-def wait_ssh_up(host: str, user: str, password: str, timeout_s: int = 180) -> None:
+    now = time.monotonic()
+    scadute = []
+
+    with _lock:
+        for key, (client, last) in list(_connections.items()):
+            if now - last > IDLE_S:
+                scadute.append(_connections.pop(key)[0])
+
+        entry = _connections.get((host, user))
+        if entry:
+            transport = entry[0].get_transport()
+            if transport is not None and transport.is_active():
+                entry[1] = now
+                client = entry[0]
+            else:
+                scadute.append(_connections.pop((host, user))[0])
+                entry = None
+
+    for vecchio in scadute:
+        _close(vecchio)
+
+    if entry:
+        return client
+
+    client = _connect(host, user, password, timeout=timeout)
+    with _lock:
+        esistente = _connections.get((host, user))
+        if esistente:
+            # un altro thread si è connesso nel frattempo: si usa la sua connessione
+            _close(client)
+            esistente[1] = time.monotonic()
+            return esistente[0]
+        _connections[(host, user)] = [client, time.monotonic()]
+    return client
+
+
+def close_ssh(host: str, user: str = None) -> None:
+    """Chiude le connessioni in cache verso host (di tutti gli utenti se user è None)."""
+    with _lock:
+        chiavi = [k for k in _connections if k[0] == host and (user is None or k[1] == user)]
+        clients = [_connections.pop(k)[0] for k in chiavi]
+    for client in clients:
+        _close(client)
+
+
+def _run(client: paramiko.SSHClient, cmd: str, stdin_data: str = None, timeout: int = 30) -> tuple:
+
+    """
+    Esegue un comando su un nuovo canale della connessione
+    Ritorna la tupla (rc, stdout, stderr)
+
+    """
+
+    try:
+        with SSH_SECONDS.time(op="exec"):
+            stdin, stdout, stderr = client.exec_command(cmd, timeout=timeout)
+            if stdin_data is not None:
+                stdin.write(stdin_data)
+                stdin.channel.shutdown_write()
+
+            out = stdout.read().decode("utf-8", "ignore")
+            err = stderr.read().decode("utf-8", "ignore")
+            rc = stdout.channel.recv_exit_status()
+    except Exception:
+        SSH_ERRORS.inc(op="exec")
+        raise
+    return rc, out, err
+
+
+def _run_cached(host: str, user: str, password: str, cmd: str, timeout: int = 30, stdin_data: str = None) -> tuple:
+    # comando sulla connessione in cache (bloccante, paramiko), ritorna (rc, stdout, stderr)
+    # timeout vale per il comando, per la connessione e il login al massimo 30 secondi
+    connect_timeout = min(timeout, 30)
+    client = ssh_client(host, user, password, timeout=connect_timeout)
+
+    try:
+        return _run(client, cmd, stdin_data=stdin_data, timeout=timeout)
+    except (paramiko.SSHException, EOFError, OSError):
+        # connessione in cache caduta: una sola riconnessione
+        SSH_RECONNECTS.inc()
+        close_ssh(host, user)
+        client = ssh_client(host, user, password, timeout=connect_timeout)
+        return _run(client, cmd, stdin_data=stdin_data, timeout=timeout)
+
+
+def _exec(host: str, user: str, password: str, cmd: str, timeout: int = 30, stdin_data: str = None) -> str:
+    rc, out, err = _run_cached(host, user, password, cmd, timeout=timeout, stdin_data=stdin_data)
+    if rc != 0:
+        raise RuntimeError(f"SSH cmd non riuscito (rc={rc}): {err.strip()}")
+    return out.strip()
+
+
+async def ssh_exec_async(host: str, user: str, password: str, cmd: str, timeout: int = 30,
+                         stdin_data: str = None) -> str:
+    """Esegue un comando via SSH e ritorna stdout (paramiko gira nel pool di thread di utils/aio.py)."""
+    return await run_blocking(_exec, host, user, password, cmd, timeout=timeout, stdin_data=stdin_data)
+
+
+def ssh_exec(host: str, user: str, password: str, cmd: str, timeout: int = 30, stdin_data: str = None) -> str:
+    """Esegue un comando via SSH (non interattivo) e ritorna stdout. Alza eccezione se rc != 0."""
+    return run_sync(ssh_exec_async(host, user, password, cmd, timeout=timeout, stdin_data=stdin_data))
+
+
+async def wait_ssh_up_async(host: str, user: str, password: str, timeout_s: int = 180) -> None:
     """
     Aspetta che:
-    - la porta 22 sia aperta
-    - il banner SSH risponda correttamente (paramiko)
+    - sulla porta SSH (22 o PORTAL_SSH_PORT) risponda sshd con il suo banner, senza login
+      (prober condiviso di utils/readiness.py: tutti gli host su una sola coroutine, backoff con jitter)
+    - il login SSH riesca (paramiko, nel pool di thread di utils/aio.py), di solito al primo tentativo
+    Tra un tentativo e l'altro non occupa thread.
+    La connessione autenticata resta in cache per i comandi successivi.
     """
-    wait_port(host, 22, timeout_s=timeout_s)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout_s
+    await readiness_prober().wait(host, SSH_PORT, banner=True, timeout_s=timeout_s)
 
-    deadline = time.time() + timeout_s
     last = None
-    while time.time() < deadline:
+    pausa = 0.5
+    while loop.time() < deadline:
+        POLL_ITERATIONS.inc(loop="ssh_login")
         try:
-            ssh_exec(host, user, password, "true", timeout=30)
+            await run_blocking(ssh_client, host, user, password, timeout=30)
             return
         except Exception as e:
+            # banner già ricevuto: sshd c'è, ma il login non ancora (es. utente non ancora creato)
             last = e
-            time.sleep(2)
+            await asyncio.sleep(random.uniform(pausa / 2, pausa))
+            pausa = min(pausa * 2, 4)
 
     raise RuntimeError(f"SSH non disponibile su {host} entro {timeout_s}s. Ultimo errore: {last}")
 
 
+def wait_ssh_up(host: str, user: str, password: str, timeout_s: int = 180) -> None:
+    """Aspetta porta e login SSH (wrapper sincrono di wait_ssh_up_async)."""
+    run_sync(wait_ssh_up_async(host, user, password, timeout_s))
+
+
 def sudo_cmd(cmd: str) -> str:
     """
     Usa sudo NOPASSWD:
@@ -88,49 +223,91 @@ def sudo_cmd(cmd: str) -> str:
     return f"sudo -n bash -lc {cmd!r}"
 
 
-def create_user_over_ssh(
+# prefisso delle righe con cui lo script di bootstrap riporta l'esito di ogni passo
+STEP_MARK = "@@step"
+
+
+def bootstrap_script(steps: list) -> str:
+
+    """
+    Costruisce uno script bash che esegue i passi (nome, comando) in ordine
+    Dopo ogni passo stampa "@@step nome rc" e si ferma al primo passo fallito
+
+    """
+
+    righe = []
+    for name, cmd in steps:
+        righe.append(f"{{ {cmd} ; }}; rc=$?; echo \"{STEP_MARK} {name} $rc\"; [ $rc -eq 0 ] || exit $rc")
+    return "\n".join(righe) + "\n"
+
+
+async def create_user_over_ssh_async(
         
     host_ip: str,bootstrap_user: str,bootstrap_pass: str,new_user: str,new_pass: str,make_sudo: bool = True,
-        lock_bootstrap: bool = False,timeout_s: int = 180,) -> None:
+        lock_bootstrap: bool = False,timeout_s: int = 180,hostname: str = None,) -> dict:
 
     """
     Crea un utente dentro al CT via SSH usando un utente bootstrap che ha sudo NOPASSWD.
+    Se viene passato hostname lo imposta anche dentro al CT (container del pool rinominati).
+    Tutti i passi girano come un solo script (sudo -n bash -s) su un solo canale della
+    connessione in cache: niente login ripetuti e password mai sulla riga di comando.
+    Le attese di porta e login girano sul loop, i comandi paramiko nel pool di thread di utils/aio.py.
+    Ritorna il codice di uscita di ogni passo, alza RuntimeError indicando il passo fallito.
     """
     # sanity: evita caratteri strani nell'username (useradd è schizzinoso)
     if not new_user.isalnum():
         raise ValueError("new_user deve essere alfanumerico (solo lettere/numeri).")
 
     # aspetta che SSH sia su
-    wait_ssh_up(host_ip, bootstrap_user, bootstrap_pass, timeout_s=timeout_s)
-
-    # Check: sudo NOPASSWD deve funzionare
-    ssh_exec(host_ip, bootstrap_user, bootstrap_pass, "sudo -n true")
+    await wait_ssh_up_async(host_ip, bootstrap_user, bootstrap_pass, timeout_s=timeout_s)
 
     u = shlex.quote(new_user)
 
-    # crea utente se non esiste
-    ssh_exec(
-        host_ip, bootstrap_user, bootstrap_pass,
-        sudo_cmd(f"id -u {u} >/dev/null 2>&1 || useradd -m -s /bin/bash {u}")
-    )
-
-    # imposta password nuovo utente
-    # (quoting robusto: chpasswd legge "user:pass")
-    line = f"{new_user}:{new_pass}"
-    ssh_exec(
-        host_ip, bootstrap_user, bootstrap_pass,
-        sudo_cmd(f"echo {shlex.quote(line)} | chpasswd")
-    )
+    # crea utente se non esiste, imposta la password (chpasswd legge "user:pass")
+    steps = [
+        ("useradd", f"id -u {u} >/dev/null 2>&1 || useradd -m -s /bin/bash {u}"),
+        ("chpasswd", f"printf '%s\\n' {shlex.quote(f'{new_user}:{new_pass}')} | chpasswd"),
+    ]
 
     # aggiunta utente a sudo
     if make_sudo:
-        ssh_exec(
-            host_ip, bootstrap_user, bootstrap_pass,
-            sudo_cmd(f"getent group sudo >/dev/null 2>&1 || exit 0; usermod -aG sudo {u}")
-        )
+        steps.append(("sudo", f"! getent group sudo >/dev/null 2>&1 || usermod -aG sudo {u}"))
+
+    # hostname del container (senza riavvio)
+    if hostname:
+        h = shlex.quote(hostname)
+        steps.append(("hostname", f"hostname {h} && echo {h} > /etc/hostname"))
+
+    # blocco della password dell'utente bootstrap
+    if lock_bootstrap:
+        steps.append(("lock_bootstrap", f"passwd -l {shlex.quote(bootstrap_user)}"))
 
     # verifica della creazione utente
-    ssh_exec(
-        host_ip, bootstrap_user, bootstrap_pass,
-        sudo_cmd(f"getent passwd {u}")
-    )
+    steps.append(("verifica", f"getent passwd {u} >/dev/null"))
+
+    # connessione in cache, riaperta una volta se è caduta dopo wait_ssh_up (lo script è idempotente)
+    rc, out, err = await run_blocking(_run_cached, host_ip, bootstrap_user, bootstrap_pass, "sudo -n bash -s",
+                                      stdin_data=bootstrap_script(steps), timeout=timeout_s)
+
+    esiti = {}
+    for riga in out.splitlines():
+        parti = riga.split()
+        if len(parti) == 3 and parti[0] == STEP_MARK:
+            esiti[parti[1]] = int(parti[2])
+
+    if rc != 0:
+        # nessun passo riportato: è fallito sudo -n (utente bootstrap senza NOPASSWD)
+        fallito = next((name for name, code in esiti.items() if code != 0), "sudo -n")
+        raise RuntimeError(f"Creazione utente via SSH: passo '{fallito}' non riuscito (rc={rc}): {err.strip()}")
+
+    return esiti
+
+
+def create_user_over_ssh(
+        
+    host_ip: str,bootstrap_user: str,bootstrap_pass: str,new_user: str,new_pass: str,make_sudo: bool = True,
+        lock_bootstrap: bool = False,timeout_s: int = 180,hostname: str = None,) -> dict:
+    """Crea l'utente dentro al CT via SSH (wrapper sincrono di create_user_over_ssh_async)."""
+    return run_sync(create_user_over_ssh_async(host_ip, bootstrap_user, bootstrap_pass, new_user, new_pass,
+                                               make_sudo=make_sudo, lock_bootstrap=lock_bootstrap,
+                                               timeout_s=timeout_s, hostname=hostname))
@@ -0,0 +1,216 @@
+# utils/task_watcher.py
+import os, asyncio, weakref, logging
+from utils.metrics import POLL_ITERATIONS, gauge
+from utils.aio import run_blocking
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# intervallo di polling: parte dal minimo e cresce fino al massimo finché non cambia nulla
+MIN_INTERVAL_S = float(os.getenv("PROXMOX_TASK_POLL_MIN_S", "0.5"))
+MAX_INTERVAL_S = float(os.getenv("PROXMOX_TASK_POLL_MAX_S", "5"))
+BACKOFF = 1.5
+# giri in cui una task può mancare dalla lista del nodo prima di chiederne lo stato singolarmente
+MISSING_TICKS = 3
+# giri di polling di un nodo falliti di seguito dopo i quali le sue task in attesa falliscono con l'errore
+MAX_POLL_ERRORS = int(os.getenv("PROXMOX_TASK_POLL_MAX_ERRORS", "3"))
+
+
+def upid_starttime(upid: str) -> int:
+
+    """
+    Estrae l'ora di avvio (epoch) da un UPID Proxmox
+    formato: UPID:nodo:pid:pstart:starttime:tipo:id:utente:
+
+    """
+
+    try:
+        return int(upid.split(":")[4], 16)
+    except (IndexError, ValueError):
+        return 0
+
+
+class _WatchedTask:
+
+    def __init__(self, proxmox, node: str, upid: str, timeout_s: float):
+        loop = asyncio.get_running_loop()
+        self.proxmox = proxmox
+        self.node = node
+        self.upid = upid
+        self.deadline = loop.time() + timeout_s
+        self.starttime = upid_starttime(upid)
+        self.missing = 0
+        self.future = loop.create_future()
+
+
+class TaskWatcher:
+
+    """
+    Segue tutte le task Proxmox in corso di un event loop con una sola coroutine.
+    Ad ogni giro fa una sola richiesta per nodo (nodes/{node}/tasks, i nodi in parallelo)
+    per tutte le task di quel nodo, invece di un ciclo di polling per ogni UPID.
+    Chi aspetta (wait) viene risvegliato appena la task termina
+    (con la stessa semantica di exitstatus e timeout di wait_task).
+    Se il polling di un nodo fallisce MAX_POLL_ERRORS volte di seguito (Proxmox irraggiungibile, 403, 500)
+    le task di quel nodo falliscono con l'errore invece di aspettare il loro timeout.
+
+    """
+
+    def __init__(self, min_interval_s: float = MIN_INTERVAL_S, max_interval_s: float = MAX_INTERVAL_S):
+        self.min_interval_s = min_interval_s
+        self.max_interval_s = max_interval_s
+        self._tasks = {}
+        self._sveglia = asyncio.Event()
+        self._runner = None
+        # giri di polling falliti di seguito per nodo
+        self._errori = {}
+        # contatori: giri di polling e richieste fatte all'API
+        self.ticks = 0
+        self.api_calls = 0
+
+    async def wait(self, proxmox, node: str, upid: str, timeout_s: float = 600) -> str:
+
+        """
+        Aspetta la fine della task e ritorna l'exitstatus ("OK")
+        Alza RuntimeError se la task fallisce o scade il timeout
+
+        """
+
+        task = self._tasks.get(upid)
+        if task is None:
+            task = self._tasks[upid] = _WatchedTask(proxmox, node, upid, timeout_s)
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._loop(), name="proxmox-task-watcher")
+        # una nuova task riporta il polling all'intervallo minimo
+        self._sveglia.set()
+        # shield: chi smette di aspettare (cancellato) non annulla l'attesa degli altri sulla stessa task
+        return await asyncio.shield(task.future)
+
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    async def _loop(self) -> None:
+        interval = self.min_interval_s
+
+        while self._tasks:
+            per_nodo = {}
+            for task in self._tasks.values():
+                per_nodo.setdefault(task.node, []).append(task)
+
+            esiti = await asyncio.gather(*(self._poll_node(node, tasks) for node, tasks in per_nodo.items()),
+                                         return_exceptions=True)
+            cambiato = False
+            for node, esito in zip(per_nodo, esiti):
+                if isinstance(esito, Exception):
+                    cambiato |= self._poll_failed(node, per_nodo[node], esito)
+                else:
+                    self._errori.pop(node, None)
+                    cambiato |= esito
+
+            cambiato |= self._expire()
+            self.ticks += 1
+            POLL_ITERATIONS.inc(loop="proxmox_task")
+
+            interval = self.min_interval_s if cambiato else min(interval * BACKOFF, self.max_interval_s)
+            self._sveglia.clear()
+            try:
+                await asyncio.wait_for(self._sveglia.wait(), interval)
+                interval = self.min_interval_s
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll_node(self, node: str, tasks: list) -> bool:
+
+        """
+        Legge in una sola chiamata le task del nodo avviate dopo la più vecchia task seguita
+        e risolve quelle terminate. Ritorna True se almeno una task è terminata
+
+        """
+
+        proxmox = tasks[0].proxmox
+        since = min(t.starttime for t in tasks) - 1
+        lista = await run_blocking(proxmox.nodes(node).tasks.get, source="all", since=max(since, 0), limit=1000)
+        self.api_calls += 1
+
+        per_upid = {t.get("upid"): t for t in lista or []}
+        terminata = False
+
+        for task in tasks:
+            st = per_upid.get(task.upid)
+
+            if st is None:
+                # non ancora (o non più) nella lista del nodo: dopo qualche giro si chiede lo stato singolo
+                task.missing += 1
+                if task.missing < MISSING_TICKS:
+                    continue
+                try:
+                    st = await run_blocking(proxmox.nodes(node).tasks(task.upid).status.get)
+                except Exception as e:
+                    # UPID errato o non più presente sul nodo: fallisce solo questa task, non il giro del nodo
+                    self._fail(task, RuntimeError(f"Stato della task Proxmox {task.upid} non disponibile: {e}"), e)
+                    terminata = True
+                    continue
+                finally:
+                    self.api_calls += 1
+                if st.get("status") != "stopped":
+                    continue
+                exitstatus = st.get("exitstatus")
+            else:
+                if "endtime" not in st:
+                    continue
+                exitstatus = st.get("status")
+
+            self._finish(task, exitstatus)
+            terminata = True
+
+        return terminata
+
+    def _poll_failed(self, node: str, tasks: list, errore: Exception) -> bool:
+        # un giro del nodo fallito: oltre MAX_POLL_ERRORS di seguito le sue task falliscono. Ritorna True se fallite
+        errori = self._errori[node] = self._errori.get(node, 0) + 1
+        if errori < MAX_POLL_ERRORS:
+            logger.warning("Errore nel polling delle task del nodo %s (%s/%s): %s", node, errori, MAX_POLL_ERRORS, errore)
+            return False
+
+        logger.error("Polling delle task del nodo %s fallito %s volte di seguito: %s", node, errori, errore)
+        self._errori.pop(node, None)
+        for task in tasks:
+            self._fail(task, RuntimeError(f"Polling delle task del nodo {node} non riuscito: {errore}"), errore)
+        return True
+
+    def _finish(self, task: _WatchedTask, exitstatus) -> None:
+        if exitstatus == "OK":
+            self._tasks.pop(task.upid, None)
+            if not task.future.done():
+                task.future.set_result(exitstatus)
+        else:
+            self._fail(task, RuntimeError(f"Task Proxmox fallito: {exitstatus}"))
+
+    def _fail(self, task: _WatchedTask, errore: Exception, causa: Exception = None) -> None:
+        self._tasks.pop(task.upid, None)
+        if not task.future.done():
+            errore.__cause__ = causa
+            task.future.set_exception(errore)
+
+    def _expire(self) -> bool:
+        now = asyncio.get_running_loop().time()
+        scadute = [t for t in self._tasks.values() if t.deadline <= now]
+        for task in scadute:
+            self._fail(task, RuntimeError("Timeout: task Proxmox non terminato in tempo"))
+        return bool(scadute)
+
+
+# un watcher per event loop (di solito solo quello condiviso di utils/aio.py)
+_watchers = weakref.WeakKeyDictionary()
+gauge("portal_proxmox_tasks_watched", "Task Proxmox in attesa di completamento",
+      lambda: sum(w.pending() for w in list(_watchers.values())))
+
+
+def task_watcher() -> TaskWatcher:
+    """Watcher del loop corrente (da chiamare dentro al loop)."""
+    loop = asyncio.get_running_loop()
+    watcher = _watchers.get(loop)
+    if watcher is None:
+        watcher = _watchers[loop] = TaskWatcher()
+    return watcher
@@ -0,0 +1,348 @@
+# utils/templates.py
+import os, time, threading, logging
+from datetime import timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy.exc import IntegrityError
+
+from model.connection import db
+from model.model import TemplateReplica, VmType
+from utils.cluster import cluster_snapshot
+from utils.placement import STORAGE, node_capacities
+from utils.vmids import reserve_vmid, mark_vmid_in_use, release_vmid
+from utils.metrics import counter
+from utils.jobs import utcnow
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# sincronizza le repliche dei template insieme al server: disattivato di default, va attivato (1)
+# in un solo processo perché la prima sincronizzazione copia ogni template master su ogni nodo
+TEMPLATE_SYNC = os.getenv("PORTAL_TEMPLATE_SYNC", "0") != "0"
+# ogni quanto controllare se i template master sono cambiati (secondi)
+TEMPLATE_SYNC_S = float(os.getenv("PORTAL_TEMPLATE_SYNC_S", "300"))
+# una copia in "SYNCING" da più di così è di un processo terminato e viene ripresa (secondi)
+SYNC_TIMEOUT_S = int(os.getenv("PORTAL_TEMPLATE_SYNC_TIMEOUT_S", "1800"))
+# linked clone dalla replica locale sugli storage che li supportano (0 = sempre full clone)
+LINKED_CLONE = os.getenv("PROXMOX_LINKED_CLONE", "0") != "0"
+
+# tipi di storage Proxmox su cui un linked clone di un template è possibile
+LINKED_TYPES = ("lvmthin", "zfspool", "rbd")
+
+CLONES = counter("portal_template_clones_total", "Clone dei container per sorgente del template",
+                 ("source",))
+
+
+def template_node_of(template_vmid: int, default: str) -> str:
+    """Nodo che ospita il template, dalla fotografia del cluster in cache (default se non disponibile)."""
+    try:
+        return cluster_snapshot().vm_node(template_vmid) or default
+    except Exception:
+        return default
+
+
+def clone_source(template_vmid: int, node: str) -> tuple:
+
+    """
+    Sorgente del clone di un container da creare su node: la replica READY del template
+    su node e sullo storage dei container (PROXMOX_STORAGE), altrimenti il template master
+    sul suo nodo (clone tra nodi, più lento)
+    Il linked clone viene usato solo da una replica locale su uno storage che lo supporta
+    e con PROXMOX_LINKED_CLONE attivo
+    Ritorna la tupla (nodo sorgente, vmid sorgente, linked)
+
+    """
+
+    # replica attiva del nodo (indice unico parziale su status != 'RETIRED')
+    replica = db.session.execute(
+        db.select(TemplateReplica.vmid, TemplateReplica.linked, TemplateReplica.status)
+        .where(TemplateReplica.master_vmid == template_vmid, TemplateReplica.node == node,
+               TemplateReplica.storage == STORAGE, TemplateReplica.status != "RETIRED")
+    ).first()
+
+    if replica and replica.status == "READY" and replica.vmid:
+        linked = LINKED_CLONE and replica.linked
+        CLONES.inc(source="linked" if linked else "local")
+        return node, replica.vmid, linked
+
+    template_node = template_node_of(template_vmid, default=node)
+    CLONES.inc(source="local" if template_node == node else "remote")
+    return template_node, template_vmid, False
+
+
+def _master_config(proxmox, master_vmid: int) -> tuple:
+    # nodo, storage e digest della configurazione del template master (il digest cambia a ogni modifica)
+    node = template_node_of(master_vmid, default=None)
+    if node is None:
+        raise RuntimeError(f"Template {master_vmid} non trovato nel cluster")
+    config = proxmox.nodes(node).lxc(master_vmid).config.get()
+    storage = str(config.get("rootfs", "")).split(":", 1)[0]
+    return node, storage, config.get("digest")
+
+
+def _storage_linked(snapshot, node: str) -> bool:
+    storage = snapshot.storages.get((node, STORAGE)) or {}
+    return storage.get("plugintype") in LINKED_TYPES
+
+
+def _claim(master_vmid: int, node: str, digest: str):
+
+    """
+    Prende in carico la copia del template su node: crea la riga della replica
+    oppure la porta in "SYNCING" se è STALE, FAILED o in copia da un processo terminato.
+    Con più processi solo uno ottiene la riga (INSERT con vincolo unico / UPDATE condizionale)
+    Ritorna la replica presa in carico, oppure None se è già aggiornata o in copia
+
+    """
+
+    now = utcnow()
+    filtro = (TemplateReplica.master_vmid == master_vmid, TemplateReplica.node == node,
+              TemplateReplica.storage == STORAGE, TemplateReplica.status != "RETIRED")
+    replica = db.session.execute(db.select(TemplateReplica).where(*filtro)).scalar_one_or_none()
+
+    if replica is None:
+        replica = TemplateReplica(master_vmid=master_vmid, node=node, storage=STORAGE, status="SYNCING",
+                                  sync_ts=now, add_ts=now)
+        db.session.add(replica)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return None
+        return replica
+
+    if replica.status == "READY" and replica.master_digest == digest:
+        return None
+
+    res = db.session.execute(
+        db.update(TemplateReplica)
+        .where(TemplateReplica.id == replica.id, db.or_(
+            TemplateReplica.status.in_(("READY", "STALE", "FAILED")),
+            TemplateReplica.sync_ts < now - timedelta(seconds=SYNC_TIMEOUT_S),
+        ))
+        .values(status="SYNCING", sync_ts=now, last_error=None)
+    )
+    db.session.commit()
+    if res.rowcount != 1:
+        return None
+    db.session.refresh(replica)
+    return replica
+
+
+def _delete_container(proxmox, node: str, vmid: int) -> bool:
+
+    """
+    Elimina una replica non più usata e ne rilascia il vmid
+    Fallisce (e ritorna False) finché esistono linked clone della replica o un clone è in corso:
+    la replica resta "RETIRED" e viene riprovata alla sincronizzazione successiva
+
+    """
+
+    from utils.proxmox import wait_task
+
+    try:
+        upid = proxmox.nodes(node).lxc(vmid).delete()
+        if upid:
+            wait_task(proxmox, node, upid, timeout_s=600)
+    except Exception as e:
+        if "does not exist" not in str(e):
+            logger.warning("Replica %s su %s non eliminata: %s", vmid, node, e)
+            return False
+
+    release_vmid(vmid)
+    return True
+
+
+def _copy(proxmox, replica: TemplateReplica, master_node: str, digest: str, linked: bool) -> None:
+
+    """
+    Copia il template master sul nodo della replica (full clone sullo storage PROXMOX_STORAGE),
+    lo converte in template e sostituisce la replica precedente, che viene eliminata
+
+    """
+
+    from utils.proxmox import wait_task
+
+    vmid = reserve_vmid(node=replica.node)
+    params = dict(newid=vmid, hostname=f"tpl-{replica.master_vmid}-{replica.node}", full=1, storage=STORAGE)
+    if master_node != replica.node:
+        params["target"] = replica.node
+
+    upid = None
+    try:
+        upid = proxmox.nodes(master_node).lxc(replica.master_vmid).clone.post(**params)
+        wait_task(proxmox, master_node, upid, timeout_s=SYNC_TIMEOUT_S)
+        mark_vmid_in_use(vmid, replica.node)
+        proxmox.nodes(replica.node).lxc(vmid).template.post()
+    except Exception:
+        # copia a metà: eliminata; clone non partito (es. vmid occupato fuori dal portale): solo il vmid
+        if upid:
+            _delete_container(proxmox, replica.node, vmid)
+        else:
+            release_vmid(vmid)
+        raise
+
+    precedente = replica.vmid if replica.vmid != replica.master_vmid else None
+    if precedente:
+        # la replica vecchia resta registrata finché non viene eliminata
+        db.session.add(TemplateReplica(master_vmid=replica.master_vmid, node=replica.node, storage=replica.storage,
+                                       vmid=precedente, status="RETIRED", master_digest=replica.master_digest,
+                                       linked=replica.linked, sync_ts=utcnow()))
+
+    replica.vmid = vmid
+    replica.master_digest = digest
+    replica.linked = linked
+    replica.status = "READY"
+    replica.sync_ts = utcnow()
+    db.session.commit()
+
+
+def _delete_retired(proxmox) -> int:
+    eliminate = 0
+    for replica in db.session.execute(
+        db.select(TemplateReplica).where(TemplateReplica.status == "RETIRED")
+    ).scalars().all():
+        if _delete_container(proxmox, replica.node, replica.vmid):
+            db.session.delete(replica)
+            db.session.commit()
+            eliminate += 1
+    return eliminate
+
+
+def sync_templates(proxmox) -> dict:
+
+    """
+    Allinea le repliche dei template master dei tipi di VM su ogni nodo utilizzabile
+    (PROXMOX_NODES online) per lo storage PROXMOX_STORAGE:
+    - le repliche copiate da una versione precedente del master (digest della configurazione
+      diverso) passano subito a "STALE", così i clone tornano a partire dal master;
+    - sul nodo e storage del master la replica è il master stesso (nessuna copia);
+    - sugli altri nodi il master viene copiato e convertito in template, poi la replica
+      precedente viene eliminata (se ha ancora linked clone resta "RETIRED" e si riprova dopo)
+    Ritorna il conteggio di repliche copiate, invariate, eliminate e fallite
+
+    """
+
+    snapshot = cluster_snapshot()
+    nodi = [n.name for n in node_capacities(snapshot) if (n.name, STORAGE) in snapshot.storages]
+    esito = {"copiate": 0, "invariate": 0, "eliminate": 0, "fallite": 0}
+
+    masters = sorted({int(v) for v in db.session.execute(db.select(VmType.template_vmid).distinct()).scalars() if v})
+
+    # repliche di template non più usati da nessun tipo di VM
+    db.session.execute(
+        db.update(TemplateReplica)
+        .where(TemplateReplica.master_vmid.not_in(masters), TemplateReplica.vmid != TemplateReplica.master_vmid,
+               TemplateReplica.status != "SYNCING")
+        .values(status="RETIRED")
+    )
+    db.session.execute(
+        db.delete(TemplateReplica)
+        .where(TemplateReplica.master_vmid.not_in(masters), db.or_(TemplateReplica.vmid.is_(None),
+                                                                   TemplateReplica.vmid == TemplateReplica.master_vmid))
+    )
+    db.session.commit()
+
+    for master_vmid in masters:
+        try:
+            master_node, master_storage, digest = _master_config(proxmox, master_vmid)
+        except Exception as e:
+            logger.warning("Template %s: configurazione del master non leggibile: %s", master_vmid, e)
+            esito["fallite"] += 1
+            continue
+
+        db.session.execute(
+            db.update(TemplateReplica)
+            .where(TemplateReplica.master_vmid == master_vmid, TemplateReplica.status == "READY",
+                   TemplateReplica.vmid != master_vmid, TemplateReplica.master_digest != digest)
+            .values(status="STALE")
+        )
+        db.session.commit()
+
+        for node in nodi:
+            replica = _claim(master_vmid, node, digest)
+            if replica is None:
+                esito["invariate"] += 1
+                continue
+
+            linked = _storage_linked(snapshot, node)
+            try:
+                if node == master_node and STORAGE == master_storage:
+                    if replica.vmid and replica.vmid != master_vmid:
+                        # master spostato sul nodo di una sua copia: la copia non serve più
+                        db.session.add(TemplateReplica(master_vmid=master_vmid, node=node, storage=STORAGE,
+                                                       vmid=replica.vmid, status="RETIRED", linked=replica.linked,
+                                                       sync_ts=utcnow()))
+                    replica.vmid, replica.master_digest, replica.linked = master_vmid, digest, linked
+                    replica.status, replica.sync_ts = "READY", utcnow()
+                    db.session.commit()
+                else:
+                    start = time.perf_counter()
+                    _copy(proxmox, replica, master_node, digest, linked)
+                    logger.info("Template %s copiato su %s/%s (vmid %s) in %.1fs", master_vmid, node, STORAGE,
+                                replica.vmid, time.perf_counter() - start)
+                    esito["copiate"] += 1
+            except Exception as e:
+                logger.exception("Copia del template %s su %s fallita", master_vmid, node)
+                db.session.rollback()
+                replica = db.session.get(TemplateReplica, replica.id)
+                replica.status = "FAILED"
+                replica.last_error = str(e) or e.__class__.__name__
+                db.session.commit()
+                esito["fallite"] += 1
+
+    esito["eliminate"] = _delete_retired(proxmox)
+    return esito
+
+
+def start_template_sync(app):
+
+    """
+    Avvia il thread che sincronizza le repliche dei template ogni PORTAL_TEMPLATE_SYNC_S
+    (solo con PORTAL_TEMPLATE_SYNC=1, di default è disattivato). Va avviato in un solo processo
+
+    """
+
+    if not TEMPLATE_SYNC:
+        return None
+
+    def loop():
+        from utils.proxmox import proxmox_client
+        while True:
+            try:
+                with app.app_context():
+                    sync_templates(proxmox_client())
+            except Exception:
+                logger.exception("Errore nella sincronizzazione dei template")
+            time.sleep(TEMPLATE_SYNC_S)
+
+    thread = threading.Thread(target=loop, name="template-sync", daemon=True)
+    thread.start()
+    return thread
+
+
+# comandi "flask template ...": repliche dei template per nodo
+@click.group("template")
+def template_command() -> None:
+    pass
+
+
+@template_command.command("list")
+@with_appcontext
+def template_list_command() -> None:
+    click.echo(f"storage {STORAGE}, linked clone {'attivi' if LINKED_CLONE else 'disattivati'}")
+    for r in db.session.execute(
+        db.select(TemplateReplica).order_by(TemplateReplica.master_vmid, TemplateReplica.node, TemplateReplica.id)
+    ).scalars():
+        click.echo(f"{r.master_vmid} {r.node}/{r.storage}: vmid={r.vmid} {r.status} linked={r.linked} "
+                   f"sync={r.sync_ts}" + (f" errore={r.last_error}" if r.last_error else ""))
+
+
+@template_command.command("sync")
+@with_appcontext
+def template_sync_command() -> None:
+    from utils.proxmox import proxmox_client
+    esito = sync_templates(proxmox_client())
+    click.echo(", ".join(f"{k}={v}" for k, v in esito.items()))
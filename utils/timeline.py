@@ -0,0 +1,169 @@
+# utils/timeline.py
+import threading
+from contextlib import contextmanager
+
+from model.connection import db
+from model.model import VmRequest, VmType, ProvisioningStage
+from utils import metrics
+from utils.events import publish_stage
+from utils.jobs import utcnow
+
+
+# timeline del provisioning in corso nel thread (una per job)
+_current = threading.local()
+
+
+class Timeline:
+
+    """
+    Passi del provisioning di una richiesta raccolti in memoria durante il job
+    e salvati insieme alla fine (anche se il provisioning fallisce e la sessione viene annullata)
+
+    """
+
+    def __init__(self, vm_request_id: int, attempt: int = 1, user_id: int = None):
+        self.vm_request_id = vm_request_id
+        self.attempt = attempt
+        self.user_id = user_id
+        self.node = None
+        self.stages = []
+
+    def add(self, name: str, start_ts, end_ts, error: Exception = None, node: str = None) -> None:
+        self.stages.append(ProvisioningStage(
+            vm_request_id=self.vm_request_id,
+            attempt=self.attempt,
+            stage=name,
+            node=node or self.node,
+            status="FAILED" if error else "OK",
+            error=(str(error) or error.__class__.__name__)[:2000] if error else None,
+            start_ts=start_ts,
+            end_ts=end_ts,
+            duration_s=(end_ts - start_ts).total_seconds(),
+        ))
+
+    def publish(self, name: str, status: str, duration_s: float = None) -> None:
+        if self.user_id is not None:
+            publish_stage(self.vm_request_id, self.user_id, name, status, self.node, duration_s)
+
+    def save(self) -> None:
+        db.session.add_all(self.stages)
+        db.session.commit()
+        self.stages = []
+
+
+@contextmanager
+def recording(vm_request_id: int, attempt: int = 1, user_id: int = None):
+    """Raccoglie i passi eseguiti nel blocco nella timeline della richiesta (vedi stage)."""
+    timeline = Timeline(vm_request_id, attempt, user_id)
+    _current.timeline = timeline
+    try:
+        yield timeline
+    finally:
+        _current.timeline = None
+
+
+def set_node(node: str) -> None:
+    """Nodo su cui gira il provisioning in corso, registrato nei passi successivi."""
+    timeline = getattr(_current, "timeline", None)
+    if timeline is not None:
+        timeline.node = node
+
+
+@contextmanager
+def stage(name: str):
+
+    """
+    Passo del provisioning: ne misura la durata per /metrics (utils/metrics.py) e,
+    se è in corso un job, lo aggiunge alla timeline della richiesta con l'eventuale errore
+    e ne pubblica inizio e fine agli stream SSE (utils/events.py)
+
+    """
+
+    timeline = getattr(_current, "timeline", None)
+    start_ts = utcnow()
+    if timeline is not None:
+        timeline.publish(name, "RUNNING")
+    try:
+        with metrics.stage(name):
+            yield
+    except Exception as e:
+        if timeline is not None:
+            timeline.add(name, start_ts, utcnow(), error=e)
+            timeline.publish(name, "FAILED", timeline.stages[-1].duration_s)
+        raise
+    else:
+        if timeline is not None:
+            timeline.add(name, start_ts, utcnow())
+            timeline.publish(name, "OK", timeline.stages[-1].duration_s)
+
+
+def percentile(values: list, p: float) -> float:
+    """Percentile p (0-100) di una lista ordinata, con interpolazione lineare."""
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100
+    i = int(k)
+    if i + 1 >= len(values):
+        return values[-1]
+    return values[i] + (values[i + 1] - values[i]) * (k - i)
+
+
+# raggruppamenti disponibili per le statistiche dei passi
+GRUPPI = ("stage", "vm_type", "node")
+
+# ordine dei passi nella pipeline, per mostrare le statistiche nell'ordine in cui vengono eseguiti
+ORDINE_PASSI = ["queue", "warm_claim", "rename", "placement", "vmid", "ip_allocate", "clone", "resize",
+                "config", "start", "ip_wait", "ssh_wait", "ssh_user"]
+
+
+def _ordine(name: str) -> int:
+    return ORDINE_PASSI.index(name) if name in ORDINE_PASSI else len(ORDINE_PASSI)
+
+
+def stage_stats(since, group_by: str = "vm_type") -> list:
+
+    """
+    Statistiche dei passi eseguiti da since in poi, per passo (group_by="stage"),
+    per passo e tipo di VM ("vm_type") oppure per passo e nodo ("node"):
+    numero, falliti, p50/p95/p99 e massimo in secondi.
+    Ritorna una lista di dict ordinata per gruppo e passo
+
+    """
+
+    if group_by not in GRUPPI:
+        raise ValueError(f"Raggruppamento non valido: {group_by}")
+
+    colonne = {
+        "stage": db.literal("tutti"),
+        "vm_type": VmType.name + " (" + db.cast(VmType.disk, db.String) + " GB)",
+        "node": ProvisioningStage.node,
+    }
+
+    righe = db.session.execute(
+        db.select(colonne[group_by], ProvisioningStage.stage, ProvisioningStage.status, ProvisioningStage.duration_s)
+        .join(VmRequest, ProvisioningStage.vm_request_id == VmRequest.id)
+        .join(VmType, VmRequest.vm_type_id == VmType.id)
+        .where(ProvisioningStage.start_ts >= since)
+    ).all()
+
+    durate = {}
+    for gruppo, name, status, duration_s in righe:
+        entry = durate.setdefault((gruppo or "-", name), {"valori": [], "falliti": 0})
+        entry["valori"].append(duration_s)
+        if status != "OK":
+            entry["falliti"] += 1
+
+    stats = []
+    for (gruppo, name), entry in sorted(durate.items(), key=lambda kv: (kv[0][0], _ordine(kv[0][1]), kv[0][1])):
+        valori = sorted(entry["valori"])
+        stats.append({
+            "gruppo": gruppo,
+            "stage": name,
+            "count": len(valori),
+            "failed": entry["falliti"],
+            "p50": percentile(valori, 50),
+            "p95": percentile(valori, 95),
+            "p99": percentile(valori, 99),
+            "max": valori[-1],
+        })
+    return stats
@@ -0,0 +1,99 @@
+# utils/versions.py
+import hashlib
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from model.connection import db
+from model.model import TableVersion, VERSIONED_TABLES
+from utils.jobs import utcnow
+
+
+_versions = TableVersion.__table__
+
+
+def _bump(connection, tables: set) -> None:
+    # UPDATE sulla stessa connessione (e transazione) delle modifiche: il contatore cambia solo se il commit riesce
+    # (tabelle in ordine fisso, così due transazioni bloccano le righe dei contatori sempre nello stesso ordine)
+    connection.execute(
+        _versions.update()
+        .where(_versions.c.table_name.in_(sorted(tables)))
+        .values(version=_versions.c.version + 1, change_ts=utcnow())
+    )
+
+
+def _modified(session: Session) -> set:
+    # tabelle con contatore modificate dalla transazione in corso, incrementate al commit
+    return session.info.setdefault("versioned_tables", set())
+
+
+# modifiche fatte tramite oggetti ORM (insert, update, delete, ruoli di un utente)
+@event.listens_for(Session, "after_flush")
+def _collect_on_flush(session, flush_context):
+    tables = set()
+    for obj in session.new:
+        tables.add(obj.__table__.name)
+    for obj in session.dirty:
+        if session.is_modified(obj):
+            tables.add(obj.__table__.name)
+    for obj in session.deleted:
+        tables.add(obj.__table__.name)
+
+    _modified(session).update(tables & set(VERSIONED_TABLES))
+
+
+# modifiche fatte con db.update()/db.delete() sui modelli (es. enqueue_provisioning):
+# conta solo se l'istruzione ha toccato almeno una riga (un UPDATE condizionale a vuoto non cambia gli ETag)
+@event.listens_for(Session, "do_orm_execute")
+def _collect_on_execute(orm_execute_state):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert):
+        return None
+    table = getattr(orm_execute_state.statement, "table", None)
+    if table is None or table.name not in VERSIONED_TABLES:
+        return None
+
+    result = orm_execute_state.invoke_statement()
+    # rowcount non disponibile (-1, alcuni driver con RETURNING): si considera modificata
+    if getattr(result, "rowcount", -1) != 0:
+        _modified(orm_execute_state.session).add(table.name)
+    return result
+
+
+# i contatori si incrementano solo alla fine della transazione, appena prima del COMMIT:
+# la riga di table_version resta bloccata (Postgres) per la durata del commit e non per tutto il lavoro
+@event.listens_for(Session, "before_commit")
+def _bump_on_commit(session):
+    # flush delle ultime modifiche prima del conteggio (il commit lo farebbe dopo questo evento)
+    session.flush()
+    tables = session.info.pop("versioned_tables", None)
+    if tables:
+        _bump(session.connection(), tables)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_on_rollback(session):
+    session.info.pop("versioned_tables", None)
+
+
+def table_versions(*tables) -> dict:
+
+    """
+    Versione e ora dell'ultima modifica delle tabelle indicate, con una sola query sulla tabella dei contatori
+    Ritorna {tabella: (versione, change_ts)}
+
+    """
+
+    righe = db.session.execute(
+        db.select(_versions.c.table_name, _versions.c.version, _versions.c.change_ts)
+        .where(_versions.c.table_name.in_(tables))
+    ).all()
+    return {name: (version, change_ts) for name, version, change_ts in righe}
+
+
+def etag_for(versions: dict, *scope) -> str:
+    """ETag forte dalle versioni delle tabelle e da ciò che distingue la risposta (URL, utente, ...)."""
+    chiave = "|".join([f"{name}:{versions[name][0]}" for name in sorted(versions)] + [str(s) for s in scope])
+    return hashlib.sha1(chiave.encode()).hexdigest()[:32]
+
+
+def last_modified(versions: dict):
+    """Ora dell'ultima modifica tra le tabelle indicate (None se non ci sono contatori)."""
+    return max((ts for _, ts in versions.values()), default=None)
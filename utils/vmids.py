@@ -0,0 +1,222 @@
+# utils/vmids.py
+import os, logging
+from datetime import timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy.exc import IntegrityError
+
+from model.connection import db
+from model.model import VmidReservation
+from utils.jobs import utcnow, LEASE_S
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# intervallo dei vmid assegnati dal portale
+VMID_MIN = int(os.getenv("PORTAL_VMID_MIN", "1000"))
+VMID_MAX = int(os.getenv("PORTAL_VMID_MAX", "99999"))
+# un vmid rilasciato viene riusato solo dopo questo tempo (la distruzione su Proxmox è asincrona)
+REUSE_AFTER_S = int(os.getenv("PORTAL_VMID_REUSE_S", "300"))
+# le prenotazioni più giovani di così non vengono mai rilasciate dalla riconciliazione (clone ancora in corso)
+RECONCILE_GRACE_S = int(os.getenv("PORTAL_VMID_GRACE_S", str(LEASE_S)))
+
+# tentativi di inserimento di un vmid nuovo prima di dichiarare l'intervallo conteso/esaurito
+_MAX_TENTATIVI = 100
+
+
+def _cluster_vmids() -> set:
+    # vmid esistenti nel cluster dalla fotografia in cache (nessuna chiamata API se è fresca)
+    from utils.cluster import cluster_snapshot
+    try:
+        return set(cluster_snapshot().guests)
+    except Exception:
+        logger.exception("Fotografia del cluster non disponibile, vmid controllati solo sul DB")
+        return set()
+
+
+def _reuse(esistenti: set, node: str, vm_request_id: int):
+    limite = utcnow() - timedelta(seconds=REUSE_AFTER_S)
+    candidati = db.session.execute(
+        db.select(VmidReservation.vmid)
+        .where(VmidReservation.status == "RELEASED", VmidReservation.release_ts < limite,
+               VmidReservation.vmid.between(VMID_MIN, VMID_MAX))
+        .order_by(VmidReservation.release_ts)
+        .limit(20)
+    ).scalars().all()
+
+    for vmid in candidati:
+        if vmid in esistenti:
+            continue
+        # riuso di un vmid rilasciato: vince il primo che aggiorna la riga
+        res = db.session.execute(
+            db.update(VmidReservation)
+            .where(VmidReservation.vmid == vmid, VmidReservation.status == "RELEASED")
+            .values(status="RESERVED", node=node, vm_request_id=vm_request_id, lease_ts=utcnow(), release_ts=None)
+        )
+        db.session.commit()
+        if res.rowcount == 1:
+            return vmid
+    return None
+
+
+def _new(esistenti: set, node: str, vm_request_id: int):
+    ultimo = db.session.execute(
+        db.select(db.func.max(VmidReservation.vmid)).where(VmidReservation.vmid.between(VMID_MIN, VMID_MAX))
+    ).scalar()
+    vmid = (ultimo or VMID_MIN - 1) + 1
+
+    for _ in range(_MAX_TENTATIVI):
+        while vmid in esistenti:
+            vmid += 1
+        if vmid > VMID_MAX:
+            return None
+
+        # vmid mai usato: la chiave primaria evita doppie prenotazioni, chi perde prova il successivo
+        db.session.add(VmidReservation(vmid=vmid, node=node, vm_request_id=vm_request_id, status="RESERVED",
+                                       lease_ts=utcnow()))
+        try:
+            db.session.commit()
+            return vmid
+        except IntegrityError:
+            db.session.rollback()
+            vmid += 1
+    return None
+
+
+def reserve_vmid(node: str = None, vm_request_id: int = None) -> int:
+
+    """
+    Riserva un vmid libero per un nuovo container, senza chiamare cluster/nextid.
+    Prima riusa un vmid rilasciato da almeno REUSE_AFTER_S, altrimenti prende il successivo
+    al più alto già riservato nell'intervallo PORTAL_VMID_MIN..PORTAL_VMID_MAX.
+    I vmid presenti nel cluster (fotografia in cache) vengono saltati, quindi anche i container
+    creati fuori dal portale. Più provisioning in parallelo ricevono sempre vmid diversi.
+    Se l'intervallo è pieno rilascia le prenotazioni dei container non più esistenti e riprova
+    Ritorna il vmid riservato
+
+    """
+
+    for tentativo in range(2):
+        esistenti = _cluster_vmids()
+        vmid = _reuse(esistenti, node, vm_request_id) or _new(esistenti, node, vm_request_id)
+        if vmid:
+            return vmid
+
+        if tentativo == 0:
+            from utils.proxmox import proxmox_client
+            reconcile_vmids(proxmox_client())
+
+    raise RuntimeError(f"Nessun vmid libero tra {VMID_MIN} e {VMID_MAX}")
+
+
+def vmid_reserved_for(vmid: int, vm_request_id: int) -> bool:
+    """True se il vmid è ancora prenotato (o in uso) per la richiesta, cioè non è stato rilasciato nel frattempo."""
+    return db.session.execute(
+        db.select(VmidReservation.vmid)
+        .where(VmidReservation.vmid == vmid, VmidReservation.vm_request_id == vm_request_id,
+               VmidReservation.status != "RELEASED")
+    ).first() is not None
+
+
+def mark_vmid_in_use(vmid: int, node: str = None) -> None:
+    """Il clone è riuscito: il vmid è di un container esistente."""
+    values = dict(status="IN_USE")
+    if node:
+        values["node"] = node
+    db.session.execute(db.update(VmidReservation).where(VmidReservation.vmid == vmid).values(**values))
+    db.session.commit()
+
+
+def mark_vmid_foreign(vmid: int) -> None:
+
+    """
+    Il vmid riservato è già usato da un container creato fuori dal portale dopo l'ultima fotografia:
+    resta occupato (IN_USE, senza richiesta) finché la riconciliazione non lo trova eliminato
+
+    """
+
+    db.session.execute(
+        db.update(VmidReservation).where(VmidReservation.vmid == vmid).values(status="IN_USE", vm_request_id=None)
+    )
+    db.session.commit()
+
+
+def release_vmid(vmid: int) -> int:
+
+    """
+    Rilascia il vmid di un container eliminato: potrà essere riusato dopo REUSE_AFTER_S
+    Ritorna il numero di prenotazioni rilasciate
+
+    """
+
+    res = db.session.execute(
+        db.update(VmidReservation)
+        .where(VmidReservation.vmid == vmid, VmidReservation.status != "RELEASED")
+        .values(status="RELEASED", release_ts=utcnow())
+    )
+    db.session.commit()
+    return res.rowcount
+
+
+def reconcile_vmids(proxmox, grace_s: int = RECONCILE_GRACE_S) -> int:
+
+    """
+    Rilascia i vmid dei container che non esistono più nel cluster (eliminati o clone falliti)
+    Le prenotazioni più giovani di grace_s vengono lasciate stare (clone ancora in corso)
+    Ritorna il numero di vmid rilasciati
+
+    """
+
+    esistenti = {int(r["vmid"]) for r in proxmox.cluster.resources.get(type="vm") if "vmid" in r}
+    limite = utcnow() - timedelta(seconds=grace_s)
+
+    orfani = [
+        vmid for vmid in db.session.execute(
+            db.select(VmidReservation.vmid).where(VmidReservation.status != "RELEASED", VmidReservation.lease_ts < limite)
+        ).scalars()
+        if vmid not in esistenti
+    ]
+    if not orfani:
+        return 0
+
+    res = db.session.execute(
+        db.update(VmidReservation)
+        .where(VmidReservation.vmid.in_(orfani), VmidReservation.status != "RELEASED")
+        .values(status="RELEASED", release_ts=utcnow())
+    )
+    db.session.commit()
+    logger.info("VMID: rilasciati %s vmid di container non più esistenti", res.rowcount)
+    return res.rowcount
+
+
+# comandi "flask vmid ...": prenotazioni dei vmid
+@click.group("vmid")
+def vmid_command() -> None:
+    pass
+
+
+@vmid_command.command("list")
+@with_appcontext
+def vmid_list_command() -> None:
+    righe = db.session.execute(
+        db.select(VmidReservation.status, db.func.count()).group_by(VmidReservation.status)
+    ).all()
+    click.echo(f"intervallo {VMID_MIN}..{VMID_MAX}, riuso dopo {REUSE_AFTER_S}s")
+    for status, n in righe:
+        click.echo(f"{status}: {n}")
+
+
+@vmid_command.command("release")
+@click.argument("vmid", type=int)
+@with_appcontext
+def vmid_release_command(vmid: int) -> None:
+    click.echo(f"{release_vmid(vmid)} vmid rilasciati")
+
+
+@vmid_command.command("reconcile")
+@with_appcontext
+def vmid_reconcile_command() -> None:
+    from utils.proxmox import proxmox_client
+    click.echo(f"{reconcile_vmids(proxmox_client())} vmid rilasciati")
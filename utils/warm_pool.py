@@ -0,0 +1,355 @@
+# utils/warm_pool.py
+import os, threading, logging
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from model.connection import db
+from model.model import VmType, VmRequest, WarmContainer, VmidReservation
+from utils.jobs import utcnow, LEASE_S
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# avvia il gestore del pool insieme al server: disattivato di default, va attivato (1) in un solo processo
+# (oppure "flask pool run") perché il refill conta i container e poi clona, senza coordinarsi con altri processi
+POOL_MANAGER = os.getenv("PORTAL_POOL_MANAGER", "0") != "0"
+# ogni quanto il gestore controlla i pool (secondi)
+TICK_S = float(os.getenv("PORTAL_POOL_TICK_S", "15"))
+# numero massimo di container del pool in creazione contemporaneamente
+BUILDERS = int(os.getenv("PORTAL_POOL_BUILDERS", "2"))
+# creazioni fallite per tipo di VM oltre le quali il refill del tipo si ferma (template o nodo guasto)
+MAX_FAILURES = int(os.getenv("PORTAL_POOL_MAX_FAILURES", "3"))
+# finestra in cui si contano le creazioni fallite (secondi)
+FAILURE_WINDOW_S = int(os.getenv("PORTAL_POOL_FAILURE_WINDOW_S", "900"))
+
+_refill = threading.Event()
+
+
+def claim_warm_container(vm_type: VmType, req: VmRequest):
+
+    """
+    Assegna alla richiesta un container pronto del pool del tipo di VM.
+    L'assegnazione è un UPDATE condizionale (READY -> CLAIMED): due worker non
+    possono prendere lo stesso container.
+    Ritorna il container assegnato oppure None se il pool è vuoto
+
+    """
+
+    candidati = db.session.execute(
+        db.select(WarmContainer.id)
+        .where(WarmContainer.vm_type_id == vm_type.id, WarmContainer.status == "READY")
+        .order_by(WarmContainer.ready_ts)
+        .limit(5)
+    ).scalars().all()
+
+    for warm_id in candidati:
+        res = db.session.execute(
+            db.update(WarmContainer)
+            .where(WarmContainer.id == warm_id, WarmContainer.status == "READY")
+            .values(status="CLAIMED", vm_request_id=req.id, claimed_ts=utcnow())
+        )
+        db.session.commit()
+        if res.rowcount == 1:
+            # il pool è sceso sotto il target: anticipa il refill
+            _refill.set()
+            return db.session.get(WarmContainer, warm_id)
+
+    return None
+
+
+def build_warm_container(warm_id: int) -> None:
+
+    """
+    Crea un container del pool: clone, resize, configurazione, avvio e attesa di IP e SSH.
+    A fine creazione il container passa in "READY", in caso di errore in "FAILED"
+    e il container parzialmente creato viene eliminato (vmid e IP rilasciati).
+
+    """
+
+    # import qui per non caricare proxmoxer/paramiko finché non serve
+    from utils.proxmox import proxmox_client
+    from utils.ssh import wait_ssh_up
+    from utils.provisioning import build_container, BuildState, BOOTSTRAP_USER, BOOTSTRAP_PASS
+    from utils.timeline import stage
+
+    warm = db.session.get(WarmContainer, warm_id)
+    vm_type = warm.vm_type
+
+    def save(state):
+        # il vmid viene salvato appena riservato: serve per eliminare il container se la creazione fallisce
+        warm.vmid = state.vmid
+        warm.hostname = state.hostname
+        db.session.commit()
+
+    proxmox = None
+    try:
+        proxmox = proxmox_client()
+        vmid, hostname, ipv4 = build_container(proxmox, warm.node, vm_type, lambda vmid: f"warm-{vm_type.name}-{vmid}",
+                                               state=BuildState(save=save))
+
+        warm.vmid = vmid
+        warm.hostname = hostname
+        warm.ip_address = ipv4
+        db.session.commit()
+
+        # il container viene dato come pronto solo quando SSH risponde
+        with stage("ssh_wait"):
+            wait_ssh_up(ipv4, BOOTSTRAP_USER, BOOTSTRAP_PASS, timeout_s=240)
+
+        warm.status = "READY"
+        warm.ready_ts = utcnow()
+        db.session.commit()
+
+    except Exception as e:
+        logger.exception("Creazione del container del pool %s fallita", warm_id)
+        db.session.rollback()
+
+        warm = db.session.get(WarmContainer, warm_id)
+        warm.status = "FAILED"
+        warm.last_error = str(e) or e.__class__.__name__
+        db.session.commit()
+
+        if proxmox is not None:
+            discard_warm_container(proxmox, warm)
+
+
+def discard_warm_container(proxmox, warm: WarmContainer) -> bool:
+
+    """
+    Elimina da Proxmox il container di una creazione fallita e ne rilascia vmid e lease IP
+    Se l'eliminazione non riesce (es. clone ancora in corso) il vmid resta riservato e
+    il gestore del pool riprova al giro successivo
+    Ritorna True se non resta nulla da eliminare
+
+    """
+
+    from utils.proxmox import wait_task
+    from utils.vmids import release_vmid
+    from utils.ipam import release_ip
+
+    if warm.vmid is None:
+        return True
+
+    try:
+        # force: il container può essere già acceso; purge: toglie anche i riferimenti (backup, HA)
+        upid = proxmox.nodes(warm.node).lxc(warm.vmid).delete(force=1, purge=1)
+        if upid:
+            wait_task(proxmox, warm.node, upid, timeout_s=300)
+    except Exception as e:
+        if "does not exist" not in str(e):
+            logger.warning("Container %s del pool su %s non eliminato: %s", warm.vmid, warm.node, e)
+            return False
+
+    vmid = warm.vmid
+    # il vmid rilasciato potrà essere riusato: la riga del pool non lo tiene più
+    warm.vmid = None
+    db.session.commit()
+    release_ip(vmid=vmid)
+    release_vmid(vmid)
+    return True
+
+
+class PoolManager:
+
+    """
+    Mantiene per ogni tipo di VM il numero di container pronti indicato da VmType.pool_target,
+    senza superare VmType.pool_refill_per_min nuovi clone al minuto.
+    Le creazioni girano in un pool di thread separato (PORTAL_POOL_BUILDERS).
+
+    """
+
+    def __init__(self, app, builders: int = BUILDERS, tick_s: float = TICK_S):
+        self.app = app
+        self.tick_s = tick_s
+        self.builders = builders
+        self._executor = ThreadPoolExecutor(max_workers=builders, thread_name_prefix="warm-pool-builder")
+        self._in_corso = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # tipi di VM con il refill fermo per troppi fallimenti (per avvisare una volta sola)
+        self._fermi = set()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._loop, name="warm-pool-manager", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        _refill.set()
+        self._executor.shutdown(wait=False)
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    self.refill()
+            except Exception:
+                logger.exception("Errore nel gestore del pool")
+
+            _refill.wait(self.tick_s)
+            _refill.clear()
+
+    def refill(self) -> None:
+
+        """
+        Un giro di controllo dei pool: segna come falliti i container rimasti in
+        creazione oltre il lease, elimina i container delle creazioni fallite e avvia
+        i clone mancanti rispettando target e velocità. Un tipo di VM con almeno
+        PORTAL_POOL_MAX_FAILURES creazioni fallite nella finestra non viene riempito
+
+        """
+
+        from utils.placement import choose_node
+
+        now = utcnow()
+
+        # container rimasti in "CREATING" da un processo terminato
+        db.session.execute(
+            db.update(WarmContainer)
+            .where(WarmContainer.status == "CREATING", WarmContainer.add_ts < now - timedelta(seconds=LEASE_S))
+            .values(status="FAILED", last_error="Creazione interrotta")
+        )
+        db.session.commit()
+
+        self.cleanup_failed()
+
+        for vm_type in VmType.query.filter(VmType.pool_target > 0).all():
+            falliti = vm_type.warm_containers.filter(
+                WarmContainer.status == "FAILED", WarmContainer.add_ts >= now - timedelta(seconds=FAILURE_WINDOW_S)
+            ).count()
+            if falliti >= MAX_FAILURES:
+                if vm_type.id not in self._fermi:
+                    self._fermi.add(vm_type.id)
+                    logger.warning("Pool %s fermo: %s creazioni fallite negli ultimi %ss",
+                                   vm_type.name, falliti, FAILURE_WINDOW_S)
+                continue
+            self._fermi.discard(vm_type.id)
+
+            attivi = vm_type.warm_containers.filter(WarmContainer.status.in_(("CREATING", "READY"))).count()
+            recenti = vm_type.warm_containers.filter(WarmContainer.add_ts >= now - timedelta(minutes=1)).count()
+
+            with self._lock:
+                liberi = self.builders - self._in_corso
+
+            da_creare = min(vm_type.pool_target - attivi, vm_type.pool_refill_per_min - recenti, liberi)
+
+            for _ in range(max(da_creare, 0)):
+                warm = WarmContainer(vm_type_id=vm_type.id, node=choose_node(vm_type), status="CREATING", add_ts=now)
+                db.session.add(warm)
+                db.session.commit()
+
+                with self._lock:
+                    self._in_corso += 1
+                self._executor.submit(self._build, warm.id)
+
+    def cleanup_failed(self, limit: int = 10) -> int:
+
+        """
+        Elimina i container delle creazioni fallite il cui vmid è ancora riservato al pool
+        (eliminazione non riuscita al momento del fallimento o creazione interrotta)
+        Ritorna quanti ne sono stati eliminati
+
+        """
+
+        falliti = db.session.execute(
+            db.select(WarmContainer)
+            .join(VmidReservation, VmidReservation.vmid == WarmContainer.vmid)
+            .where(WarmContainer.status == "FAILED", VmidReservation.status != "RELEASED",
+                   VmidReservation.vm_request_id.is_(None))
+            .limit(limit)
+        ).scalars().all()
+        if not falliti:
+            return 0
+
+        from utils.proxmox import proxmox_client
+        proxmox = proxmox_client()
+        return sum(1 for warm in falliti if discard_warm_container(proxmox, warm))
+
+    def _build(self, warm_id: int) -> None:
+        try:
+            with self.app.app_context():
+                build_warm_container(warm_id)
+        finally:
+            with self._lock:
+                self._in_corso -= 1
+            _refill.set()
+
+
+def start_pool_manager(app):
+
+    """
+    Avvia il gestore del pool dentro al processo (solo con PORTAL_POOL_MANAGER=1, di default è disattivato).
+    Va avviato in un solo processo per non creare più container del necessario
+
+    """
+
+    if not POOL_MANAGER:
+        return None
+
+    manager = PoolManager(app)
+    manager.start()
+    app.extensions["warm_pool_manager"] = manager
+    return manager
+
+
+# comandi "flask pool ...": configurazione e stato dei pool per tipo di VM
+@click.group("pool")
+def pool_command() -> None:
+    pass
+
+
+@pool_command.command("run")
+@with_appcontext
+def pool_run_command() -> None:
+    # gestore del pool in un processo separato dal server web (al posto di PORTAL_POOL_MANAGER=1)
+    manager = PoolManager(current_app._get_current_object())
+    manager.start()
+    click.echo(f"Gestore del pool avviato, {manager.builders} creazioni in parallelo (CTRL+C per uscire)")
+
+    try:
+        while not manager._stop.wait(1):
+            pass
+    except KeyboardInterrupt:
+        manager.stop()
+
+
+@pool_command.command("config")
+@click.argument("vm_type_name")
+@click.option("--target", type=int, help="Container pronti da mantenere")
+@click.option("--rate", type=int, help="Nuovi clone al minuto")
+@with_appcontext
+def pool_config_command(vm_type_name: str, target: int, rate: int) -> None:
+    vm_type = VmType.query.filter_by(name=vm_type_name).first()
+    if not vm_type:
+        raise click.ClickException(f"Tipo VM {vm_type_name} non trovato")
+
+    if target is not None:
+        vm_type.pool_target = target
+    if rate is not None:
+        vm_type.pool_refill_per_min = rate
+    db.session.commit()
+    _refill.set()
+
+    click.echo(f"{vm_type.name}: target={vm_type.pool_target} refill={vm_type.pool_refill_per_min}/min")
+
+
+@pool_command.command("status")
+@with_appcontext
+def pool_status_command() -> None:
+    for vm_type in VmType.query.order_by(VmType.id).all():
+        conteggi = dict(
+            db.session.execute(
+                db.select(WarmContainer.status, db.func.count())
+                .where(WarmContainer.vm_type_id == vm_type.id)
+                .group_by(WarmContainer.status)
+            ).all()
+        )
+        click.echo(f"{vm_type.name}: target={vm_type.pool_target} refill={vm_type.pool_refill_per_min}/min "
+                   f"ready={conteggi.get('READY', 0)} creating={conteggi.get('CREATING', 0)} "
+                   f"claimed={conteggi.get('CLAIMED', 0)} failed={conteggi.get('FAILED', 0)}")